@@ -40,6 +40,7 @@ const fs = __importStar(require("fs"));
 const path = __importStar(require("path"));
 const child_process_1 = require("child_process");
 let ollamaProcess = null;
+let watcherProcess = null;
 function activate(context) {
     let generatedMessage = '';
     try {
@@ -133,6 +134,52 @@ function activate(context) {
                 }, 5000);
             });
         }
+        // Start the watcher that pre-generates the messages of staged files in the background
+        function startWatcher() {
+            watcherProcess = (0, child_process_1.spawn)(venvPython, ['src/watcher.py'], { cwd: repoPath });
+            watcherProcess.stderr.on('data', (data) => {
+                console.log(`[watcher]: ${data}`);
+            });
+        }
+        // The generations in progress, with the staged diff each one was started for
+        const runningGenerations = new Map();
+        // Read the staged diff of a file, or of all files
+        function readStagedDiff(file) {
+            return new Promise((resolve) => {
+                const args = file ? ['diff', '--cached', '--', file] : ['diff', '--cached'];
+                const diffProcess = (0, child_process_1.spawn)('git', args, { cwd: repoPath });
+                let diff = '';
+                diffProcess.stdout.on('data', (data) => {
+                    diff += data.toString();
+                });
+                diffProcess.on('close', () => resolve(diff));
+            });
+        }
+        // Keep track of a generation until its Python process exits
+        function trackGeneration(pyProcess, file, diff) {
+            const generation = { file, diff, cancelled: false };
+            runningGenerations.set(pyProcess, generation);
+            pyProcess.on('close', () => runningGenerations.delete(pyProcess));
+            return generation;
+        }
+        // Stop the generations of staged content that changed, runExtension.py cancels its requests to the model on SIGTERM
+        async function cancelStaleGenerations() {
+            for (const [pyProcess, generation] of runningGenerations) {
+                const diff = await readStagedDiff(generation.file);
+                if (diff !== generation.diff && runningGenerations.has(pyProcess)) {
+                    generation.cancelled = true;
+                    pyProcess.kill('SIGTERM');
+                }
+            }
+        }
+        // Staging or unstaging files rewrites the git index
+        const indexPath = path.join(repoPath, '.git', 'index');
+        fs.watchFile(indexPath, { interval: 500 }, (current, previous) => {
+            if (current.mtimeMs !== previous.mtimeMs && runningGenerations.size > 0) {
+                cancelStaleGenerations();
+            }
+        });
+        context.subscriptions.push({ dispose: () => fs.unwatchFile(indexPath) });
         // Create a helper function to pull the Mistral model via Ollama
         async function pullModel(repoPath) {
             return new Promise((resolve, reject) => {
@@ -195,28 +242,9 @@ function activate(context) {
                     if (!fileDiff.trim()) {
                         return resolve(); // no changes for this file
                     }
-                    const fewShotExamples = [
-                        'Fix null pointer exception in authentication',
-                        'Refactor logging setup for better traceability',
-                        'Improve API request handling to avoid timeouts'
-                    ].join('\n');
-                    // Create a file-specific prompt
-                    let prompt = `
-            You are an AI assistant designed to produce concise, descriptive commit messages for Git changes. 
-            Below are up to three examples of commit messages that previously touched upon the same code or files. 
-            Please note that the first example is more important and should influence your message the most. 
-            Use the style and context of these examples, prioritizing the first examples, to inspire a new commit message for the provided Git diff.  Do not include references to issue numbers or pull requests.  Do not surround with quotes.
-            Generate a concise one-sentence Git commit message for changes in a single file.
-            Examples of relevant commit messages:
-            ${fewShotExamples}
-            File: ${file}
-            Diff:
-            ${fileDiff}
-            Output:
-           - A short commit message (in one sentence) describing what changed and why, consistent with the style 
-            and context demonstrated by the above examples.`;
-                    // Spawn Python script for this prompt
-                    const pyProcess = (0, child_process_1.spawn)(venvPython, ['src/runExtension.py', '--output_txt', 'my_messages.txt'], { cwd: repoPath });
+                    // Spawn Python script for this file, it builds the per-file prompt and reuses the message the watcher pre-generated
+                    const pyProcess = (0, child_process_1.spawn)(venvPython, ['src/runExtension.py', '--output_txt', 'my_messages.txt', '--file', file], { cwd: repoPath });
+                    const generation = trackGeneration(pyProcess, file, fileDiff);
                     let generatedMessageForFile = '';
                     pyProcess.stdout.on('data', (data) => {
                         generatedMessageForFile += data.toString();
@@ -225,7 +253,10 @@ function activate(context) {
                         console.error(`[Python stderr for ${file}]: ${data}`);
                     });
                     pyProcess.on('close', async (pyCode) => {
-                        if (pyCode !== 0) {
+                        if (generation.cancelled) {
+                            vscode.window.showWarningMessage(`The staged changes of ${file} changed, its commit message generation was cancelled.`);
+                        }
+                        else if (pyCode !== 0) {
                             vscode.window.showErrorMessage(`Python script for ${file} exited with code ${pyCode}`);
                         }
                         else {
@@ -236,8 +267,8 @@ function activate(context) {
                         }
                         resolve();
                     });
-                    // Pass prompt to Python script via stdin
-                    pyProcess.stdin.write(prompt);
+                    // Pass the diff to Python script via stdin
+                    pyProcess.stdin.write(fileDiff);
                     pyProcess.stdin.end();
                 });
             });
@@ -341,29 +372,17 @@ function activate(context) {
                 });
             });
         }
-        async function runPythonScriptWithPipedDiff() {
+        // Generate the message of a single staged file. runExtension.py builds the per-file prompt from the diff and
+        // reuses the message the watcher pre-generated for the same staged content
+        async function runPythonScriptWithPipedDiff(file) {
             return new Promise((resolve, reject) => {
                 generatedMessage = '';
-                const fewShotExamples = [
-                    'Fix null pointer exception, changed variable a to b and removed redundant lines in authentication',
-                    'Refactor logging setup for better traceability',
-                    'Improve API request handling to avoid timeouts'
-                ].join('\n');
-                let diffCollected = `
-            You are an AI assistant designed to produce concise, descriptive commit messages for Git changes. 
-           Below are up to three examples of commit messages that previously touched upon the same code or files. 
-          Please note that the first example is more important and should influence your message the most. 
-          Use the style and context of these examples, prioritizing the first examples, to inspire a new commit message for the provided Git diff.  
-          Do not include references to issue numbers or pull requests.  Do not surround with quotes. Do not summarize. Point out specific changes in the code. 
-          Examples of relevant commit messages:
-          ${fewShotExamples}
-         Now here is the new Git diff for which you must generate a commit message:
-            `;
-                // A) Spawn 'git diff --cached'
-                const gitProcess = (0, child_process_1.spawn)('git', ['diff', '--cached'], { cwd: repoPath });
-                // B) Accumulate its stdout into diffCollected
+                // A) Spawn 'git diff --cached' for the file
+                const gitProcess = (0, child_process_1.spawn)('git', ['diff', '--cached', '--', file], { cwd: repoPath });
+                let stagedDiff = '';
+                // B) Accumulate its stdout into stagedDiff
                 gitProcess.stdout.on('data', (chunk) => {
-                    diffCollected += chunk.toString();
+                    stagedDiff += chunk.toString();
                 });
                 // Optionally capture errors
                 gitProcess.stderr.on('data', (errData) => {
@@ -376,23 +395,14 @@ function activate(context) {
                         return;
                     }
                     // Check if the diff is empty
-                    if (!diffCollected.trim()) {
+                    if (!stagedDiff.trim()) {
                         vscode.window.showWarningMessage('No staged changes found.');
                         resolve();
                         return;
                     }
-                    diffCollected += `
-            Output:
-           For each file change in the provided diff, produce a concise, one-sentence commit message.
-           Format:
-           - File: <filename>
-           Commit Message: <message>
-          Separate each file's message with a newline.`;
                     // D) Now spawn Python
-                    const pyProcess = (0, child_process_1.spawn)(venvPython, 
-                    // for example: ['src/runExtension.py', '--output_txt', 'my_messages.txt']
-                    // or any other arguments your script needs:
-                    ['src/runExtension.py', '--output_txt', 'my_messages.txt'], { cwd: repoPath });
+                    const pyProcess = (0, child_process_1.spawn)(venvPython, ['src/runExtension.py', '--output_txt', 'my_messages.txt', '--file', file], { cwd: repoPath });
+                    const generation = trackGeneration(pyProcess, file, stagedDiff);
                     // E) When Python writes to stdout, accumulate the generated message
                     pyProcess.stdout.on('data', (data) => {
                         //vscode.window.showInformationMessage(`Output: ${data}`);
@@ -404,7 +414,11 @@ function activate(context) {
                     });
                     // F) On Python close
                     pyProcess.on('close', async (pyCode) => {
-                        if (pyCode !== 0) {
+                        if (generation.cancelled) {
+                            vscode.window.showWarningMessage(`The staged changes of ${file} changed, its commit message generation was cancelled.`);
+                            resolve();
+                        }
+                        else if (pyCode !== 0) {
                             reject(new Error(`Python script exited with code ${pyCode}`));
                         }
                         else {
@@ -430,8 +444,8 @@ function activate(context) {
                             resolve();
                         }
                     });
-                    // G) Finally, write the collected diff to Python’s stdin
-                    pyProcess.stdin.write(diffCollected);
+                    // G) Finally, write the staged diff to Python’s stdin
+                    pyProcess.stdin.write(stagedDiff);
                     pyProcess.stdin.end();
                 });
             });
@@ -477,7 +491,7 @@ function activate(context) {
                 }
                 else if (changedFiles.length === 1) {
                     console.log("Single file changed. Using runPythonScriptWithPipedDiff...");
-                    await runPythonScriptWithPipedDiff();
+                    await runPythonScriptWithPipedDiff(changedFiles[0]);
                 }
                 else {
                     console.log("Multiple files changed. Processing each file separately...");
@@ -492,6 +506,10 @@ function activate(context) {
                     vscode.window.showErrorMessage('Unknown error processing diffs.');
                 }
             }
+            // The watcher starts after the first generation, which fills the message cache itself, so the staged files
+            // are not generated twice at the same time
+            console.log("Starting the staged changes watcher...");
+            startWatcher();
         })().catch((error) => {
             vscode.window.showErrorMessage(`Extension activation error: ${error.message}`);
         });
@@ -517,5 +535,9 @@ function deactivate() {
         console.log('Stopping Ollama server...');
         ollamaProcess.kill();
     }
+    if (watcherProcess) {
+        console.log('Stopping the staged changes watcher...');
+        watcherProcess.kill();
+    }
 }
 //# sourceMappingURL=extension.js.map
\ No newline at end of file
@@ -4,6 +4,7 @@ import * as path from 'path';
 import { spawn , ChildProcessWithoutNullStreams} from 'child_process';
 
 let ollamaProcess: ChildProcessWithoutNullStreams | null = null;
+let watcherProcess: ChildProcessWithoutNullStreams | null = null;
 
 export function activate(context: vscode.ExtensionContext) {
     let generatedMessage = '';
@@ -120,6 +121,64 @@ export function activate(context: vscode.ExtensionContext) {
             });
         }
         
+        // Start the watcher that pre-generates the messages of staged files in the background
+        function startWatcher(): void {
+            watcherProcess = spawn(venvPython, ['src/watcher.py'], { cwd: repoPath });
+            
+            watcherProcess.stderr.on('data', (data) => {
+                console.log(`[watcher]: ${data}`);
+            });
+        }
+        
+        // The generations in progress, with the staged diff each one was started for
+        type Generation = { file: string | null; diff: string; cancelled: boolean };
+        const runningGenerations = new Map<ChildProcessWithoutNullStreams, Generation>();
+        
+        // Read the staged diff of a file, or of all files
+        function readStagedDiff(file: string | null): Promise<string> {
+            return new Promise((resolve) => {
+                const args = file ? ['diff', '--cached', '--', file] : ['diff', '--cached'];
+                const diffProcess = spawn('git', args, { cwd: repoPath });
+                let diff = '';
+                
+                diffProcess.stdout.on('data', (data) => {
+                    diff += data.toString();
+                });
+                diffProcess.on('close', () => resolve(diff));
+            });
+        }
+        
+        // Keep track of a generation until its Python process exits
+        function trackGeneration(pyProcess: ChildProcessWithoutNullStreams, file: string | null, diff: string): Generation {
+            const generation = { file, diff, cancelled: false };
+            
+            runningGenerations.set(pyProcess, generation);
+            pyProcess.on('close', () => runningGenerations.delete(pyProcess));
+            
+            return generation;
+        }
+        
+        // Stop the generations of staged content that changed, runExtension.py cancels its requests to the model on SIGTERM
+        async function cancelStaleGenerations(): Promise<void> {
+            for (const [pyProcess, generation] of runningGenerations) {
+                const diff = await readStagedDiff(generation.file);
+                
+                if (diff !== generation.diff && runningGenerations.has(pyProcess)) {
+                    generation.cancelled = true;
+                    pyProcess.kill('SIGTERM');
+                }
+            }
+        }
+        
+        // Staging or unstaging files rewrites the git index
+        const indexPath = path.join(repoPath, '.git', 'index');
+        fs.watchFile(indexPath, { interval: 500 }, (current, previous) => {
+            if (current.mtimeMs !== previous.mtimeMs && runningGenerations.size > 0) {
+                cancelStaleGenerations();
+            }
+        });
+        context.subscriptions.push({ dispose: () => fs.unwatchFile(indexPath) });
+        
         // Create a helper function to pull the Mistral model via Ollama
         async function pullModel(repoPath: string): Promise<void> {
             return new Promise((resolve, reject) => {
@@ -192,34 +251,13 @@ export function activate(context: vscode.ExtensionContext) {
                         return resolve(); // no changes for this file
                     }
                     
-                    const fewShotExamples = [
-                        'Fix null pointer exception in authentication',
-                        'Refactor logging setup for better traceability',
-                        'Improve API request handling to avoid timeouts'
-                    ].join('\n');
-                    
-                    // Create a file-specific prompt
-                    let prompt = `
-            You are an AI assistant designed to produce concise, descriptive commit messages for Git changes. 
-            Below are up to three examples of commit messages that previously touched upon the same code or files. 
-            Please note that the first example is more important and should influence your message the most. 
-            Use the style and context of these examples, prioritizing the first examples, to inspire a new commit message for the provided Git diff.  Do not include references to issue numbers or pull requests.  Do not surround with quotes.
-            Generate a concise one-sentence Git commit message for changes in a single file.
-            Examples of relevant commit messages:
-            ${fewShotExamples}
-            File: ${file}
-            Diff:
-            ${fileDiff}
-            Output:
-           - A short commit message (in one sentence) describing what changed and why, consistent with the style 
-            and context demonstrated by the above examples.`;
-                    
-                    // Spawn Python script for this prompt
+                    // Spawn Python script for this file, it builds the per-file prompt and reuses the message the watcher pre-generated
                     const pyProcess = spawn(
                         venvPython,
-                        ['src/runExtension.py', '--output_txt', 'my_messages.txt'],
+                        ['src/runExtension.py', '--output_txt', 'my_messages.txt', '--file', file],
                         { cwd: repoPath }
                     );
+                    const generation = trackGeneration(pyProcess, file, fileDiff);
                     
                     let generatedMessageForFile = '';
                     
@@ -232,7 +270,9 @@ export function activate(context: vscode.ExtensionContext) {
                     });
                     
                     pyProcess.on('close', async(pyCode) => {
-                        if (pyCode !== 0) {
+                        if (generation.cancelled) {
+                            vscode.window.showWarningMessage(`The staged changes of ${file} changed, its commit message generation was cancelled.`);
+                        } else if (pyCode !== 0) {
                             vscode.window.showErrorMessage(`Python script for ${file} exited with code ${pyCode}`);
                         } else {
                             const trimmedMessage = generatedMessageForFile.trim();
@@ -245,8 +285,8 @@ export function activate(context: vscode.ExtensionContext) {
                         resolve();
                     });
                     
-                    // Pass prompt to Python script via stdin
-                    pyProcess.stdin.write(prompt);
+                    // Pass the diff to Python script via stdin
+                    pyProcess.stdin.write(fileDiff);
                     pyProcess.stdin.end();
                 });
             });
@@ -364,32 +404,19 @@ export function activate(context: vscode.ExtensionContext) {
             });
         }
         
-        async function runPythonScriptWithPipedDiff(): Promise<void> {
+        // Generate the message of a single staged file. runExtension.py builds the per-file prompt from the diff and
+        // reuses the message the watcher pre-generated for the same staged content
+        async function runPythonScriptWithPipedDiff(file: string): Promise<void> {
             return new Promise((resolve, reject) => {
                 generatedMessage = '';
-                const fewShotExamples = [
-                    'Fix null pointer exception, changed variable a to b and removed redundant lines in authentication',
-                    'Refactor logging setup for better traceability',
-                    'Improve API request handling to avoid timeouts'
-                ].join('\n');
                 
-                let diffCollected = `
-            You are an AI assistant designed to produce concise, descriptive commit messages for Git changes. 
-           Below are up to three examples of commit messages that previously touched upon the same code or files. 
-          Please note that the first example is more important and should influence your message the most. 
-          Use the style and context of these examples, prioritizing the first examples, to inspire a new commit message for the provided Git diff.  
-          Do not include references to issue numbers or pull requests.  Do not surround with quotes. Do not summarize. Point out specific changes in the code. 
-          Examples of relevant commit messages:
-          ${fewShotExamples}
-         Now here is the new Git diff for which you must generate a commit message:
-            `;
+                // A) Spawn 'git diff --cached' for the file
+                const gitProcess = spawn('git', ['diff', '--cached', '--', file], { cwd: repoPath });
+                let stagedDiff = '';
                 
-                // A) Spawn 'git diff --cached'
-                const gitProcess = spawn('git', ['diff', '--cached'], { cwd: repoPath });
-                
-                // B) Accumulate its stdout into diffCollected
+                // B) Accumulate its stdout into stagedDiff
                 gitProcess.stdout.on('data', (chunk) => {
-                    diffCollected += chunk.toString();
+                    stagedDiff += chunk.toString();
                 });
                 
                 // Optionally capture errors
@@ -404,28 +431,19 @@ export function activate(context: vscode.ExtensionContext) {
                         return;
                     }
                     // Check if the diff is empty
-                    if (!diffCollected.trim()) {
+                    if (!stagedDiff.trim()) {
                         vscode.window.showWarningMessage('No staged changes found.');
                         resolve();
                         return;
                     }
                     
-                    diffCollected += `
-            Output:
-           For each file change in the provided diff, produce a concise, one-sentence commit message.
-           Format:
-           - File: <filename>
-           Commit Message: <message>
-          Separate each file's message with a newline.`;
-                    
                     // D) Now spawn Python
                     const pyProcess = spawn(
                         venvPython,
-                        // for example: ['src/runExtension.py', '--output_txt', 'my_messages.txt']
-                        // or any other arguments your script needs:
-                        ['src/runExtension.py', '--output_txt', 'my_messages.txt'],
+                        ['src/runExtension.py', '--output_txt', 'my_messages.txt', '--file', file],
                         { cwd: repoPath }
                     );
+                    const generation = trackGeneration(pyProcess, file, stagedDiff);
                     
                     // E) When Python writes to stdout, accumulate the generated message
                     pyProcess.stdout.on('data', (data) => {
@@ -440,7 +458,10 @@ export function activate(context: vscode.ExtensionContext) {
                     
                     // F) On Python close
                     pyProcess.on('close', async(pyCode) => {
-                        if (pyCode !== 0) {
+                        if (generation.cancelled) {
+                            vscode.window.showWarningMessage(`The staged changes of ${file} changed, its commit message generation was cancelled.`);
+                            resolve();
+                        } else if (pyCode !== 0) {
                             reject(new Error(`Python script exited with code ${pyCode}`));
                         } else {
                             console.log('Full generated message for a single file:', generatedMessage.trim());
@@ -465,8 +486,8 @@ export function activate(context: vscode.ExtensionContext) {
                         }
                     });
                     
-                    // G) Finally, write the collected diff to Python’s stdin
-                    pyProcess.stdin.write(diffCollected);
+                    // G) Finally, write the staged diff to Python’s stdin
+                    pyProcess.stdin.write(stagedDiff);
                     pyProcess.stdin.end();
                 });
             });
@@ -524,7 +545,7 @@ export function activate(context: vscode.ExtensionContext) {
                     vscode.window.showWarningMessage('No staged changes found.');
                 }     else if (changedFiles.length === 1) {
                     console.log("Single file changed. Using runPythonScriptWithPipedDiff...");
-                    await runPythonScriptWithPipedDiff();
+                    await runPythonScriptWithPipedDiff(changedFiles[0]);
                 } else {
                     console.log("Multiple files changed. Processing each file separately...");
                     await processChangedFiles();
@@ -537,6 +558,11 @@ export function activate(context: vscode.ExtensionContext) {
                 }
             }
             
+            // The watcher starts after the first generation, which fills the message cache itself, so the staged files
+            // are not generated twice at the same time
+            console.log("Starting the staged changes watcher...");
+            startWatcher();
+            
             
             
         })().catch((error) => {
@@ -566,4 +592,8 @@ export function deactivate() {
         console.log('Stopping Ollama server...');
         ollamaProcess.kill();
     }
+    if (watcherProcess) {
+        console.log('Stopping the staged changes watcher...');
+        watcherProcess.kill();
+    }
 }
@@ -1,6 +1,13 @@
+import argparse
 from itertools import groupby
+import os
+import sys
 import pandas as pd
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+from profiling import add_profile_arguments, span, start_profiling, stop_profiling
+from post_processing.significance import CONFIG, METRICS, Significance, read_scores
+
 MODEL_NAME = {
     "codellama": "CodeLlama 6.7B",
     "mistral": "Mistral 7B",
@@ -9,16 +16,65 @@ MODEL_NAME = {
 
 class Table:
     df: pd.DataFrame
-
-    def __init__(self, filename: str):
-        self.df = pd.read_csv(filename)
+    significance: Significance|None = None
+    alpha: float
+    # The rows shown in the table being generated, the best values are found among them
+    rows: list[int]
+
+    # With the scored items of every configuration, the cells get confidence intervals and significance markers
+    def __init__(self, filename: str, scores: str|None = None, alpha: float = 0.05, resamples: int = 10000):
+        with span("table.read", filename):
+            self.df = pd.read_csv(filename)
+        # The tables compare single sample runs, results from before --best_of have no best_of column
+        if 'best_of' not in self.df.columns:
+            self.df['best_of'] = 1
         self.value = ""
+        self.alpha = alpha
+        self.rows = list(range(len(self.df)))
+
+        if scores is not None:
+            with span("table.significance", scores):
+                self.significance = Significance(read_scores(scores), METRICS, resamples)
+
+    def config(self, i) -> tuple:
+        return tuple(self.df.iloc[i][CONFIG])
 
+    # Select the rows shown in the table
+    def select(self, keep) -> list[int]:
+        self.rows = [i for i in range(len(self.df)) if keep(self.df.iloc[i])]
+
+        return self.rows
+
+    # The best value of the shown rows is bold. With significance, the values that are not significantly worse than the
+    # best are bold too, the best is marked with a star when it is significantly better than all other shown rows, and
+    # the cell shows its interval.
     def style(self, i, key):
+        values = self.df[key].iloc[self.rows].to_numpy()
         val = self.df.iloc[i][key] * 100
-        max_val = self.df[key].max() * 100
+        max_val = values.max() * 100
+        is_best = abs(val - max_val) < 1e-12
+
+        if self.significance is None:
+            return rf"\textbf{{{val:.2f}}}" if is_best else f"{val:.2f}"
 
-        return rf"\textbf{{{val:.2f}}}" if abs(val - max_val) < 1e-12 else f"{val:.2f}"
+        metric = key.removesuffix('_mean')
+        best = self.config(self.rows[int(values.argmax())])
+        p_value = self.significance.p_value(metric, self.config(i), best)
+        interval = self.significance.interval(metric, self.config(i))
+
+        value = rf"\textbf{{{val:.2f}}}" if is_best or (p_value is not None and p_value >= self.alpha) else f"{val:.2f}"
+
+        if is_best and self.beats_all(metric, best):
+            value += r"$^{*}$"
+        if interval is not None:
+            value += rf" {{\scriptsize [{interval[0] * 100:.1f}, {interval[1] * 100:.1f}]}}"
+
+        return value
+
+    def beats_all(self, metric: str, best: tuple) -> bool:
+        p_values = [self.significance.p_value(metric, self.config(i), best) for i in self.rows if self.config(i) != best]
+
+        return all(p_value is None or p_value < self.alpha for p_value in p_values)
 
     def table_start(self, title: str, l: list[tuple[str, int]], c: list[tuple[str, int]], second_row: list[str] = []):
         self.value += r"\begin{table*}[ht]" + "\n"
@@ -72,14 +128,10 @@ class Table:
 
         last_model = None
 
-        for i in range(len(self.df)):
+        for i in self.select(lambda item: item["temperature"] == 0.7 and item["best_of"] == 1):
             item = self.df.iloc[i]
             model = item["model"]
             prompt = item["prompt"]
-            temperature = item["temperature"]
-
-            if temperature != 0.7:
-                continue
 
             row = ""
 
@@ -107,14 +159,10 @@ class Table:
 
         last_model = None
 
-        for i in range(len(self.df)):
+        for i in self.select(lambda item: item["temperature"] == 0.7 and item["best_of"] == 1):
             item = self.df.iloc[i]
             model = item["model"]
             prompt = item["prompt"]
-            temperature = item["temperature"]
-
-            if temperature != 0.7:
-                continue
 
             row = ""
 
@@ -141,14 +189,10 @@ class Table:
             ["", "BLEU", "METEOR", "ROUGE-L", "BLEU", "METEOR", "ROUGE-L"]
         )
 
-        for i in range(len(self.df)):
+        for i in self.select(lambda item: item["model"] == "mistral" and item["temperature"] in [0.0, 0.25, 0.5, 0.75, 1.0] and item["best_of"] == 1):
             item = self.df.iloc[i]
-            model = item["model"]
             temperature = item["temperature"]
 
-            if model != "mistral" or temperature not in [0.0, 0.25, 0.5, 0.75, 1.0]:
-                continue
-
             row = f"{temperature} & {self.style(i, 'bleu_mean')} & {self.style(i, 'meteor_mean')} & {self.style(i, 'rouge_l_mean')} & {self.style(i, 'cleaned_bleu_mean')} & {self.style(i, 'cleaned_meteor_mean')} & {self.style(i, 'cleaned_rouge_l_mean')} \\\\"
 
             self.value += row + "\n"
@@ -157,5 +201,29 @@ class Table:
 
         return self.value
 
+TABLES = {
+    "full": Table.generate_full_results,
+    "length": Table.generate_length_results,
+    "temperature": Table.generate_temperature_results,
+}
+
+parser = argparse.ArgumentParser(description="Generate the LaTeX tables of the evaluation results.")
+
+parser.add_argument("--file", type=str, default="evaluation_results.csv", help="The evaluation results file.")
+parser.add_argument("--table", type=str, default="temperature", choices=TABLES.keys(), help="The table to generate.")
+parser.add_argument("--scores", type=str, default=None, help="The scored items of all configurations (evaluation_results_all.csv), adds confidence intervals and significance markers.")
+parser.add_argument("--alpha", type=float, default=0.05, help="The significance level of the paired permutation tests.")
+parser.add_argument("--resamples", type=int, default=10000, help="The number of bootstrap resamples and permutations.")
+add_profile_arguments(parser)
+
 if __name__ == "__main__":
-    print(Table("evaluation_results.csv").generate_temperature_results())
+    args = parser.parse_args()
+    start_profiling(args)
+
+    table = Table(args.file, args.scores, args.alpha, args.resamples)
+
+    with span("table.generate", args.table):
+        print(TABLES[args.table](table))
+
+    stop_profiling(args, "data_to_table")
+
@@ -0,0 +1,627 @@
+import argparse
+import contextlib
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Hashable
+
+import ollama
+
+from cancellation import Cancelled, check_cancelled, current_token, with_token
+from stub_llm import StubProfile, StubResidency
+
+# Result of a single generation, together with the statistics reported by the backend (durations in seconds)
+class Generation:
+    text: str
+    prompt_tokens: int
+    completion_tokens: int
+    load_duration: float
+    prompt_duration: float
+    completion_duration: float
+    total_duration: float
+
+    def __init__(self, text: str, prompt_tokens: int = 0, completion_tokens: int = 0, load_duration: float = 0, prompt_duration: float = 0, completion_duration: float = 0, total_duration: float = 0):
+        self.text = text
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.load_duration = load_duration
+        self.prompt_duration = prompt_duration
+        self.completion_duration = completion_duration
+        self.total_duration = total_duration
+
+# The base class for all the engines that generate text for a model
+class Backend(ABC):
+    name: str = ""
+
+    # Generate a response for the prompt, the options use the Ollama option names (temperature, repeat_penalty, ...)
+    @abstractmethod
+    def generate(self, model: str, prompt: str, options: dict) -> Generation:
+        ...
+
+    # Generate several samples for the same prompt, by default as concurrent requests so a server with parallel slots
+    # evaluates the shared prompt once and decodes the samples side by side
+    def generate_n(self, model: str, prompt: str, options: dict, n: int) -> list[Generation]:
+        token = current_token()
+
+        with ThreadPoolExecutor(max_workers=n) as executor:
+            return list(executor.map(lambda index: with_token(token, self.generate, model, prompt, sample_options(options, index)), range(n)))
+
+    # Generate the prompt at several temperatures. The requests go one after the other, so after the first one the
+    # backend finds the evaluated prompt in its cache and only the first temperature pays for the prefill.
+    def generate_temperatures(self, model: str, prompt: str, options: dict, temperatures: list[float]) -> list[Generation]:
+        return [self.generate(model, prompt, {**options, "temperature": temperature}) for temperature in temperatures]
+
+    # Check if the model can be used with this backend
+    def check_installed(self, model: str) -> bool:
+        return True
+
+    # Load the model ahead of the first generation and return the time it took in seconds
+    def load(self, model: str) -> float:
+        return 0
+
+    # Unload the model to free the memory for the next one
+    def unload(self, model: str):
+        pass
+
+    # Release the resources held by the backend
+    def close(self):
+        pass
+
+    # Backend specific statistics shown at the end of a run
+    def report(self) -> str:
+        return ""
+
+    # Create the backend from the parsed command line arguments
+    @classmethod
+    def from_args(cls, args: argparse.Namespace) -> "Backend":
+        return cls()
+
+# The options of one of several samples, every sample gets its own seed so the samples differ and stay reproducible
+def sample_options(options: dict, index: int) -> dict:
+    return {**options, "seed": options.get("seed", 0) + index}
+
+# Registry of the available backends by name
+BACKENDS: dict[str, type[Backend]] = {}
+
+# Register a backend class so it can be selected with --backend
+def register_backend(cls: type[Backend]) -> type[Backend]:
+    BACKENDS[cls.name] = cls
+
+    return cls
+
+# Create the backend selected on the command line
+def create_backend(args: argparse.Namespace) -> Backend:
+    backend = BACKENDS[args.backend].from_args(args)
+
+    if args.no_coalesce:
+        return backend
+
+    return CoalescingBackend(backend)
+
+# Base class for backends that add behaviour around another backend, everything not overridden goes to the wrapped backend
+class BackendWrapper(Backend):
+    inner: Backend
+
+    def __init__(self, inner: Backend):
+        self.inner = inner
+        self.name = inner.name
+
+    def generate(self, model: str, prompt: str, options: dict) -> Generation:
+        return self.inner.generate(model, prompt, options)
+
+    def generate_n(self, model: str, prompt: str, options: dict, n: int) -> list[Generation]:
+        return self.inner.generate_n(model, prompt, options, n)
+
+    def generate_temperatures(self, model: str, prompt: str, options: dict, temperatures: list[float]) -> list[Generation]:
+        return self.inner.generate_temperatures(model, prompt, options, temperatures)
+
+    def check_installed(self, model: str) -> bool:
+        return self.inner.check_installed(model)
+
+    def load(self, model: str) -> float:
+        return self.inner.load(model)
+
+    def unload(self, model: str):
+        self.inner.unload(model)
+
+    def close(self):
+        self.inner.close()
+
+    def report(self) -> str:
+        return self.inner.report()
+
+# Lets concurrent calls with the same key share a single call, the callers arriving while it runs all get its result or its error
+class SingleFlight:
+    calls: dict[Hashable, Future]
+    lock: threading.Lock
+    started: int = 0
+    coalesced: int = 0
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key: Hashable, function: Callable):
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+
+            if leader:
+                future = Future()
+                self.calls[key] = future
+                self.started += 1
+            else:
+                self.coalesced += 1
+
+        # Another caller is already running the call
+        if not leader:
+            return future.result()
+
+        try:
+            future.set_result(function())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+        return future.result()
+
+# Sends identical concurrent requests, same model, prompt and options, to the wrapped backend once
+class CoalescingBackend(BackendWrapper):
+    flight: SingleFlight
+
+    def __init__(self, inner: Backend):
+        super().__init__(inner)
+        self.flight = SingleFlight()
+
+    def generate(self, model: str, prompt: str, options: dict) -> Generation:
+        key = (model, prompt, json.dumps(options, sort_keys=True))
+
+        return self.flight.do(key, lambda: self.inner.generate(model, prompt, options))
+
+    def generate_n(self, model: str, prompt: str, options: dict, n: int) -> list[Generation]:
+        key = (model, prompt, json.dumps(options, sort_keys=True), n)
+
+        return self.flight.do(key, lambda: self.inner.generate_n(model, prompt, options, n))
+
+    def report(self) -> str:
+        requests = self.flight.started + self.flight.coalesced
+        lines = [self.inner.report()] if self.inner.report() else []
+
+        if self.flight.coalesced > 0:
+            lines.append(f"Coalesced {self.flight.coalesced} of {requests} requests into identical in-flight requests")
+
+        return "\n".join(lines)
+
+# Add the arguments used to select and configure a backend
+def add_backend_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--backend", type=str, default="ollama", choices=BACKENDS.keys(), help="The engine used to generate messages.")
+    parser.add_argument("--host", type=str, default=None, help="The Ollama host to use (defaults to OLLAMA_HOST or localhost).")
+    parser.add_argument("--hosts", type=str, nargs="+", default=None, help="The Ollama hosts the balanced backend spreads the requests over.")
+    parser.add_argument("--health_interval", type=float, default=5, help="The seconds between health checks of the balanced backend.")
+    parser.add_argument("--model_path", type=str, default=None, help="The GGUF file to load with the llama_cpp backend (defaults to MODEL_PATH_<MODEL>).")
+    parser.add_argument("--n_ctx", type=int, default=4096, help="The context window of the llama_cpp backend.")
+    parser.add_argument("--n_threads", type=int, default=None, help="The number of CPU threads used by the llama_cpp backend.")
+    parser.add_argument("--n_batch", type=int, default=512, help="The prompt batch size of the llama_cpp backend.")
+    parser.add_argument("--n_gpu_layers", type=int, default=0, help="The number of layers the llama_cpp backend offloads to the GPU.")
+    parser.add_argument("--priority", type=str, default=None, choices=["interactive", "batch"], help="The priority class of the requests when Ollama runs behind scheduler.py (defaults to batch).")
+    parser.add_argument("--no_coalesce", action="store_true", help="Send identical concurrent requests separately instead of sharing one generation.")
+    StubProfile.add_arguments(parser, "stub_")
+
+# Convert a duration reported by Ollama in nanoseconds to seconds
+def ns_to_s(value: int|None) -> float:
+    return (value or 0) / 1e9
+
+# Generate using an Ollama server over HTTP
+@register_backend
+class OllamaBackend(Backend):
+    name: str = "ollama"
+    client: ollama.Client
+
+    # The priority is sent as the X-Priority header, the scheduler proxy uses it to serve interactive requests first
+    def __init__(self, host: str|None = None, priority: str|None = None):
+        self.client = ollama.Client(host=host, headers={"X-Priority": priority} if priority else None)
+
+    # The response is streamed so a cancelled generation can close the request between two tokens, Ollama stops
+    # generating once the connection is closed. The last message of the stream holds the statistics.
+    def generate(self, model: str, prompt: str, options: dict) -> Generation:
+        check_cancelled()
+
+        chunks = self.client.generate(model=model, prompt=prompt, options=options, stream=True)
+        text = ""
+        response = None
+
+        try:
+            for response in chunks:
+                check_cancelled()
+                text += response.response
+        finally:
+            chunks.close()
+
+        if response is None:
+            raise Exception(f"Ollama returned no response for {model}")
+
+        return Generation(
+            text,
+            response.prompt_eval_count or 0,
+            response.eval_count or 0,
+            ns_to_s(response.load_duration),
+            ns_to_s(response.prompt_eval_duration),
+            ns_to_s(response.eval_duration),
+            ns_to_s(response.total_duration)
+        )
+
+    def check_installed(self, model: str) -> bool:
+        try:
+            self.client.show(model)
+
+            return True
+        except:
+            return False
+
+    # An empty prompt makes Ollama load the model without generating
+    def load(self, model: str) -> float:
+        response = self.client.generate(model=model, prompt="")
+
+        return ns_to_s(response.load_duration)
+
+    def unload(self, model: str):
+        self.client.generate(model=model, prompt="", keep_alive=0)
+
+    @classmethod
+    def from_args(cls, args: argparse.Namespace) -> Backend:
+        return cls(args.host, args.priority)
+
+# Generate in-process with llama.cpp, every GGUF model is loaded once and kept for the whole run
+@register_backend
+class LlamaCppBackend(Backend):
+    name: str = "llama_cpp"
+    model_path: str|None
+    n_ctx: int
+    n_threads: int|None
+    n_batch: int
+    n_gpu_layers: int
+    prefix_cache: bool
+    llms: dict
+    lock: threading.Lock
+
+    # Environment variables holding the GGUF file of each model
+    MODEL_PATHS = {
+        "mistral": "MODEL_PATH_MISTRAL",
+        "codellama": "MODEL_PATH_CODELLAMA",
+        "phi3.5": "MODEL_PATH_PHI"
+    }
+
+    def __init__(self, model_path: str|None = None, n_ctx: int = 4096, n_threads: int|None = None, n_batch: int = 512, n_gpu_layers: int = 0, prefix_cache: bool = True):
+        self.model_path = model_path
+        self.n_ctx = n_ctx
+        self.n_threads = n_threads
+        self.n_batch = n_batch
+        self.n_gpu_layers = n_gpu_layers
+        self.prefix_cache = prefix_cache
+        self.llms = {}
+        # A llama.cpp context can only evaluate one sequence at a time
+        self.lock = threading.Lock()
+
+    # Find the GGUF file of a model
+    def get_model_path(self, model: str) -> str:
+        if self.model_path is not None:
+            return self.model_path
+
+        variable = self.MODEL_PATHS.get(model, f"MODEL_PATH_{model.upper()}")
+
+        if variable not in os.environ:
+            raise Exception(f"Missing environment variable: {variable}")
+
+        return os.environ[variable]
+
+    # Load the model on first use and keep it for all following generations
+    def get_llm(self, model: str):
+        if model not in self.llms:
+            from llama_cpp import Llama
+            from prefix_cache import enable_prefix_cache
+
+            llm = Llama(
+                model_path=self.get_model_path(model),
+                n_ctx=self.n_ctx,
+                n_threads=self.n_threads,
+                n_batch=self.n_batch,
+                n_gpu_layers=self.n_gpu_layers,
+                verbose=False
+            )
+
+            if self.prefix_cache:
+                enable_prefix_cache(llm)
+
+            self.llms[model] = llm
+
+        return self.llms[model]
+
+    def generate(self, model: str, prompt: str, options: dict) -> Generation:
+        with self.lock:
+            return self.complete(model, prompt, options)
+
+    # The samples are generated one after the other in the same context. llama.cpp keeps the evaluated tokens and only
+    # evaluates the part of a prompt after the longest prefix it already has, so only the first sample prefills the prompt.
+    def generate_n(self, model: str, prompt: str, options: dict, n: int) -> list[Generation]:
+        with self.lock:
+            return [self.complete(model, prompt, sample_options(options, index)) for index in range(n)]
+
+    # The lock is held for all temperatures, so no other prompt replaces the evaluated prompt in the context in between
+    def generate_temperatures(self, model: str, prompt: str, options: dict, temperatures: list[float]) -> list[Generation]:
+        with self.lock:
+            return [self.complete(model, prompt, {**options, "temperature": temperature}) for temperature in temperatures]
+
+    def complete(self, model: str, prompt: str, options: dict) -> Generation:
+        # The generation may have been cancelled while it waited for the lock
+        check_cancelled()
+
+        start = time.perf_counter()
+        llm = self.get_llm(model)
+        loaded = time.perf_counter()
+
+        # Stream the completion to separate the prefill time (until the first token) from the decoding time
+        chunks = llm.create_chat_completion(
+            messages=[{"role": "user", "content": prompt}],
+            temperature=options.get("temperature", 0.8),
+            repeat_penalty=options.get("repeat_penalty", 1.1),
+            max_tokens=options.get("num_predict"),
+            seed=options.get("seed"),
+            stream=True
+        )
+
+        text = ""
+        completion_tokens = 0
+        first_token = None
+
+        # Closing the stream of a cancelled generation ends the llama.cpp generation loop after the current token
+        try:
+            for chunk in chunks:
+                check_cancelled()
+                content = chunk["choices"][0]["delta"].get("content")
+
+                if content is None:
+                    continue
+                if first_token is None:
+                    first_token = time.perf_counter()
+
+                text += content
+                completion_tokens += 1
+        finally:
+            chunks.close()
+
+        end = time.perf_counter()
+
+        if first_token is None:
+            first_token = end
+
+        return Generation(
+            text,
+            max(llm.n_tokens - completion_tokens, 0),
+            completion_tokens,
+            loaded - start,
+            first_token - loaded,
+            end - first_token,
+            end - start
+        )
+
+    def check_installed(self, model: str) -> bool:
+        try:
+            return os.path.exists(self.get_model_path(model))
+        except Exception:
+            return False
+
+    def load(self, model: str) -> float:
+        with self.lock:
+            start = time.perf_counter()
+            self.get_llm(model)
+
+            return time.perf_counter() - start
+
+    def unload(self, model: str):
+        with self.lock:
+            self.llms.pop(model, None)
+
+    def close(self):
+        self.llms.clear()
+
+    @classmethod
+    def from_args(cls, args: argparse.Namespace) -> Backend:
+        return cls(args.model_path, args.n_ctx, args.n_threads, args.n_batch, args.n_gpu_layers)
+
+# Deterministic in-process stand-in for a model, with simulated latency and errors, used to measure the orchestration overhead
+@register_backend
+class StubBackend(Backend):
+    name: str = "stub"
+    profile: StubProfile
+    residency: StubResidency
+    slots: contextlib.AbstractContextManager
+
+    def __init__(self, profile: StubProfile|None = None):
+        self.profile = profile if profile is not None else StubProfile()
+        self.residency = StubResidency(self.profile.load_time)
+        self.slots = self.profile.slots()
+
+    def generate(self, model: str, prompt: str, options: dict) -> Generation:
+        with self.slots:
+            return self.generate_in_slot(model, prompt)
+
+    def generate_in_slot(self, model: str, prompt: str) -> Generation:
+        start = time.perf_counter()
+        load = self.residency.ensure_loaded(model)
+        text = ""
+        first_token = 0
+        tokens = 0
+
+        for token, elapsed in self.profile.stream(model, prompt):
+            check_cancelled()
+            first_token = elapsed if tokens == 0 else first_token
+            text += token
+            tokens += 1
+
+        total = time.perf_counter() - start
+
+        return Generation(text, len(prompt.split()), tokens, load, first_token, total - load - first_token, total)
+
+    def load(self, model: str) -> float:
+        return self.residency.ensure_loaded(model)
+
+    def unload(self, model: str):
+        self.residency.unload(model)
+
+    @classmethod
+    def from_args(cls, args: argparse.Namespace) -> Backend:
+        return cls(StubProfile.from_args(args, "stub_"))
+
+# One Ollama server behind the load balancer, with the requests it handled
+class Endpoint:
+    host: str
+    backend: OllamaBackend
+    outstanding: int = 0
+    healthy: bool = True
+    completed: int = 0
+    errors: int = 0
+    busy_time: float = 0
+    completion_tokens: int = 0
+    last_used: int = 0
+
+    def __init__(self, host: str, priority: str|None = None):
+        self.host = host
+        self.backend = OllamaBackend(host, priority)
+
+    # Check if the server responds, any answer counts as healthy
+    def check_health(self) -> bool:
+        try:
+            self.backend.client.list()
+            self.healthy = True
+        except Exception:
+            self.healthy = False
+
+        return self.healthy
+
+# Spreads the generations over several Ollama servers.
+# Every request goes to the healthy endpoint with the least outstanding requests, failed requests are retried on another
+# endpoint, and endpoints that cannot be reached are skipped until a background health check sees them again.
+@register_backend
+class LoadBalancedBackend(Backend):
+    name: str = "balanced"
+    endpoints: list[Endpoint]
+    health_interval: float
+    lock: threading.Lock
+    requests: int = 0
+    start_time: float
+    stopped: threading.Event
+
+    def __init__(self, hosts: list[str], health_interval: float = 5, priority: str|None = None):
+        if len(hosts) == 0:
+            raise ValueError("The balanced backend needs at least one host")
+
+        self.endpoints = [Endpoint(host, priority) for host in hosts]
+        self.health_interval = health_interval
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.stopped = threading.Event()
+
+        for endpoint in self.endpoints:
+            endpoint.check_health()
+
+        threading.Thread(target=self.run_health_checks, daemon=True).start()
+
+    def run_health_checks(self):
+        while not self.stopped.wait(self.health_interval):
+            for endpoint in self.endpoints:
+                endpoint.check_health()
+
+    # Reserve the endpoint with the least outstanding requests, preferring healthy endpoints and the least recently used on ties
+    def acquire(self, tried: set[str]) -> Endpoint:
+        with self.lock:
+            candidates = [endpoint for endpoint in self.endpoints if endpoint.host not in tried]
+            healthy = [endpoint for endpoint in candidates if endpoint.healthy]
+
+            if len(candidates) == 0:
+                raise Exception("All endpoints failed")
+
+            endpoint = min(healthy or candidates, key=lambda endpoint: (endpoint.outstanding, endpoint.last_used))
+
+            self.requests += 1
+            endpoint.outstanding += 1
+            endpoint.last_used = self.requests
+
+            return endpoint
+
+    def release(self, endpoint: Endpoint, duration: float, generation: Generation|None, failed: bool = True):
+        with self.lock:
+            endpoint.outstanding -= 1
+            endpoint.busy_time += duration
+
+            if generation is None:
+                if failed:
+                    endpoint.errors += 1
+            else:
+                endpoint.completed += 1
+                endpoint.completion_tokens += generation.completion_tokens
+
+    def generate(self, model: str, prompt: str, options: dict) -> Generation:
+        tried: set[str] = set()
+
+        while True:
+            endpoint = self.acquire(tried)
+            tried.add(endpoint.host)
+            start = time.time()
+
+            try:
+                generation = endpoint.backend.generate(model, prompt, options)
+                self.release(endpoint, time.time() - start, generation)
+
+                return generation
+            except Cancelled:
+                # Not a failure of the endpoint, and not worth another endpoint
+                self.release(endpoint, time.time() - start, None, failed=False)
+                raise
+            except ollama.ResponseError as e:
+                self.release(endpoint, time.time() - start, None)
+
+                # Invalid requests fail the same way everywhere, only server side errors are worth another endpoint
+                if 400 <= e.status_code < 500 and e.status_code != 404:
+                    raise
+                if len(tried) == len(self.endpoints):
+                    raise
+            except Exception:
+                self.release(endpoint, time.time() - start, None)
+                # The server could not be reached, skip it until the health check sees it again
+                endpoint.healthy = False
+
+                if len(tried) == len(self.endpoints):
+                    raise
+
+    def check_installed(self, model: str) -> bool:
+        return any(endpoint.backend.check_installed(model) for endpoint in self.endpoints if endpoint.healthy)
+
+    def load(self, model: str) -> float:
+        return max([endpoint.backend.load(model) for endpoint in self.endpoints if endpoint.healthy], default=0)
+
+    def unload(self, model: str):
+        for endpoint in self.endpoints:
+            if endpoint.healthy:
+                endpoint.backend.unload(model)
+
+    def close(self):
+        self.stopped.set()
+
+    # Per endpoint throughput since the backend was created
+    def report(self) -> str:
+        elapsed = time.time() - self.start_time
+        lines = []
+
+        for endpoint in self.endpoints:
+            lines.append(f"{endpoint.host}: {endpoint.completed} completed, {endpoint.errors} errors, {endpoint.completed / elapsed:.2f} items/s, {endpoint.completion_tokens / elapsed:.2f} tokens/s, busy {endpoint.busy_time:.2f}s ({'healthy' if endpoint.healthy else 'unhealthy'})")
+
+        return "\n".join(lines)
+
+    @classmethod
+    def from_args(cls, args: argparse.Namespace) -> Backend:
+        return cls(args.hosts or [args.host or "http://localhost:11434"], args.health_interval, args.priority)
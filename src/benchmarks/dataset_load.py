@@ -0,0 +1,66 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+from pandas import read_csv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dataset import Dataset, write_arrow
+
+# Benchmark loading a dataset from CSV against the memory-mapped Arrow file, for the full file,
+# for a projection on a few columns and for random lookups by hash.
+
+# Best time of a number of runs
+def best_time(function, repeat: int) -> float:
+    times = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+def benchmark(csv_file: str, columns: list[str], lookups: int, repeat: int):
+    with tempfile.TemporaryDirectory() as folder:
+        arrow_file = os.path.join(folder, os.path.basename(csv_file).replace(".csv", ".arrow"))
+        write_arrow(read_csv(csv_file), arrow_file)
+
+        hashes = random.Random(0).choices(read_csv(csv_file, usecols=["hash"])["hash"].tolist(), k=lookups)
+
+        def csv_lookups():
+            df = read_csv(csv_file).set_index("hash")
+            for hash in hashes:
+                df.loc[hash]
+
+        def arrow_lookups():
+            dataset = Dataset(arrow_file)
+            for hash in hashes:
+                dataset.get(hash)
+
+        results = [
+            ("full", best_time(lambda: read_csv(csv_file), repeat), best_time(lambda: Dataset(arrow_file).to_pandas(), repeat)),
+            (f"columns {','.join(columns)}", best_time(lambda: read_csv(csv_file, usecols=columns), repeat), best_time(lambda: Dataset(arrow_file).to_pandas(columns), repeat)),
+            (f"{lookups} lookups", best_time(csv_lookups, repeat), best_time(arrow_lookups, repeat)),
+        ]
+
+        print(f"{os.path.basename(csv_file)} ({os.path.getsize(csv_file) / 1e6:.1f} MB csv, {os.path.getsize(arrow_file) / 1e6:.1f} MB arrow)")
+        for name, csv_time, arrow_time in results:
+            print(f"  {name:<40} read_csv {csv_time * 1000:>8.2f}ms  arrow {arrow_time * 1000:>8.2f}ms  {csv_time / arrow_time:>6.1f}x")
+
+parser = argparse.ArgumentParser(description="Benchmark loading datasets from CSV against memory-mapped Arrow files.")
+
+parser.add_argument("files", type=str, nargs="+", help="The CSV files to benchmark.")
+parser.add_argument("--columns", type=str, nargs="+", default=["hash", "project"], help="The columns to project on.")
+parser.add_argument("--lookups", type=int, default=100, help="The number of random lookups by hash.")
+parser.add_argument("--repeat", type=int, default=5, help="The number of runs, the best is reported.")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    for file in args.files:
+        benchmark(file, args.columns, args.lookups, args.repeat)
@@ -0,0 +1,126 @@
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "few_shot"))
+
+from commit_similar import SimilarCommitSearch
+from git_backend import GIT_BACKENDS, create_git_backend
+from logger import ERROR, Logger
+from similar_search_memory import create_repository
+
+# Benchmark the Git backends of the similarity search on the same repository and the same items: the diffs of the
+# items, the line counts of the changed files, the commit stats, blame of the changed ranges and the full search.
+# Without --repo a synthetic repository is created, the items are the most recent commits, and some lines of its files
+# are changed in the index and in the working tree to compare the staged and working tree diffs too.
+
+# The time of every operation over all items, and the results to check the backends agree
+def measure(backend_name: str, folder: str, items: list[str], logger: Logger) -> tuple[dict[str, float], list]:
+    git = create_git_backend(folder, backend_name)
+    times = {}
+    results = []
+
+    start = time.perf_counter()
+    hunks = {item: list(git.diff_hunks(f"{item}~", item, only_staged=False)) for item in items}
+    times["diff"] = time.perf_counter() - start
+    results.append(hunks)
+
+    start = time.perf_counter()
+    results.append([git.line_count(f"{item}~", file) for item in items for file, _ in hunks[item]])
+    times["line count"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results.append([git.stats(item) for item in items])
+    times["stats"] = time.perf_counter() - start
+
+    search = SimilarCommitSearch(folder, logger, git_backend=backend_name)
+
+    start = time.perf_counter()
+    blames = []
+    for item in items:
+        for file, lines in hunks[item]:
+            deletions = search.parse_change_block(file, lines).deletions
+            end = min(deletions.line + max(deletions.length, 1) - 1, git.line_count(f"{item}~", file))
+            blames.append(git.blame(f"{item}~", file, deletions.line, end))
+    times["blame"] = time.perf_counter() - start
+    results.append(blames)
+
+    start = time.perf_counter()
+    results.append([[(score.commit.hash, round(score.score, 6)) for score in search.search(f"{item}~", item, only_staged=False)] for item in items])
+    times["search"] = time.perf_counter() - start
+
+    return times, results
+
+# Change random lines of the files of the synthetic repository, stage them, then change other lines in the working tree
+def change_working_tree(folder: str, seed: int):
+    rng = random.Random(seed)
+    files = sorted(file for file in os.listdir(folder) if file.endswith(".txt"))
+
+    for stage in [True, False]:
+        for file in rng.sample(files, 2):
+            with open(os.path.join(folder, file), encoding="utf-8") as f:
+                lines = f.read().splitlines()
+
+            for _ in range(3):
+                line = rng.randrange(len(lines))
+                lines[line:line + 1] = [f"{'staged' if stage else 'unstaged'} change {rng.random()}"] * rng.randint(1, 2)
+
+            with open(os.path.join(folder, file), "w", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+
+            if stage:
+                subprocess.run(["git", "add", file], cwd=folder, check=True)
+
+# The diffs of the index and the working tree, staged and unstaged, from HEAD and from an older commit
+def measure_uncommitted(backend_name: str, folder: str) -> tuple[float, list]:
+    git = create_git_backend(folder, backend_name)
+
+    start = time.perf_counter()
+    results = [list(git.diff_hunks(diff_from, None, only_staged)) for diff_from in [None, "HEAD", "HEAD~5"] for only_staged in [True, False]]
+
+    return time.perf_counter() - start, results
+
+parser = argparse.ArgumentParser(description="Benchmark the Git backends of the similarity search.")
+
+parser.add_argument("--repo", type=str, default=None, help="The repository to run on, a synthetic repository is created without it.")
+parser.add_argument("--items", type=int, default=20, help="The number of most recent commits to search for.")
+parser.add_argument("--commits", type=int, default=2000, help="The number of commits of the synthetic repository.")
+parser.add_argument("--backends", type=str, nargs="+", default=list(GIT_BACKENDS.keys()), choices=GIT_BACKENDS.keys(), help="The backends to compare.")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temporary_folder:
+        folder = args.repo
+
+        if folder is None:
+            folder = temporary_folder
+            create_repository(folder, args.commits, 5, 300, 0)
+            change_working_tree(folder, 0)
+
+        logger = Logger("git_backends", temporary_folder, console_level=ERROR)
+        items = [create_git_backend(folder).repo.commit(f"HEAD~{i}").hexsha for i in range(args.items)]
+        reference = None
+
+        for backend_name in args.backends:
+            try:
+                times, results = measure(backend_name, folder, items, logger)
+                times["uncommitted diff"], uncommitted = measure_uncommitted(backend_name, folder)
+                results.append(uncommitted)
+            except ImportError as e:
+                print(f"{backend_name:<12} not available: {e}")
+                continue
+
+            operations = ", ".join(f"{operation} {seconds:.3f}s" for operation, seconds in times.items())
+            print(f"{backend_name:<12} {operations}")
+
+            if reference is None:
+                reference = results
+            elif results != reference:
+                print(f"{backend_name:<12} results differ from {args.backends[0]}")
+
+        logger.close()
@@ -0,0 +1,78 @@
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backends import Backend, LoadBalancedBackend, OllamaBackend
+from main import Experiment, MODELS
+from stub_llm import StubProfile, StubServer
+
+# Benchmark the balanced backend against several local stand-in servers.
+# The servers can have different speeds, one of them can inject errors and one can be stopped halfway through the run
+# to exercise the failover, and the result is compared with sending everything to a single server.
+
+# Run the experiment on the first items of an input file and return the wall time
+def run_experiment(backend: Backend, args: argparse.Namespace) -> float:
+    with tempfile.TemporaryDirectory() as output_folder:
+        experiment = Experiment(MODELS[args.model](backend), args.input_size, args.items, args.prompt, args.input_folder, output_folder, args.workers, 0.7)
+        experiment.read_input()
+
+        start = time.perf_counter()
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            experiment.run_parallel()
+
+        failed = (experiment.output_df["generated_message"] == "").sum()
+        print(f"{len(experiment.output_df) - failed}/{len(experiment.output_df)} items generated")
+
+        return time.perf_counter() - start
+
+parser = argparse.ArgumentParser(description="Benchmark load balancing over several stand-in Ollama servers.")
+
+parser.add_argument("--model", type=str, default="mistral", choices=MODELS.keys(), help="The model name to request.")
+parser.add_argument("--prompt", type=str, default="fewshot", help="The prompt of the input file to use.")
+parser.add_argument("--input_folder", type=str, default="./input", help="The folder containing the input files.")
+parser.add_argument("--input_size", type=int, default=1000, help="The size of the input file.")
+parser.add_argument("--items", type=int, default=200, help="The number of items to generate.")
+parser.add_argument("--workers", type=int, default=8, help="The number of workers to use for parallel processing.")
+parser.add_argument("--servers", type=int, default=3, help="The number of stand-in servers.")
+parser.add_argument("--slowdown", type=float, default=2, help="How many times slower the last server is than the first.")
+parser.add_argument("--failing_error_rate", type=float, default=0, help="The error rate of the second server.")
+parser.add_argument("--stop_after", type=float, default=0, help="Stop the last server after this many seconds (0 to keep it running).")
+StubProfile.add_arguments(parser)
+# Like an Ollama server, every stand-in generates one message at a time by default
+parser.set_defaults(parallel=1)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    profile = StubProfile.from_args(args)
+
+    servers = []
+
+    for i in range(args.servers):
+        # Spread the speed of the servers linearly between 1x and the slowdown
+        slowdown = 1 + (args.slowdown - 1) * i / max(args.servers - 1, 1)
+        server_profile = StubProfile(profile.ttft * slowdown, profile.token_rate / slowdown, profile.jitter, args.failing_error_rate if i == 1 else profile.error_rate, parallel=profile.parallel)
+        servers.append(StubServer(server_profile, list(MODELS.keys())).start())
+
+    single_time = run_experiment(OllamaBackend(servers[0].url), args)
+    print(f"Single server: {single_time:.2f}s")
+
+    if args.stop_after > 0:
+        threading.Timer(args.stop_after, servers[-1].stop).start()
+
+    backend = LoadBalancedBackend([server.url for server in servers], health_interval=1)
+    balanced_time = run_experiment(backend, args)
+    backend.close()
+
+    print(f"Balanced over {len(servers)} servers: {balanced_time:.2f}s ({single_time / balanced_time:.2f}x)")
+    print(backend.report())
+
+    for server in servers[:-1] if args.stop_after > 0 else servers:
+        server.stop()
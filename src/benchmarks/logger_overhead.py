@@ -0,0 +1,74 @@
+import argparse
+import contextlib
+import datetime
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "few_shot"))
+
+from logger import DEBUG, INFO, Logger
+
+# Benchmark the time run_similar_search spends logging, with the logging pattern of a similarity search:
+# per item a few info messages, and debug messages for every change block and every historical commit found.
+
+# The logger as it was before, opening the log file for every message
+class UnbufferedLogger:
+    def __init__(self, name: str, folder: str):
+        self.log_file = folder + f'/{name}_{datetime.datetime.now().strftime("%Y%m%d%H%M%S")}.txt'
+
+    def print(self, message="", to_console=True, level=INFO):
+        with open(self.log_file, 'a', encoding="utf-8") as f:
+            f.write(message + '\n')
+
+        if to_console:
+            print(message)
+
+    def close(self):
+        pass
+
+# Log the messages of a run and return the time the caller spent logging
+def log_run(logger, items: int, blocks: int, commits: int) -> float:
+    start = time.perf_counter()
+
+    for i in range(items):
+        logger.print(f"({i}) Handeling commit 1d8f156 (Fix file path to words.txt) found at https://github.com/jazzband/inflect/commit/1d8f156")
+
+        for block in range(blocks):
+            logger.print(f"Checking changes in tests/test_pl_si.py for {block * 10},+6", level=DEBUG)
+
+            for commit in range(commits):
+                logger.print(f"|> Found commit {commit:07x} with 3 insertions and 1 deletions", level=DEBUG)
+
+        logger.print(f"Prompt is 2048 characters or ~512 tokens")
+        logger.print()
+
+    return time.perf_counter() - start
+
+def measure(name: str, create_logger, args: argparse.Namespace):
+    with tempfile.TemporaryDirectory() as folder, contextlib.redirect_stdout(io.StringIO()):
+        logger = create_logger(folder)
+        logging_time = log_run(logger, args.items, args.blocks, args.commits)
+
+        start = time.perf_counter()
+        logger.close()
+        close_time = time.perf_counter() - start
+
+    messages = args.items * (3 + args.blocks * (1 + args.commits))
+    print(f"{name:<32} {logging_time:>8.3f}s {logging_time / messages * 1e6:>8.2f}us/message, {close_time:.3f}s flushing at exit")
+
+parser = argparse.ArgumentParser(description="Benchmark the logging overhead of the similarity search.")
+
+parser.add_argument("--items", type=int, default=200, help="The number of items to log.")
+parser.add_argument("--blocks", type=int, default=10, help="The number of change blocks per item.")
+parser.add_argument("--commits", type=int, default=20, help="The number of historical commits found per change block.")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    measure("unbuffered", lambda folder: UnbufferedLogger("few_shot", folder), args)
+    measure("queued", lambda folder: Logger("few_shot", folder), args)
+    measure("queued, console info", lambda folder: Logger("few_shot", folder, console_level=INFO), args)
+    measure("queued, console 1%", lambda folder: Logger("few_shot", folder, console_sample_rate=0.01), args)
@@ -0,0 +1,138 @@
+import argparse
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from pandas import DataFrame
+
+SRC_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SRC_FOLDER)
+
+from backends import Backend, OllamaBackend, StubBackend
+from main import Experiment, MODELS
+from runExtension import TxtExperiment
+from stub_llm import StubProfile, StubServer
+
+# Benchmark the orchestration overhead of the generation code paths against the deterministic stand-in model.
+# The stand-in reports how long it spent generating, so the remaining wall time is the overhead of our own code
+# (threads, DataFrames, HTTP and process startup) rather than model time.
+
+# Result of one benchmark scenario
+class Measurement:
+    name: str
+    items: int
+    wall_time: float
+    model_time: float
+    concurrency: int
+
+    def __init__(self, name: str, items: int, wall_time: float, model_time: float, concurrency: int):
+        self.name = name
+        self.items = items
+        self.wall_time = wall_time
+        self.model_time = model_time
+        self.concurrency = concurrency
+
+    # Wall time that is not explained by the model, assuming the model time is spread over all workers
+    @property
+    def overhead(self) -> float:
+        return max(self.wall_time - self.model_time / self.concurrency, 0)
+
+    def __str__(self):
+        return f"{self.name:<24} {self.items:>6} {self.wall_time:>9.3f}s {self.model_time:>9.3f}s {self.overhead:>9.3f}s {self.overhead / self.items * 1000:>9.2f}ms"
+
+# Run the main.py experiment on the first items of an input file
+def run_experiment(backend: Backend, args: argparse.Namespace) -> float:
+    with tempfile.TemporaryDirectory() as output_folder:
+        experiment = Experiment(MODELS[args.model](backend), args.input_size, args.items, args.prompt, args.input_folder, output_folder, args.workers, 0.7)
+        experiment.read_input()
+
+        start = time.perf_counter()
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            if args.workers > 1:
+                experiment.run_parallel()
+            else:
+                experiment.run()
+
+        return time.perf_counter() - start
+
+# Run the extension experiment in-process, one prompt per item like the files of a commit
+def run_txt_experiment(backend: Backend, prompts: list[str], args: argparse.Namespace) -> float:
+    with tempfile.TemporaryDirectory() as output_folder:
+        experiment = TxtExperiment(f"{output_folder}/output.csv", f"{output_folder}/output.txt", len(prompts), args.workers, 0.7, backend)
+        experiment.input_df = DataFrame({"prompt": prompts})
+
+        start = time.perf_counter()
+
+        with contextlib.redirect_stderr(io.StringIO()):
+            experiment.run_parallel()
+
+        return time.perf_counter() - start
+
+# Run runExtension.py as a new process per prompt, the way the extension calls it for every staged file
+def run_extension_processes(server: StubServer, prompts: list[str]) -> float:
+    with tempfile.TemporaryDirectory() as output_folder:
+        start = time.perf_counter()
+
+        for prompt in prompts:
+            subprocess.run(
+                [sys.executable, os.path.join(SRC_FOLDER, "runExtension.py"), "--host", server.url, "--output_csv", f"{output_folder}/output.csv", "--output_txt", f"{output_folder}/output.txt"],
+                input=prompt, text=True, capture_output=True, check=True
+            )
+
+        return time.perf_counter() - start
+
+# Run a scenario against a fresh stand-in server and measure the time the server spent generating
+def measure_http(name: str, profile: StubProfile, items: int, concurrency: int, scenario) -> Measurement:
+    server = StubServer(profile, list(MODELS.keys())).start()
+
+    try:
+        wall_time = scenario(server)
+
+        return Measurement(name, items, wall_time, server.stats.busy_time, concurrency)
+    finally:
+        server.stop()
+
+parser = argparse.ArgumentParser(description="Benchmark the orchestration overhead of the generation code paths against a stand-in model.")
+
+parser.add_argument("--model", type=str, default="mistral", choices=MODELS.keys(), help="The model name to request.")
+parser.add_argument("--prompt", type=str, default="fewshot", help="The prompt of the input file to use.")
+parser.add_argument("--input_folder", type=str, default="./input", help="The folder containing the input files.")
+parser.add_argument("--input_size", type=int, default=1000, help="The size of the input file.")
+parser.add_argument("--items", type=int, default=200, help="The number of items to generate per scenario.")
+parser.add_argument("--extension_items", type=int, default=5, help="The number of runExtension.py processes to start.")
+parser.add_argument("--workers", type=int, default=5, help="The number of workers to use for parallel processing.")
+StubProfile.add_arguments(parser)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    profile = StubProfile.from_args(args)
+
+    experiment = Experiment(MODELS[args.model](StubBackend()), args.input_size, args.items, args.prompt, args.input_folder, "", args.workers, 0.7)
+    experiment.read_input()
+    prompts = experiment.input_df["prompt"].tolist()[:args.items]
+
+    measurements = []
+
+    # Without any simulated latency all the wall time is orchestration
+    measurements.append(Measurement("main.py in-process", args.items, run_experiment(StubBackend(), args), 0, args.workers))
+
+    stub = StubBackend(profile)
+    start = time.perf_counter()
+    for prompt in prompts:
+        stub.generate(args.model, prompt, {})
+    model_time = time.perf_counter() - start
+    measurements.append(Measurement("main.py stub backend", args.items, run_experiment(StubBackend(profile), args), model_time, args.workers))
+
+    measurements.append(measure_http("main.py over HTTP", profile, args.items, args.workers, lambda server: run_experiment(OllamaBackend(server.url), args)))
+    measurements.append(measure_http("runExtension in-process", profile, args.items, args.workers, lambda server: run_txt_experiment(OllamaBackend(server.url), prompts, args)))
+    extension_prompts = prompts[:args.extension_items]
+    measurements.append(measure_http("runExtension processes", profile, len(extension_prompts), 1, lambda server: run_extension_processes(server, extension_prompts)))
+
+    print(f"{'Scenario':<24} {'Items':>6} {'Wall':>10} {'Model':>10} {'Overhead':>10} {'Per item':>11}")
+    for measurement in measurements:
+        print(measurement)
@@ -0,0 +1,62 @@
+import argparse
+import os
+import sys
+import time
+
+from pandas import read_csv
+from llama_cpp import Llama
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prefix_cache import enable_prefix_cache, disable_prefix_cache
+from prompt_template import prefix_key
+
+# Benchmark the prefill time of the experiment prompts with and without reusing the KV cache of the shared prompt prefix.
+# Only one token is generated per prompt, so the measured time is dominated by prefilling the prompt.
+
+# Prefill every prompt once and return the time taken per prompt
+def measure_prefill(llm: Llama, prompts: list[str], reuse: bool) -> list[float]:
+    if reuse:
+        enable_prefix_cache(llm)
+    else:
+        disable_prefix_cache(llm)
+
+    times = []
+
+    for prompt in prompts:
+        if not reuse:
+            llm.reset()
+
+        start = time.perf_counter()
+        llm.create_completion(prompt, max_tokens=1)
+        times.append(time.perf_counter() - start)
+
+    return times
+
+# Print a short summary of the measured prefill times
+def print_summary(label: str, times: list[float]):
+    print(f"{label}: total {sum(times):.2f}s, mean {sum(times) / len(times) * 1000:.1f}ms per prompt")
+
+parser = argparse.ArgumentParser(description="Benchmark prefill time with and without prompt prefix reuse.")
+
+parser.add_argument("--model_path", type=str, required=True, help="Path to the GGUF model file.")
+parser.add_argument("--input_file", type=str, default="./input/mistral_1000_fewshot.csv", help="The input file with the prompts.")
+parser.add_argument("--items", type=int, default=50, help="The number of prompts to prefill.")
+parser.add_argument("--n_ctx", type=int, default=4096, help="The context window of the model.")
+parser.add_argument("--n_gpu_layers", type=int, default=0, help="The number of layers to offload to the GPU.")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    prompts = read_csv(args.input_file, usecols=["prompt"], nrows=args.items)["prompt"].tolist()
+    # Schedule prompts sharing a prefix back to back, the same way the experiments do
+    prompts.sort(key=prefix_key)
+
+    llm = Llama(model_path=args.model_path, n_ctx=args.n_ctx, n_gpu_layers=args.n_gpu_layers, verbose=False)
+
+    without_reuse = measure_prefill(llm, prompts, reuse=False)
+    with_reuse = measure_prefill(llm, prompts, reuse=True)
+
+    print_summary("Without prefix reuse", without_reuse)
+    print_summary("With prefix reuse", with_reuse)
+    print(f"Speedup: {sum(without_reuse) / sum(with_reuse):.2f}x")
@@ -0,0 +1,160 @@
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "few_shot"))
+
+from commit_similar import Commit, CommitOverlap, SimilarCommitSearch
+from logger import ERROR, Logger
+
+# Benchmark the memory of the similarity search data objects on a synthetic repository with a long history.
+# The repository is written with git fast-import: every commit rewrites a few random lines of one of the files.
+
+# The data objects as they were before, backed by an instance dict and keeping the text of every hunk
+class DictRange:
+    def __init__(self, line: int, length: int):
+        self.line = line
+        self.length = length
+
+class DictChangeBlock:
+    def __init__(self, file: str, insertions: DictRange, deletions: DictRange, text: list[str]):
+        self.file = file
+        self.insertions = insertions
+        self.deletions = deletions
+        self.text = text
+
+class DictCommit:
+    def __init__(self, hash: str, author: str, date: str, message: str, insertions: int = 0, deletions: int = 0):
+        self.hash = hash
+        self.author = author
+        self.date = date
+        self.message = message
+        self.insertions = insertions
+        self.deletions = deletions
+
+class DictCommitOverlap:
+    def __init__(self, commit: DictCommit, insertions: int = 0, deletions: int = 0):
+        self.commit = commit
+        self.insertions = insertions
+        self.deletions = deletions
+
+# Write a repository with the given number of commits to the folder
+def create_repository(folder: str, commits: int, files: int, lines: int, seed: int):
+    rng = random.Random(seed)
+    contents = [[f"line {line} of file {file}" for line in range(lines)] for file in range(files)]
+    authors = [f"author{author} <author{author}@example.com>" for author in range(20)]
+    stream = []
+
+    for i in range(commits):
+        file = rng.randrange(files)
+
+        for _ in range(rng.randint(1, 6)):
+            contents[file][rng.randrange(lines)] = f"line changed in commit {i} {rng.random()}"
+
+        data = ("\n".join(contents[file]) + "\n").encode("utf-8")
+        message = f"Change {rng.randint(1, 6)} lines of file{file}.txt in commit {i}\n".encode("utf-8")
+
+        stream.append(b"commit refs/heads/main\n")
+        stream.append(f"committer {rng.choice(authors)} {1600000000 + i * 60} +0000\n".encode("utf-8"))
+        stream.append(b"data %d\n%s" % (len(message), message))
+        stream.append(b"M 644 inline file%d.txt\ndata %d\n%s\n" % (file, len(data), data))
+
+    subprocess.run(["git", "init", "-q", "-b", "main", folder], check=True)
+    subprocess.run(["git", "fast-import", "--quiet"], input=b"".join(stream), cwd=folder, check=True)
+    subprocess.run(["git", "checkout", "-q", "main"], cwd=folder, check=True)
+
+# The hunks of the whole history, as (file, hunk lines) pairs
+def read_hunks(folder: str) -> list[tuple[str, list[str]]]:
+    log = subprocess.run(["git", "log", "--patch", "--unified=0", "--format="], cwd=folder, capture_output=True, text=True, check=True).stdout
+    hunks = []
+    file = None
+
+    for line in log.splitlines():
+        if line.startswith("+++ "):
+            file = line[6:]
+        elif line.startswith("@@"):
+            hunks.append((file, [line]))
+        elif len(hunks) > 0 and (line.startswith("+") or line.startswith("-")) and not line.startswith("---"):
+            hunks[-1][1].append(line)
+
+    return hunks
+
+# The bytes still allocated after building the objects, and the time it took
+def measure(build) -> tuple[int, float]:
+    tracemalloc.start()
+    start = time.perf_counter()
+    objects = build()
+    elapsed = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    del objects
+
+    return size, elapsed
+
+def build_dict_blocks(search: SimilarCommitSearch, hunks: list[tuple[str, list[str]]]):
+    blocks = []
+
+    for file, lines in hunks:
+        block = search.parse_change_block(file, lines)
+        blocks.append(DictChangeBlock(file, DictRange(block.insertions.line, block.insertions.length), DictRange(block.deletions.line, block.deletions.length), [line for line in lines[1:]]))
+
+    return blocks
+
+def build_dict_overlaps(commits: int):
+    return [DictCommitOverlap(DictCommit(f"{i:040x}", f"author{i % 20}", f"2020-09-{i % 28 + 1:02}", f"Change lines in commit {i}", 4, 4), 2, 2) for i in range(commits)]
+
+def build_overlaps(commits: int):
+    return [CommitOverlap(Commit(f"{i:040x}", f"author{i % 20}", f"2020-09-{i % 28 + 1:02}", f"Change lines in commit {i}", 4, 4), 2, 2) for i in range(commits)]
+
+def report(name: str, size: int, elapsed: float, count: int):
+    print(f"{name:<40} {size / 1e6:>8.2f}MB {size / count:>8.1f}B/object {elapsed:>7.3f}s")
+
+parser = argparse.ArgumentParser(description="Benchmark the memory of the similarity search on a synthetic repository with a long history.")
+
+parser.add_argument("--commits", type=int, default=3000, help="The number of commits of the synthetic repository.")
+parser.add_argument("--files", type=int, default=5, help="The number of files of the synthetic repository.")
+parser.add_argument("--lines", type=int, default=300, help="The number of lines per file.")
+parser.add_argument("--searches", type=int, default=5, help="The number of recent commits to run the full similarity search for.")
+parser.add_argument("--seed", type=int, default=0, help="The seed of the synthetic history.")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        start = time.perf_counter()
+        create_repository(folder, args.commits, args.files, args.lines, args.seed)
+        hunks = read_hunks(folder)
+        print(f"Created {args.commits} commits with {len(hunks)} hunks in {time.perf_counter() - start:.2f}s")
+
+        logger = Logger("similar_search_memory", folder, console_level=ERROR)
+        search = SimilarCommitSearch(folder, logger)
+        search_with_text = SimilarCommitSearch(folder, logger, keep_text=True)
+
+        report("hunks, dict", *measure(lambda: build_dict_blocks(search, hunks)), len(hunks))
+        report("hunks, slots with text", *measure(lambda: [search_with_text.parse_change_block(file, lines) for file, lines in hunks]), len(hunks))
+        report("hunks, slots", *measure(lambda: [search.parse_change_block(file, lines) for file, lines in hunks]), len(hunks))
+
+        report("commit overlaps, dict", *measure(lambda: build_dict_overlaps(args.commits)), args.commits)
+        report("commit overlaps, slots", *measure(lambda: build_overlaps(args.commits)), args.commits)
+
+        # The full search for the most recent commits, the peak includes the git log output
+        for keep_text in [True, False]:
+            search = SimilarCommitSearch(folder, logger, keep_text=keep_text)
+
+            tracemalloc.start()
+            start = time.perf_counter()
+            for i in range(args.searches):
+                search.search(diff_from=f"HEAD~{i + 1}", diff_to=f"HEAD~{i}", only_staged=False)
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            print(f"{'search, ' + ('with text' if keep_text else 'without text'):<40} {peak / 1e6:>8.2f}MB peak {elapsed:>7.3f}s, {len(search.commits)} commits cached")
+
+        logger.close()
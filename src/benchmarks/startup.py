@@ -0,0 +1,76 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Benchmark the cold start of the entry points with python -X importtime, the time until the arguments are parsed
+# and the modules that take the longest to import.
+
+# The entry points, started with --help so they exit right after importing and parsing the arguments
+ENTRY_POINTS = {
+    "main": ["main.py", "--help"],
+    "runExtension": ["runExtension.py", "--help"],
+    "watcher": ["watcher.py", "--help"],
+    "clean": ["-c", "import clean"],
+    "scoring": ["-c", "import post_processing.post_processing_csv"],
+    "graphs": ["-c", "import post_processing.graphs"]
+}
+
+# The cumulative import time per top level module in seconds, from the stderr of python -X importtime
+def parse_importtime(output: str) -> dict[str, float]:
+    modules = {}
+
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+
+        _, cumulative, name = line[len("import time:"):].split("|")
+
+        # Only the modules imported by the entry point itself, not the ones they import in turn
+        if not name.startswith("  "):
+            modules[name.strip()] = int(cumulative) / 1e6
+
+    return modules
+
+def measure(arguments: list[str], repeat: int) -> tuple[float, dict[str, float]]:
+    best = None
+    modules = {}
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, "-X", "importtime", *arguments], cwd=SRC, capture_output=True, text=True)
+        elapsed = time.perf_counter() - start
+
+        if result.returncode != 0:
+            raise Exception(result.stderr.strip().splitlines()[-1])
+
+        if best is None or elapsed < best:
+            best = elapsed
+            modules = parse_importtime(result.stderr)
+
+    return best, modules
+
+parser = argparse.ArgumentParser(description="Benchmark the startup time of the entry points.")
+
+parser.add_argument("entry_points", type=str, nargs="*", default=list(ENTRY_POINTS.keys()), help="The entry points to start.")
+parser.add_argument("--repeat", type=int, default=3, help="The number of starts, the fastest is reported.")
+parser.add_argument("--top", type=int, default=5, help="The number of slowest imports shown per entry point.")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    for name in args.entry_points:
+        try:
+            elapsed, modules = measure(ENTRY_POINTS[name], args.repeat)
+        except Exception as e:
+            print(f"{name:<14} failed: {e}")
+            continue
+
+        slowest = sorted(modules.items(), key=lambda module: module[1], reverse=True)[:args.top]
+
+        print(f"{name:<14} {elapsed * 1000:>8.1f}ms, imports {sum(modules.values()) * 1000:>8.1f}ms")
+        for module, seconds in slowest:
+            print(f"    {module:<40} {seconds * 1000:>8.1f}ms")
@@ -0,0 +1,56 @@
+import contextlib
+import threading
+from typing import Callable
+
+# Raised in a generation that was cancelled. Like KeyboardInterrupt it is not an Exception, so the error handling
+# around a generation does not count it as a failed request or retry it.
+class Cancelled(BaseException):
+    pass
+
+# Cancels the work that was started with it, from any thread.
+# The backends check the token of the current thread between tokens and close the running request or generation loop.
+class CancellationToken:
+    event: threading.Event
+
+    def __init__(self):
+        self.event = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.event.is_set()
+
+    def cancel(self):
+        self.event.set()
+
+    def raise_if_cancelled(self):
+        if self.event.is_set():
+            raise Cancelled()
+
+current = threading.local()
+
+# The token of the work running on this thread, None when it cannot be cancelled
+def current_token() -> CancellationToken|None:
+    return getattr(current, "token", None)
+
+# Raise Cancelled when the work running on this thread was cancelled
+def check_cancelled():
+    token = current_token()
+
+    if token is not None:
+        token.raise_if_cancelled()
+
+# Run the work inside the block with the token, the backends called in it stop when the token is cancelled
+@contextlib.contextmanager
+def use_token(token: CancellationToken|None):
+    previous = current_token()
+    current.token = token
+
+    try:
+        yield token
+    finally:
+        current.token = previous
+
+# Call a function with the token, for work submitted to another thread
+def with_token(token: CancellationToken|None, function: Callable, *args):
+    with use_token(token):
+        return function(*args)
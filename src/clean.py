@@ -1,7 +1,10 @@
+import argparse
 import os
 import pandas as pd
 import logging
 
+from profiling import span
+
 def clean_string(message: str):
 	return message.replace('\n', '').strip(' `"\'-:]')
 
@@ -67,8 +70,9 @@ def clean_file(input_path: str, output_path: str):
 	size = parts[1]
 	prompt_type = parts[2]
 
-	for i in range(len(df)):
-		clean_item(df, i, model, prompt_type)
+	with span("clean.file", os.path.basename(input_path)):
+		for i in range(len(df)):
+			clean_item(df, i, model, prompt_type)
 
 	df.to_csv(output_path, index=False)
 
@@ -83,4 +87,19 @@ def clean_folder(input_folder: str='./output', output_folder: str='./cleaned_out
 		input_path = os.path.join(input_folder, filename)
 		output_path = os.path.join(output_folder, filename)
 
-		clean_file(input_path, output_path)
\ No newline at end of file
+		clean_file(input_path, output_path)
+
+parser = argparse.ArgumentParser(description="Clean the generated messages of the output files.")
+
+parser.add_argument("--file", type=str, default=None, help="Clean a single output file instead of the whole folder.")
+parser.add_argument("--output", type=str, default=None, help="The file to save the cleaned --file to.")
+parser.add_argument("--input_folder", type=str, default="./output", help="The folder of output files to clean.")
+parser.add_argument("--output_folder", type=str, default="./cleaned_output", help="The folder to save the cleaned files to.")
+
+if __name__ == "__main__":
+	args = parser.parse_args()
+
+	if args.file:
+		clean_file(args.file, args.output or os.path.join(args.output_folder, os.path.basename(args.file)))
+	else:
+		clean_folder(args.input_folder, args.output_folder)
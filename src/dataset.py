@@ -0,0 +1,159 @@
+import argparse
+import os
+from typing import Iterator
+
+import pyarrow as pa
+import pyarrow.ipc as ipc
+from pandas import DataFrame, read_csv
+
+ARROW_EXTENSION = ".arrow"
+
+def is_arrow(path: str) -> bool:
+    return path.endswith(ARROW_EXTENSION)
+
+# The Arrow file next to a CSV file
+def arrow_path(path: str) -> str:
+    return os.path.splitext(path)[0] + ARROW_EXTENSION
+
+# A dataset stored as an uncompressed Arrow IPC file.
+# The file is memory-mapped and the columns are read zero-copy, so only the pages of the columns that are used get loaded.
+class Dataset:
+    path: str
+    table: pa.Table
+    key: str
+    index: dict[str, int]|None = None
+
+    def __init__(self, path: str, key: str = "hash"):
+        self.path = path
+        self.key = key
+        self.table = ipc.open_file(pa.memory_map(path, "r")).read_all()
+
+    def __len__(self) -> int:
+        return self.table.num_rows
+
+    @property
+    def columns(self) -> list[str]:
+        return self.table.column_names
+
+    # Project the table on the given columns and limit it to the first rows
+    def select(self, columns: list[str]|None = None, nrows: int|None = None) -> pa.Table:
+        table = self.table if columns is None else self.table.select(columns)
+
+        return table if nrows is None else table.slice(0, nrows)
+
+    def to_pandas(self, columns: list[str]|None = None, nrows: int|None = None) -> DataFrame:
+        return self.select(columns, nrows).to_pandas()
+
+    # Read the selected columns in DataFrames of chunksize rows
+    def chunks(self, columns: list[str]|None, nrows: int|None, chunksize: int) -> Iterator[DataFrame]:
+        table = self.select(columns, nrows)
+
+        for offset in range(0, table.num_rows, chunksize):
+            chunk = table.slice(offset, chunksize).to_pandas()
+            chunk.index += offset
+
+            yield chunk
+
+    # Row number of every key, built on the first lookup
+    def build_index(self) -> dict[str, int]:
+        if self.index is None:
+            self.index = {key: row for row, key in enumerate(self.table.column(self.key).to_pylist())}
+
+        return self.index
+
+    def row(self, key: str) -> int|None:
+        return self.build_index().get(key)
+
+    # Look up a single item by its key, only reading the given columns
+    def get(self, key: str, columns: list[str]|None = None) -> dict|None:
+        row = self.row(key)
+
+        if row is None:
+            return None
+
+        return self.select(columns).slice(row, 1).to_pylist()[0]
+
+    def export_csv(self, path: str):
+        self.to_pandas().to_csv(path, index=False)
+
+# Writes DataFrames to an Arrow IPC file one chunk at a time, all chunks use the schema of the first
+class ArrowWriter:
+    path: str
+    sink: pa.OSFile
+    writer: ipc.RecordBatchFileWriter|None = None
+    schema: pa.Schema|None
+
+    def __init__(self, path: str, schema: pa.Schema|None = None):
+        self.path = path
+        self.schema = schema
+        self.sink = pa.OSFile(path, "wb")
+
+    def write(self, df: DataFrame):
+        table = pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+
+        if self.writer is None:
+            self.schema = table.schema
+            self.writer = ipc.new_file(self.sink, self.schema)
+
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is None:
+            self.writer = ipc.new_file(self.sink, self.schema if self.schema is not None else pa.schema([]))
+
+        self.writer.close()
+        self.sink.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+# Schema of a table with only string columns
+def string_schema(columns: list[str]) -> pa.Schema:
+    return pa.schema([(column, pa.string()) for column in columns])
+
+def write_arrow(df: DataFrame, path: str):
+    with ArrowWriter(path) as writer:
+        writer.write(df)
+
+# Read a CSV or Arrow file, only loading the given columns
+def read_table(path: str, columns: list[str]|None = None, nrows: int|None = None) -> DataFrame:
+    if is_arrow(path):
+        return Dataset(path).to_pandas(columns, nrows)
+
+    return read_csv(path, usecols=columns, nrows=nrows)
+
+# Read a CSV or Arrow file in chunks, only loading the given columns
+def read_chunks(path: str, columns: list[str]|None, nrows: int|None, chunksize: int) -> Iterator[DataFrame]:
+    if is_arrow(path):
+        return Dataset(path).chunks(columns, nrows, chunksize)
+
+    return read_csv(path, usecols=columns, nrows=nrows, chunksize=chunksize)
+
+# Convert a CSV file to an Arrow file next to it
+def convert_csv(path: str) -> str:
+    output_file = arrow_path(path)
+    write_arrow(read_csv(path), output_file)
+
+    return output_file
+
+parser = argparse.ArgumentParser(description="Convert datasets between CSV and memory-mapped Arrow files.")
+
+parser.add_argument("files", type=str, nargs="+", help="The files to convert, CSV files are converted to Arrow and Arrow files to CSV.")
+parser.add_argument("--get", type=str, default=None, help="Print the item with this hash instead of converting.")
+parser.add_argument("--columns", type=str, nargs="+", default=None, help="The columns to print with --get.")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    for file in args.files:
+        if args.get is not None:
+            print(Dataset(file).get(args.get, args.columns))
+        elif is_arrow(file):
+            output_file = os.path.splitext(file)[0] + ".csv"
+            Dataset(file).export_csv(output_file)
+            print(f"Exported {file} to {output_file}")
+        else:
+            print(f"Converted {file} to {convert_csv(file)}")
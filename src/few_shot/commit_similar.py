@@ -1,10 +1,20 @@
 from __future__ import annotations
 
-from git import Repo, Commit as GitCommit
-from logger import Logger
+import contextlib
+import sys
+import time
+from collections.abc import Iterable, Iterator
+
+from git_backend import GitBackend, create_git_backend
+from logger import DEBUG, Logger
+
+# The data objects use __slots__, a search creates one for every hunk and every historical commit overlapping it,
+# and without an instance dict they take a fraction of the memory.
 
 # Represents a range of lines in a file
 class Range:
+    __slots__ = ('line', 'length')
+
     line: int
     length: int
 
@@ -15,14 +25,16 @@ class Range:
     def __str__(self):
         return f'{self.line},{self.length}'
 
-# Represents a block of changes in a file, including insertions, deletions, and the text content
+# Represents a block of changes in a file, including insertions, deletions, and the text content when it is kept
 class ChangeBlock:
+    __slots__ = ('file', 'insertions', 'deletions', 'text')
+
     file: str
     insertions: Range
     deletions: Range
-    text: list[str]
+    text: list[str]|None
 
-    def __init__(self, file: str, insertions: Range, deletions: Range, text: list[str]):
+    def __init__(self, file: str, insertions: Range, deletions: Range, text: list[str]|None = None):
         self.file = file
         self.insertions = insertions
         self.deletions = deletions
@@ -33,6 +45,8 @@ class ChangeBlock:
 
 # Represents a Git commit with metadata such as hash, author, date, message, and changes
 class Commit:
+    __slots__ = ('hash', 'author', 'date', 'message', 'insertions', 'deletions')
+
     hash: str
     author: str
     date: str
@@ -42,8 +56,9 @@ class Commit:
 
     def __init__(self, hash: str, author: str, date: str, message: str, insertions: int = 0, deletions: int = 0):
         self.hash = hash
-        self.author = author
-        self.date = date
+        # Authors and dates repeat over the history, share a single string for each
+        self.author = sys.intern(author)
+        self.date = sys.intern(date)
         self.message = message
         self.insertions = insertions
         self.deletions = deletions
@@ -61,6 +76,8 @@ class Commit:
 
 # Represents the overlap of changes between commits
 class CommitOverlap:
+    __slots__ = ('commit', 'insertions', 'deletions')
+
     commit: Commit
     insertions: int
     deletions: int
@@ -79,6 +96,8 @@ class CommitOverlap:
     
 # Represents a commit with a calculated similarity score  
 class CommitScore:
+    __slots__ = ('commit', 'score')
+
     commit: Commit
     score: float
 
@@ -89,18 +108,37 @@ class CommitScore:
     def __str__(self):
         return f'{self.commit} with score {self.score}'
 
+# Limits of a similarity search, the defaults walk the complete history of every change block
+class SearchOptions:
+    deadline: float|None
+    max_depth: int|None
+    since: str|None
+    top_k: int|None
+
+    # deadline: the seconds the search may take, max_depth: the number of historical commits walked per change block,
+    # since: the oldest commit date walked, top_k: stop once the first top_k commits can no longer change
+    def __init__(self, deadline: float|None = None, max_depth: int|None = None, since: str|None = None, top_k: int|None = None):
+        self.deadline = deadline
+        self.max_depth = max_depth
+        self.since = since
+        self.top_k = top_k
+
 # Performs similarity search on Git commits to identify related changes based on diffs  
 class SimilarCommitSearch:
     path: str
-    repo: Repo
-    commits: dict[str, GitCommit]
+    git: GitBackend
+    commits: dict[str, Commit]
     padding: int
+    keep_text: bool
     logger: Logger
+    # Why the last search stopped early: "deadline", "top_k" or None when it walked the complete history
+    stopped: str|None = None
 
-    def __init__(self, path: str, logger: Logger, padding: int = 3):
+    def __init__(self, path: str, logger: Logger, padding: int = 3, keep_text: bool = False, git_backend: str = "gitpython"):
         self.path = path
-        self.repo = Repo(path)
+        self.git = create_git_backend(path, git_backend)
         self.padding = padding
+        self.keep_text = keep_text
         self.logger = logger
         self.commits = {}
 
@@ -119,82 +157,77 @@ class SimilarCommitSearch:
         deletions = self.parse_range(range_texts[0])
         insertions = self.parse_range(range_texts[1])
 
-        text = lines[1:]
+        # The search only needs the ranges, the lines of the hunk are only kept when asked for
+        text = lines[1:] if self.keep_text else None
 
         return ChangeBlock(file, insertions, deletions, text)
 
-    # Get the changes between two commits or staged changes
-    def get_changes(self, diff_from: GitCommit, diff_to: GitCommit|None = None, only_staged: bool = True):
-        changes: list[ChangeBlock] = []
-
-        if only_staged:
-            index = diff_from.diff(diff_to, staged=True, create_patch=True, unified=0)
-        else:
-            index = diff_from.diff(diff_to, create_patch=True, unified=0)
-
-        # Get exact diffs for changes that are staged but not committed, only for modified files
-        for diff_item in index.iter_change_type("M"):
-            diff_text = diff_item.diff.decode('utf-8', errors='replace') if isinstance(diff_item.diff, bytes) else diff_item.diff
-            diff_lines = diff_text.splitlines()
-
-            change_texts: list[list[str]] = []
-
-            # Split change blocks
-            for line in diff_lines:
-                if line.startswith('@@'):
-                    change_texts.append([])
-
-                change_texts[-1].append(line)
-
-            # Parse change blocks
-            for change_text in change_texts:
-                changes.append(self.parse_change_block(diff_item.b_path, change_text))
-
-        return changes
+    # Get the changes between two commits or staged changes, only for modified files
+    def get_changes(self, diff_from: str|None, diff_to: str|None = None, only_staged: bool = True):
+        return [self.parse_change_block(file, lines) for file, lines in self.git.diff_hunks(diff_from, diff_to, only_staged)]
     
-    # Parse a commit from the Git log output
-    def parse_log_commit(self, lines: list[str]):
-        hash = lines[0].split(' ')[1].strip()
-        author = lines[1].split(' ')[1].strip()
-        date = lines[2].split(' ')[1].strip()
+    # Parse the commits of a Git log output as they arrive, one commit overlap is yielded as soon as the next commit
+    # starts, so only the header and message of the current commit are held in memory
+    def parse_log(self, lines: Iterable[str]) -> Iterator[CommitOverlap]:
+        header: list[str] = []
+        message: list[str] = []
         insertions = 0
         deletions = 0
-
-        message = ""
         in_message = True
 
         FORBIDDEN_LINES = ["Resolves", "Signed-off-by", "Co-authored-by"]
 
-        for line in lines[3:]:
+        for line in lines:
+            if line.startswith('commit '):
+                if len(header) > 0:
+                    yield self.create_commit_overlap(header, message, insertions, deletions)
+
+                header = [line]
+                message = []
+                insertions = 0
+                deletions = 0
+                in_message = True
+                continue
+
+            # The commit, author and date lines come first
+            if len(header) < 3:
+                header.append(line)
+                continue
+
             if in_message and line.startswith('diff --git'):
                 in_message = False
             if in_message:
                 text = line.strip()
 
-                if any(forbidden in text for forbidden in FORBIDDEN_LINES):
-                    continue
-
-                message += text + ' '
+                if not any(forbidden in text for forbidden in FORBIDDEN_LINES):
+                    message.append(text)
 
             if line.startswith('-') and not line.startswith('--'):
                 deletions += 1
-            
+
             if line.startswith('+') and not line.startswith('++'):
                 insertions += 1
-        
-        message = message.strip()
 
-        commit = self.get__or_create_commit(hash, date, author, message)
+        if len(header) > 0:
+            yield self.create_commit_overlap(header, message, insertions, deletions)
+
+    def create_commit_overlap(self, header: list[str], message: list[str], insertions: int, deletions: int):
+        hash = header[0].split(' ')[1].strip()
+        author = header[1].split(' ')[1].strip() if len(header) > 1 else ''
+        date = header[2].split(' ')[1].strip() if len(header) > 2 else ''
+
+        commit = self.get__or_create_commit(hash, date, author, ' '.join(message).strip())
 
         return CommitOverlap(commit, insertions, deletions)
+
+    # Parse a commit from the Git log output
+    def parse_log_commit(self, lines: list[str]):
+        return next(self.parse_log(lines))
     
     # Retrieve an existing commit or create a new one
     def get__or_create_commit(self, hash: str, date: str, author: str, message: str):
         if hash not in self.commits:
-            commit = self.repo.commit(hash)
-
-            insertions = commit.stats.total['insertions']
-            deletions = commit.stats.total['deletions']
+            insertions, deletions = self.git.stats(hash)
 
             self.commits[hash] = Commit(hash, date, author, message, insertions, deletions)
         
@@ -202,83 +235,144 @@ class SimilarCommitSearch:
     
     # Get the range of lines in a file affected by a change block
     def get_git_range(self, change: ChangeBlock, diff_to: str):
-        commit = self.repo.commit(diff_to)
-        max_lines = len(commit.tree[change.file].data_stream.read().splitlines())
+        max_lines = self.git.line_count(diff_to, change.file)
 
         start = change.deletions.line
         end = change.deletions.line + change.deletions.length
 
         return f'{max(start - self.padding, 1)},{min(end + self.padding, max_lines)}'
     
-    # Get overlaps of changes in a file with previous commits
-    def get_commit_overlaps(self, change: ChangeBlock, diff_to: str):
+    # Iterate over the overlaps of changes in a file with previous commits, while git log is still running
+    def iter_commit_overlaps(self, change: ChangeBlock, diff_to: str, options: SearchOptions|None = None, deadline: float|None = None) -> Iterator[CommitOverlap]:
+        options = SearchOptions() if options is None else options
         diff_to_text = f"{diff_to}~"
         git_range = self.get_git_range(change, diff_to_text)
 
-        self.logger.print(f"Checking changes in {change.file} for {git_range}")	
+        self.logger.print(f"Checking changes in {change.file} for {git_range}", level=DEBUG)	
 
-        log = self.repo.git.log(f'-L {git_range}:{change.file}', '--patch', diff_to_text)
+        limits = []
+        if options.max_depth is not None:
+            limits.append(f'--max-count={options.max_depth}')
+        if options.since is not None:
+            limits.append(f'--since={options.since}')
 
-        log_text = log.decode('utf-8', errors='replace') if isinstance(log, bytes) else log
-        log_lines = log_text.splitlines()
+        lines = self.git.log_lines(f'-L {git_range}:{change.file}', '--patch', *limits, diff_to_text, deadline=deadline)
 
-        commit_texts: list[list[str]] = []
+        for commit_overlap in self.parse_log(lines):
+            self.logger.print(f"|> Found commit {commit_overlap.commit.short_hash} with {commit_overlap.insertions} insertions and {commit_overlap.deletions} deletions", level=DEBUG)
 
-        # Split commits
-        for line in log_lines:
-            if line.startswith('commit '):
-                commit_texts.append([])
+            yield commit_overlap
+
+    # Get overlaps of changes in a file with previous commits
+    def get_commit_overlaps(self, change: ChangeBlock, diff_to: str):
+        return list(self.iter_commit_overlaps(change, diff_to))
 
-            commit_texts[-1].append(line)
+    # Add the overlap of a commit to its score, the score counts the overlapping lines until it is divided by the commit size
+    def merge_commit_overlap(self, commit_map: dict[str, CommitScore], commit_overlap: CommitOverlap):
+        hash = commit_overlap.commit.hash
 
-        commit_overlaps: list[CommitOverlap] = []
-        
-        # Parse commits
-        for commit_text in commit_texts:
-            commit_overlap = self.parse_log_commit(commit_text)
+        if hash not in commit_map:
+            commit_map[hash] = CommitScore(commit_overlap.commit, 0)
 
-            self.logger.print(f"|> Found commit {commit_overlap.commit.short_hash} with {commit_overlap.insertions} insertions and {commit_overlap.deletions} deletions")
-            commit_overlaps.append(commit_overlap)
+        commit_map[hash].score += commit_overlap.size
+
+    # Divide the scores by the commit sizes and sort them, commits with equal scores keep the order they were found in
+    def sort_commit_scores(self, commit_map: dict[str, CommitScore]) -> list[CommitScore]:
+        for commit_score in commit_map.values():
+            commit_score.score = commit_score.score / commit_score.commit.size
+
+        return sorted(commit_map.values(), key=lambda commit_score: commit_score.score, reverse=True)
 
-        return commit_overlaps
-    
     # Sort and merge commit overlaps into a list of commit scores
-    def sort_and_merge_commit_scores(self, commit_overlaps: list[CommitOverlap]) -> list[CommitScore]:
+    def sort_and_merge_commit_scores(self, commit_overlaps: Iterable[CommitOverlap]) -> list[CommitScore]:
         commit_map: dict[str, CommitScore] = {}
 
-        # Count the score for each commit, and keep track of the total size of the commit
         for commit_overlap in commit_overlaps:
-            hash = commit_overlap.commit.hash
+            self.merge_commit_overlap(commit_map, commit_overlap)
 
-            if hash not in commit_map:
-                commit_map[hash] = CommitScore(commit_overlap.commit, 0)
-            
-            commit_map[hash].score += commit_overlap.size
-        
-        # Divide the score by the total size of the commit
-        for hash, commit_score in commit_map.items():
-            commit_score.score = commit_score.score / commit_score.commit.size
+        return self.sort_commit_scores(commit_map)
+
+    # Check whether the rest of the history can still change the top k commits or their order.
+    # The overlap of a commit with one change block is at most the whole commit, so every change block adds at most 1 to
+    # a score: a commit can still gain 1 for every remaining change block, and 1 for the current one if it was not found
+    # in it yet. Commits found later lose ties, so a commit that was not found yet needs to beat the k-th score.
+    # It sorts all the commits found, so the search only calls it when enough commits pass the first test.
+    def top_k_settled(self, commit_map: dict[str, CommitScore], top_k: int, remaining: int, found: set[str]) -> bool:
+        scores = {hash: commit_score.score / commit_score.commit.size for hash, commit_score in commit_map.items()}
+        unseen_bound = remaining + 1
+
+        if sum(1 for score in scores.values() if score >= unseen_bound) < top_k:
+            return False
+
+        order = {hash: i for i, hash in enumerate(commit_map)}
+        ranked = sorted(scores, key=lambda hash: scores[hash], reverse=True)
+
+        for i, hash in enumerate(ranked[:top_k]):
+            for other in ranked[i + 1:]:
+                bound = scores[other] + remaining + (0 if other in found else 1)
 
-        # Sort the commits by overlap
-        sorted_commit_scores = []
-        for hash, commit_score in sorted(commit_map.items(), key=lambda x: x[1].score, reverse=True):
-            sorted_commit_scores.append(commit_score)
+                if bound > scores[hash] or (bound == scores[hash] and order[other] < order[hash]):
+                    return False
 
-        return sorted_commit_scores
+        return True
     
-    # Perform a similarity search for commits based on changes
-    def search(self, diff_from: str|None = None, diff_to: GitCommit|str|None = None, only_staged: bool = True) -> list[CommitScore]:
+    # Perform a similarity search for commits based on changes. With search options the search stops at the deadline,
+    # or once the top k commits are settled, and returns the scores of the history walked until then.
+    def search(self, diff_from: str|None = None, diff_to: str|None = None, only_staged: bool = True, options: SearchOptions|None = None) -> list[CommitScore]:
         if diff_to is not None and only_staged:
             raise ValueError('Cannot use both diff_to and only_staged options at the same time')
-        
-        diff_from = self.repo.index if diff_from is None else self.repo.commit(diff_from)
-        diff_to = diff_to
-        only_staged = only_staged
+
+        options = SearchOptions() if options is None else options
+        deadline = time.monotonic() + options.deadline if options.deadline is not None else None
+        self.stopped = None
 
         changes = self.get_changes(diff_from, diff_to, only_staged)
-        commit_overlaps = []
 
-        for change in changes:
-            commit_overlaps += self.get_commit_overlaps(change, diff_to)
-        
-        return self.sort_and_merge_commit_scores(commit_overlaps)
\ No newline at end of file
+        # The overlaps are merged into the scores while they are parsed, they are never all held at once
+        commit_map: dict[str, CommitScore] = {}
+
+        for i, change in enumerate(changes):
+            if deadline is not None and time.monotonic() >= deadline:
+                self.stopped = "deadline"
+                break
+
+            remaining = len(changes) - i - 1
+            found: set[str] = set()
+
+            # The commits a commit not found yet can no longer overtake. Scores only grow, so they are counted as the
+            # overlaps are merged, and the full check of the order runs at the start of a change block and at most once
+            # while its history is walked, once the count allows it.
+            if options.top_k is not None:
+                settled = {hash for hash, commit_score in commit_map.items() if commit_score.score / commit_score.commit.size >= remaining + 1}
+                checked = False
+
+                if len(settled) >= options.top_k and self.top_k_settled(commit_map, options.top_k, remaining, found):
+                    self.stopped = "top_k"
+                    break
+
+            with contextlib.closing(self.iter_commit_overlaps(change, diff_to, options, deadline)) as commit_overlaps:
+                for commit_overlap in commit_overlaps:
+                    self.merge_commit_overlap(commit_map, commit_overlap)
+                    found.add(commit_overlap.commit.hash)
+
+                    if options.top_k is None:
+                        continue
+
+                    commit_score = commit_map[commit_overlap.commit.hash]
+                    if commit_score.score / commit_score.commit.size >= remaining + 1:
+                        settled.add(commit_overlap.commit.hash)
+
+                    if not checked and len(settled) >= options.top_k:
+                        checked = True
+
+                        if self.top_k_settled(commit_map, options.top_k, remaining, found):
+                            self.stopped = "top_k"
+                            break
+
+            if self.stopped is not None:
+                break
+
+        if self.stopped is None and deadline is not None and time.monotonic() >= deadline:
+            self.stopped = "deadline"
+
+        return self.sort_commit_scores(commit_map)
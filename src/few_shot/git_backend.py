@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import subprocess
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections.abc import Iterator
+
+from git import Repo
+
+# The Git operations of the similarity search, implemented with GitPython or in-process with libgit2 through pygit2.
+# Diffs are returned as the hunks of a zero context patch: the file and the hunk lines, starting with the @@ header.
+class GitBackend(ABC):
+    name: str
+    path: str
+
+    def __init__(self, path: str):
+        self.path = path
+
+    # The hunks of the modified files between two revisions. Without diff_from the index is compared, without
+    # diff_to the working tree, or the index when only the staged changes are asked for.
+    @abstractmethod
+    def diff_hunks(self, diff_from: str|None, diff_to: str|None = None, only_staged: bool = True) -> Iterator[tuple[str, list[str]]]:
+        ...
+
+    # The number of lines of a file at a revision
+    @abstractmethod
+    def line_count(self, revision: str, path: str) -> int:
+        ...
+
+    # The number of inserted and deleted lines of a commit
+    @abstractmethod
+    def stats(self, hash: str) -> tuple[int, int]:
+        ...
+
+    # The commits that last changed each line of a range of a file, as (hash, number of lines) pairs
+    @abstractmethod
+    def blame(self, revision: str, path: str, start: int, end: int) -> list[tuple[str, int]]:
+        ...
+
+    # The lines of a git log of the repository, read from the git process while it runs. libgit2 has no line log,
+    # so every backend runs git for this. At the deadline, a time.monotonic() value, git is stopped and the lines
+    # read until then are all that is returned.
+    def log_lines(self, *args: str, deadline: float|None = None) -> Iterator[str]:
+        process = subprocess.Popen(["git", "log", *args], cwd=self.path, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        timer = start_deadline_timer(deadline, process.terminate)
+
+        try:
+            for line in process.stdout:
+                yield line.decode('utf-8', errors='replace').rstrip('\r\n')
+
+            if process.wait() != 0 and not deadline_passed(deadline):
+                raise Exception(f"git log failed: {process.stderr.read().decode('utf-8', errors='replace').strip()}")
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+            # Stops git when the caller stopped reading early
+            if process.poll() is None:
+                process.terminate()
+
+            process.stdout.close()
+            process.stderr.close()
+            process.wait()
+
+def deadline_passed(deadline: float|None) -> bool:
+    return deadline is not None and time.monotonic() >= deadline
+
+# Call terminate at the deadline, git log -L can spend a long time on a long history before it writes a line
+def start_deadline_timer(deadline: float|None, terminate) -> threading.Timer|None:
+    if deadline is None:
+        return None
+
+    timer = threading.Timer(max(deadline - time.monotonic(), 0), terminate)
+    timer.daemon = True
+    timer.start()
+
+    return timer
+
+GIT_BACKENDS: dict[str, type[GitBackend]] = {}
+
+# Register a backend class so it can be selected with --git_backend
+def register_git_backend(cls: type[GitBackend]) -> type[GitBackend]:
+    GIT_BACKENDS[cls.name] = cls
+
+    return cls
+
+def create_git_backend(path: str, name: str = "gitpython") -> GitBackend:
+    return GIT_BACKENDS[name](path)
+
+# Git operations through GitPython, which runs a git process for diffs and stats
+@register_git_backend
+class GitPythonBackend(GitBackend):
+    name: str = "gitpython"
+    repo: Repo
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.repo = Repo(path)
+
+    def diff_hunks(self, diff_from: str|None, diff_to: str|None = None, only_staged: bool = True) -> Iterator[tuple[str, list[str]]]:
+        diffable = self.repo.index if diff_from is None else self.repo.commit(diff_from)
+
+        if only_staged:
+            index = diffable.diff(diff_to, staged=True, create_patch=True, unified=0)
+        else:
+            index = diffable.diff(diff_to, create_patch=True, unified=0)
+
+        # Only the modified files, added and deleted files have no history to overlap with
+        for diff_item in index.iter_change_type("M"):
+            diff_text = diff_item.diff.decode('utf-8', errors='replace') if isinstance(diff_item.diff, bytes) else diff_item.diff
+            hunk: list[str]|None = None
+
+            for line in diff_text.splitlines():
+                if line.startswith('@@'):
+                    if hunk is not None:
+                        yield diff_item.b_path, hunk
+
+                    hunk = []
+
+                hunk.append(line)
+
+            if hunk is not None:
+                yield diff_item.b_path, hunk
+
+    def line_count(self, revision: str, path: str) -> int:
+        return len(self.repo.commit(revision).tree[path].data_stream.read().splitlines())
+
+    def stats(self, hash: str) -> tuple[int, int]:
+        total = self.repo.commit(hash).stats.total
+
+        return total['insertions'], total['deletions']
+
+    def blame(self, revision: str, path: str, start: int, end: int) -> list[tuple[str, int]]:
+        return [(commit.hexsha, len(lines)) for commit, lines in self.repo.blame(revision, path, L=f"{start},{end}")]
+
+    def log_lines(self, *args: str, deadline: float|None = None) -> Iterator[str]:
+        process = self.repo.git.log(*args, as_process=True)
+        timer = start_deadline_timer(deadline, process.terminate)
+
+        try:
+            for line in process.stdout:
+                yield line.decode('utf-8', errors='replace').rstrip('\r\n')
+
+            # Raises a GitCommandError with the stderr of git when it failed
+            if not deadline_passed(deadline):
+                process.wait()
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+            if process.poll() is None:
+                process.terminate()
+
+# Git operations in-process with libgit2, diffs, blobs and stats are read from the object database without a git process
+@register_git_backend
+class Pygit2Backend(GitBackend):
+    name: str = "pygit2"
+    repo: object
+
+    def __init__(self, path: str):
+        super().__init__(path)
+
+        # pygit2 is optional, it is only needed when this backend is used
+        import pygit2
+
+        self.repo = pygit2.Repository(path)
+
+    def diff_hunks(self, diff_from: str|None, diff_to: str|None = None, only_staged: bool = True) -> Iterator[tuple[str, list[str]]]:
+        # Repository.diff(cached=True) compares with the index through Tree.diff_to_index, which ignores context_lines,
+        # the staged changes are compared from the index instead
+        if diff_from is None:
+            diff = self.repo.index.diff_to_tree(self.repo.revparse_single("HEAD").tree, context_lines=0) if only_staged else self.repo.diff(context_lines=0)
+        elif diff_to is None:
+            if only_staged:
+                diff = self.repo.index.diff_to_tree(self.repo.revparse_single(diff_from).tree, context_lines=0)
+            else:
+                diff = self.repo.diff(diff_from, context_lines=0)
+        else:
+            diff = self.repo.diff(diff_from, diff_to, context_lines=0)
+
+        for patch in diff:
+            if patch.delta.status_char() != 'M':
+                continue
+
+            for hunk in patch.hunks:
+                lines = [hunk.header.rstrip('\r\n')]
+                lines += [line.origin + line.content.rstrip('\r\n') for line in hunk.lines if line.origin in '+- ']
+
+                yield patch.delta.new_file.path, lines
+
+    def line_count(self, revision: str, path: str) -> int:
+        commit = self.repo.revparse_single(revision)
+
+        return len(self.repo[commit.tree[path].id].data.splitlines())
+
+    def stats(self, hash: str) -> tuple[int, int]:
+        commit = self.repo.revparse_single(hash)
+
+        # Like git, a merge commit is compared with its first parent and the root commit with an empty tree
+        if len(commit.parents) > 0:
+            diff = self.repo.diff(commit.parents[0], commit)
+        else:
+            diff = commit.tree.diff_to_tree(swap=True)
+
+        return diff.stats.insertions, diff.stats.deletions
+
+    def blame(self, revision: str, path: str, start: int, end: int) -> list[tuple[str, int]]:
+        blame = self.repo.blame(path, newest_commit=self.repo.revparse_single(revision).id, min_line=start, max_line=end)
+
+        return [(str(hunk.final_commit_id), hunk.lines_in_hunk) for hunk in blame]
@@ -1,9 +1,37 @@
+import atexit
 import os
 import datetime
+import queue
+import threading
 
-# A simple logging utility to write log messages to a file and optionally display them on the console
+# Log levels, messages below the level of the logger are dropped
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVELS = {
+	"debug": DEBUG,
+	"info": INFO,
+	"warning": WARNING,
+	"error": ERROR
+}
+
+# A logging utility to write log messages to a file and optionally display them on the console.
+# Messages are queued and written in batches by a background thread, so logging does not wait on the file.
 class Logger:
-	def __init__(self, name: str, folder: str = "./logs"):
+	log_file: str
+	level: int
+	console_level: int
+	console_sample_rate: float
+	console_credit: float = 0
+	batch_size: int
+	flush_interval: float
+	queue: queue.SimpleQueue
+	thread: threading.Thread
+	closed: bool = False
+
+	def __init__(self, name: str, folder: str = "./logs", level: int = DEBUG, console_level: int = DEBUG, console_sample_rate: float = 1, batch_size: int = 1000, flush_interval: float = 0.5):
 		# Generate a timestamp for unique log file naming
 		date_time = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
 
@@ -14,14 +42,97 @@ class Logger:
 		if not os.path.exists(os.path.dirname(self.log_file)):
 			os.makedirs(os.path.dirname(self.log_file))
 
-	# Write a log message to the log file and optionally print it to the console
-	def print(self, message="", to_console=True):
-		with open(self.log_file, 'a', encoding="utf-8") as f:
-			f.write(message + '\n')
-		
-		if to_console:
+		self.level = level
+		self.console_level = console_level
+		self.console_sample_rate = console_sample_rate
+		self.batch_size = batch_size
+		self.flush_interval = flush_interval
+		self.queue = queue.SimpleQueue()
+
+		self.thread = threading.Thread(target=self.write_loop, daemon=True)
+		self.thread.start()
+
+		# Write the remaining messages when the program exits
+		atexit.register(self.close)
+
+	# Queue a log message for the log file and optionally print it to the console
+	def print(self, message="", to_console=True, level=INFO):
+		if level < self.level:
+			return
+
+		self.queue.put(message)
+
+		if to_console and self.should_print(level):
 			print(message)
 
-	# Placeholder method for compatibility with logging interfaces requiring a flush method but currently does nothing.
+	# Print a sample of the messages to the console, warnings and errors are always printed
+	def should_print(self, level: int) -> bool:
+		if level < self.console_level:
+			return False
+		if level >= WARNING or self.console_sample_rate >= 1:
+			return True
+
+		self.console_credit += self.console_sample_rate
+
+		if self.console_credit >= 1:
+			self.console_credit -= 1
+			return True
+
+		return False
+
+	# Write the queued messages in batches until the logger is closed
+	def write_loop(self):
+		with open(self.log_file, 'a', encoding="utf-8") as f:
+			while True:
+				try:
+					item = self.queue.get(timeout=self.flush_interval)
+				except queue.Empty:
+					continue
+
+				batch = []
+				done = []
+
+				while True:
+					# Events are flush requests and None closes the logger, both after writing the messages before them
+					if isinstance(item, threading.Event):
+						done.append(item)
+					elif item is None:
+						done.append(None)
+						break
+					else:
+						batch.append(item + '\n')
+
+					if len(batch) >= self.batch_size:
+						break
+
+					try:
+						item = self.queue.get_nowait()
+					except queue.Empty:
+						break
+
+				f.write(''.join(batch))
+				f.flush()
+
+				for event in done:
+					if event is None:
+						return
+
+					event.set()
+
+	# Wait until all queued messages are written to the log file
 	def flush(self):
-		pass
\ No newline at end of file
+		if self.closed:
+			return
+
+		event = threading.Event()
+		self.queue.put(event)
+		event.wait()
+
+	# Write the remaining messages and stop the background thread
+	def close(self):
+		if self.closed:
+			return
+
+		self.closed = True
+		self.queue.put(None)
+		self.thread.join()
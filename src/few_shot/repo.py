@@ -73,5 +73,5 @@ class ManagedRepo:
 		print()
 
 	# Create an instance of SimilarCommitSearch for the repository
-	def get_similarity_search(self, padding: int):
-		return SimilarCommitSearch(self.folder, self.logger, padding)
\ No newline at end of file
+	def get_similarity_search(self, padding: int, keep_text: bool = False, git_backend: str = "gitpython"):
+		return SimilarCommitSearch(self.folder, self.logger, padding, keep_text, git_backend)
\ No newline at end of file
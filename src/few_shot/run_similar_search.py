@@ -1,10 +1,18 @@
+import argparse
 from math import ceil
 import os
+import sys
 from pandas import DataFrame, read_csv
-from logger import Logger
+from logger import DEBUG, ERROR, LEVELS, WARNING, Logger
 import traceback
 
 from repo import ManagedRepo
+from commit_similar import SearchOptions
+from git_backend import GIT_BACKENDS
+
+# The profiling module is shared with the scripts in the parent folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from profiling import add_profile_arguments, span, start_profiling, stop_profiling
 
 #  Class to perform a similarity search experiment on commit messages
 class SimilaritySearchExperiment:
@@ -13,14 +21,18 @@ class SimilaritySearchExperiment:
 	output_file: str
 	items: int
 	change_block_padding: int
+	git_backend: str
+	search_options: SearchOptions
 	logger: Logger
 
-	def __init__(self, input_file: str, output_file: str, logger: Logger, items: int = 10, change_block_padding: int = 3, ):
+	def __init__(self, input_file: str, output_file: str, logger: Logger, items: int = 10, change_block_padding: int = 3, git_backend: str = "gitpython", search_options: SearchOptions|None = None):
 		self.input_file = input_file
 		self.output_file = output_file
 		self.logger = logger
 		self.items = items
 		self.change_block_padding = change_block_padding
+		self.git_backend = git_backend
+		self.search_options = SearchOptions() if search_options is None else search_options
 
 	# Generate a prompt for cases where no similar commits are found
 	def empty_prompt(self, diff: str):
@@ -77,23 +89,31 @@ and context demonstrated by the above examples.
 			self.logger.print(f"({i}) Handeling commit {item['hash'][:7]} ({message_text}) found at https://github.com/{author}/{project}/commit/{item['hash'][:7]}")
 
 			repo = ManagedRepo(author, project, self.logger)
+			hash = item['hash']
 
-			if not repo.is_cloned():
-				repo.clone()
-			else:
-				self.logger.print("Repo already cloned")
+			with span("similar_search.clone", hash):
+				if not repo.is_cloned():
+					repo.clone()
+				else:
+					self.logger.print("Repo already cloned")
 
-			hash = item['hash']
 			diff_from = f"{hash}~"
 			diff_to = hash
 
-			sim = repo.get_similarity_search(self.change_block_padding)
-			commit_scores = sim.search(diff_from=diff_from, diff_to=diff_to, only_staged=False)
+			sim = repo.get_similarity_search(self.change_block_padding, git_backend=self.git_backend)
+			with span("similar_search.search", hash):
+				commit_scores = sim.search(diff_from=diff_from, diff_to=diff_to, only_staged=False, options=self.search_options)
+
+			# A search stopped at the deadline keeps the best commits of the history it walked
+			if sim.stopped == "deadline":
+				self.logger.print(f"Search stopped after {self.search_options.deadline}s, using the commits found until then", level=WARNING)
+
+			self.df.at[item.name, 'similar_search_stopped'] = sim.stopped or ''
 
 			self.logger.print(f"Found {len(commit_scores)} commits (sorted by score):")
 
 			for commit_score in commit_scores:
-				self.logger.print(f"|> {commit_score.commit.hash[:7]} - score {commit_score.score:.4f} ({commit_score.commit.message[:128]})")
+				self.logger.print(f"|> {commit_score.commit.hash[:7]} - score {commit_score.score:.4f} ({commit_score.commit.message[:128]})", level=DEBUG)
 
 			# Remove commit if the commit hash is the same as the current commit
 			commit_scores = [commit_score for commit_score in commit_scores if commit_score.commit.hash != hash]
@@ -135,9 +155,10 @@ and context demonstrated by the above examples.
 			else:
 				prompt = self.empty_prompt(item['diff'])
 		except Exception as e:
-			self.logger.print(f"Error: {e}")
+			self.logger.print(f"Error: {e}", level=ERROR)
 			traceback.print_exc()
 			
+			self.df.at[item.name, 'similar_search_stopped'] = ''
 			self.df.at[item.name, 'nr_similar_commits'] = 0
 			self.df.at[item.name, 'nr_similar_commits_score_limit'] = 0
 			self.df.at[item.name, 'nr_similar_commits_3_cap'] = 0
@@ -156,14 +177,19 @@ and context demonstrated by the above examples.
 
 	# Run the experiment by processing each item in the dataset
 	def run(self):
-		self.df = self.read()
+		with span("similar_search.read"):
+			self.df = self.read()
 
 		for i in range(self.items):
-			self.handle_item(self.df.iloc[i], i)
+			item = self.df.iloc[i]
+
+			with span("similar_search.item", item['hash']):
+				self.handle_item(item, i)
 
 			self.logger.print()
 
-		self.save()
+		with span("similar_search.save"):
+			self.save()
 
 current_folder = os.path.dirname(os.path.abspath(__file__))
 
@@ -172,6 +198,30 @@ CHANGE_BLOCK_PADDING = 3
 INPUT_FILE = current_folder + '/../commitbench_subset.csv'
 OUTPUT_FILE = current_folder + '/../commitbench_subset_similar.csv'
 
-log = Logger("few_shot")
-experiment = SimilaritySearchExperiment(INPUT_FILE, OUTPUT_FILE, log, ITEMS, CHANGE_BLOCK_PADDING)
-experiment.run()
+parser = argparse.ArgumentParser(description="Find similar commits for every item of the dataset and build the few-shot prompts.")
+
+parser.add_argument("--items", type=int, default=ITEMS, help="The number of items to process.")
+parser.add_argument("--change_block_padding", type=int, default=CHANGE_BLOCK_PADDING, help="The number of lines around a change block to search for overlapping commits.")
+parser.add_argument("--input_file", type=str, default=INPUT_FILE, help="The dataset file.")
+parser.add_argument("--output_file", type=str, default=OUTPUT_FILE, help="The file to save the dataset with the similar commits to.")
+parser.add_argument("--git_backend", type=str, default="gitpython", choices=GIT_BACKENDS.keys(), help="The library used to read diffs, file contents and commit stats, pygit2 reads them in-process with libgit2.")
+parser.add_argument("--deadline", type=float, default=None, help="The seconds the search of one item may take, the commits found until then are used.")
+parser.add_argument("--max_depth", type=int, default=None, help="The number of historical commits walked per change block.")
+parser.add_argument("--since", type=str, default=None, help="Only walk the commits after this date, in any format git log --since accepts.")
+parser.add_argument("--top_k", type=int, default=None, help="Stop walking the history once the best top_k commits can no longer change, use 3 or more as the prompts use the best 3. The nr_similar_commits columns then only count the commits walked.")
+parser.add_argument("--log_level", type=str, default="debug", choices=LEVELS.keys(), help="The lowest level of the messages written to the log file.")
+parser.add_argument("--console_level", type=str, default="debug", choices=LEVELS.keys(), help="The lowest level of the messages printed to the console.")
+parser.add_argument("--console_sample_rate", type=float, default=1, help="The fraction of the messages printed to the console, warnings and errors are always printed.")
+add_profile_arguments(parser)
+
+if __name__ == "__main__":
+	args = parser.parse_args()
+	start_profiling(args)
+
+	log = Logger("few_shot", level=LEVELS[args.log_level], console_level=LEVELS[args.console_level], console_sample_rate=args.console_sample_rate)
+	experiment = SimilaritySearchExperiment(args.input_file, args.output_file, log, args.items, args.change_block_padding, args.git_backend, SearchOptions(args.deadline, args.max_depth, args.since, args.top_k))
+	experiment.run()
+
+	log.close()
+	stop_profiling(args, "similar_search")
+
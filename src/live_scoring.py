@@ -0,0 +1,99 @@
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from clean import clean_message
+
+METRICS = ["bleu", "meteor", "rouge_l"]
+
+# Cleans and scores the generated messages while the experiment is still generating, on a worker thread so the
+# generation never waits for the scoring. The running averages of the cleaned messages are printed every few items,
+# and the run can be aborted once enough items are scored and the averages are too low to be worth finishing.
+class LiveScorer:
+    prompt_type: str
+    # Shown in front of the reports, to tell the scorers of the temperatures of one run apart
+    name: str
+    report_every: int
+    abort_metric: str
+    abort_below: float|None
+    abort_after: int
+    executor: ThreadPoolExecutor
+    lock: threading.Lock
+    totals: dict[str, float]
+    count: int = 0
+    aborted: bool = False
+    evaluate_metrics = None
+
+    def __init__(self, prompt_type: str, report_every: int = 25, abort_metric: str = "rouge_l", abort_below: float|None = None, abort_after: int = 50, name: str = ""):
+        self.prompt_type = prompt_type
+        self.name = name
+        self.report_every = report_every
+        self.abort_metric = abort_metric
+        self.abort_below = abort_below
+        self.abort_after = abort_after
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.lock = threading.Lock()
+        self.totals = {metric: 0 for metric in METRICS}
+
+    def submit(self, true_message: str, generated_message: str):
+        self.executor.submit(self.score, true_message, generated_message)
+
+    def score(self, true_message: str, generated_message: str):
+        # The scoring dependencies are only loaded once the first message is scored
+        if self.evaluate_metrics is None:
+            from post_processing.evaluate import evaluate_metrics
+
+            self.evaluate_metrics = evaluate_metrics
+
+        try:
+            cleaned = clean_message(generated_message, self.prompt_type) if isinstance(generated_message, str) else ""
+            scores = self.evaluate_metrics(true_message if isinstance(true_message, str) else "", cleaned)
+        except Exception as e:
+            print(f"Error scoring item: {e}")
+            return
+
+        with self.lock:
+            self.count += 1
+
+            for metric, score in zip(METRICS, scores):
+                self.totals[metric] += score
+
+            if self.count % self.report_every == 0:
+                print(self.report())
+
+            if self.abort_below is not None and self.count >= self.abort_after and self.mean(self.abort_metric) < self.abort_below:
+                if not self.aborted:
+                    print(f"{self.prefix()}Aborting, the mean {self.abort_metric} of {self.mean(self.abort_metric):.4f} after {self.count} items is below {self.abort_below}")
+
+                self.aborted = True
+
+    def mean(self, metric: str) -> float:
+        return self.totals[metric] / self.count if self.count > 0 else 0
+
+    def prefix(self) -> str:
+        return f"{self.name}: " if self.name else ""
+
+    def report(self) -> str:
+        return f"{self.prefix()}Scores after {self.count} items: BLEU {self.mean('bleu'):.4f}, METEOR {self.mean('meteor'):.4f}, ROUGE-L {self.mean('rouge_l'):.4f}"
+
+    # Wait for the queued items and print the final averages
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+        if self.count > 0:
+            print(self.report())
+
+# Add the arguments of the live scoring to a parser
+def add_live_scoring_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--live_scores", action="store_true", help="Clean and score the messages while generating and print the running BLEU, METEOR and ROUGE-L of the cleaned messages.")
+    parser.add_argument("--live_report_every", type=int, default=25, help="Print the running scores every this many items.")
+    parser.add_argument("--abort_below", type=float, default=None, help="Stop the experiment when the running score drops below this value.")
+    parser.add_argument("--abort_metric", type=str, default="rouge_l", choices=METRICS, help="The running score compared with --abort_below.")
+    parser.add_argument("--abort_after", type=int, default=50, help="The number of scored items before the experiment can be stopped.")
+
+# The live scorer of an experiment with the given prompt, or None when live scoring is off
+def create_live_scorer(args: argparse.Namespace, prompt_type: str, name: str = "") -> LiveScorer|None:
+    if not args.live_scores and args.abort_below is None:
+        return None
+
+    return LiveScorer(prompt_type, args.live_report_every, args.abort_metric, args.abort_below, args.abort_after, name)
@@ -1,32 +1,45 @@
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
-import ollama
-from pandas import read_csv, DataFrame
+from pandas import DataFrame
 import argparse
 import time
 
-from post_processing.post_processing_csv import read_and_evaluate_files
-from post_processing.graphs import read_from_files_for_graphs
-from clean import clean_folder
+from prompt_template import prefix_key
+from backends import Backend, Generation, OllamaBackend, add_backend_arguments, create_backend
+from metrics import MetricsExport, add_metrics_arguments
+from profiling import add_profile_arguments, span, start_profiling, stop_profiling
+from dataset import read_table
+from rerank import Reranker
+from live_scoring import LiveScorer, add_live_scoring_arguments, create_live_scorer
+from cancellation import CancellationToken, Cancelled, with_token
 
 # The base class for all the models providing common functionalities
 class Model:
     name: str = ""
+    backend: Backend
+
+    def __init__(self, backend: Backend|None = None):
+        self.backend = backend if backend is not None else OllamaBackend()
+
+    # Generate a response with the statistics of the backend based on the provided prompt and options
+    def generate(self, prompt: str, temperature: float, repeat_penalty: float = 1.1) -> Generation:
+        return self.backend.generate(self.name, prompt, {"temperature": temperature, "repeat_penalty": repeat_penalty})
+
+    # Generate several samples for the prompt in one batch
+    def generate_n(self, prompt: str, temperature: float, repeat_penalty: float, n: int) -> list[Generation]:
+        return self.backend.generate_n(self.name, prompt, {"temperature": temperature, "repeat_penalty": repeat_penalty}, n)
+
+    # Generate the prompt at every temperature, the prompt is only prefilled for the first one
+    def generate_temperatures(self, prompt: str, temperatures: list[float], repeat_penalty: float = 1.1) -> list[Generation]:
+        return self.backend.generate_temperatures(self.name, prompt, {"repeat_penalty": repeat_penalty}, temperatures)
 
     # Generate a response based on the provided prompt and options
     def run(self, prompt: str, temperature: float, repeat_penalty: float = 1.1) -> str:
-        response = ollama.generate(model=self.name, prompt=prompt, options={"temperature": temperature, "repeat_penalty": repeat_penalty})
-
-        return response.response
+        return self.generate(prompt, temperature, repeat_penalty).text
     
     # This will check if the model is installed
     def check_installed(self) -> bool:
-        try:
-            ollama.show(self.name)
-
-            return True
-        except:
-            return False
+        return self.backend.check_installed(self.name)
     
 # Specific models implementations with predefined names   
 class MistralModel(Model):
@@ -51,16 +64,31 @@ class Experiment:
     start_time: float = 0
     workers: int
     temperature: float
-
-    def __init__(self, model: Model, input_size: int, process_amount: int, prompt: str, input_folder: str, output_folder: str, workers: int, temperature: float):
+    completion_tokens: int = 0
+    load_time: float = 0
+    quiet: bool
+    best_of: int
+    reranker: Reranker
+    best_of_time: float = 0
+    single_sample_time: float = 0
+    scorer: LiveScorer|None
+    # Cancels the generations in flight when the run is interrupted or aborted
+    token: CancellationToken
+
+    def __init__(self, model: Model, input_size: int, process_amount: int, prompt: str, input_folder: str, output_folder: str, workers: int, temperature: float, quiet: bool = False, input_format: str = "csv", best_of: int = 1, scorer: LiveScorer|None = None):
         self.model = model
+        self.quiet = quiet
+        self.best_of = best_of
+        self.reranker = Reranker()
+        self.scorer = scorer
+        self.token = CancellationToken()
         self.input_size = input_size
         self.process_amount = process_amount
         self.prompt = prompt
         self.workers = workers
         self.temperature = temperature
-        self.input_file = f"{input_folder}/{model.name}_{input_size}_{prompt}.csv"
-        self.output_file = f"{output_folder}/{model.name}_{process_amount}_{prompt}_{temperature}.csv"
+        self.input_file = f"{input_folder}/{model.name}_{input_size}_{prompt}.{input_format}"
+        self.output_file = f"{output_folder}/{model.name}_{process_amount}_{prompt}_{temperature}{f'_best{best_of}' if best_of > 1 else ''}.csv"
         
         self.output_df = DataFrame(columns=["hash", "project", "true_message", "generated_message"])
 
@@ -75,28 +103,56 @@ class Experiment:
         
     # Read input from the CSV file    
     def read_input(self):
-        self.input_df = read_csv(self.input_file)
+        with span("main.read_input", self.input_file):
+            self.input_df = read_table(self.input_file)
+
+    # The file an output is saved to. A run aborted by the live scores only has the items generated until then, so it
+    # gets an .aborted suffix and cleaning, the pipeline and the evaluation never take it for a complete run.
+    def saved_file(self, output_file: str) -> str:
+        return f"{output_file}.aborted" if self.should_abort() else output_file
 
     # Save output to the ouput CSV file
     def save_output(self):
-        self.output_df.to_csv(self.output_file, index=False)
+        output_file = self.saved_file(self.output_file)
+
+        with span("main.save_output", output_file):
+            self.output_df.to_csv(output_file, index=False)
+
+        if self.should_abort():
+            print(f"Saved the {len(self.output_df)} messages generated before aborting to {output_file}")
 
     # Process a single item using the model
     def process_item(self, index: int, temperature: float) -> dict:
         item = self.input_df.iloc[index]
         prompt = item['prompt']
 
-        # Generate a message using the model
-        generated_message = self.model.run(prompt, temperature, 1.5 if self.prompt == "cot" else 1.1)
+        repeat_penalty = 1.5 if self.prompt == "cot" else 1.1
+        start = time.perf_counter()
 
-        print(f"t: {item['true_message']}")
-        print(f"g: {generated_message}")
+        # Generate a message using the model, or the best of several samples
+        with span("main.generate", item['hash']):
+            if self.best_of > 1:
+                generations = self.model.generate_n(prompt, temperature, repeat_penalty, self.best_of)
+                generation = generations[self.reranker.best([generation.text for generation in generations])]
+            else:
+                generations = [self.model.generate(prompt, temperature, repeat_penalty)]
+                generation = generations[0]
+        generated_message = generation.text
+
+        if not self.quiet:
+            print(f"t: {item['true_message']}")
+            print(f"g: {generated_message}")
 
         return {
             "hash": item['hash'],
             "project": item['project'],
             "true_message": item['true_message'],
-            "generated_message": generated_message
+            "generated_message": generated_message,
+            "completion_tokens": sum(generation.completion_tokens for generation in generations),
+            "load_duration": generation.load_duration,
+            "generate_time": time.perf_counter() - start,
+            # The fastest sample is what a single generation would have cost
+            "single_sample_time": min(generation.total_duration for generation in generations)
         }
     
     # Display progress of the experiment
@@ -107,6 +163,22 @@ class Experiment:
         print(f"Progress: {completed}/{total} ({(completed/total)*100:.2f}%) done. Elapsed {time_elapsed:.2f}s, remaining: {time_remaining:.2f}s")
 
     
+    # Display the throughput of the whole run, to compare backends on the same prompts
+    def print_summary(self):
+        time_elapsed = time.time() - self.start_time
+
+        print(f"Generated {len(self.output_df)} messages with {self.model.backend.name} in {time_elapsed:.2f}s: {len(self.output_df)/time_elapsed:.2f} items/s, {self.completion_tokens/time_elapsed:.2f} tokens/s")
+
+        if self.best_of > 1 and len(self.output_df) > 0:
+            extra_time = (self.best_of_time - self.single_sample_time) / len(self.output_df)
+
+            print(f"Best of {self.best_of}: {self.best_of_time/len(self.output_df):.2f}s per item against {self.single_sample_time/len(self.output_df):.2f}s for a single sample, {extra_time/(self.best_of - 1):.2f}s per extra sample")
+
+        report = self.model.backend.report()
+
+        if report:
+            print(report)
+
     def append_result(self, index: int, result: dict):
         self.output_df.loc[index] = [
             result['hash'],
@@ -114,6 +186,22 @@ class Experiment:
             result['true_message'],
             result['generated_message']
         ]
+        self.completion_tokens += result['completion_tokens']
+        self.load_time += result['load_duration']
+        self.best_of_time += result['generate_time']
+        self.single_sample_time += result['single_sample_time']
+
+        if self.scorer is not None:
+            self.scorer.submit(result['true_message'], result['generated_message'])
+
+    # Stop generating when the live scores show the run is not worth finishing
+    def should_abort(self) -> bool:
+        return self.scorer is not None and self.scorer.aborted
+
+    # Wait for the scoring of the last items
+    def finish_scoring(self):
+        if self.scorer is not None:
+            self.scorer.close()
 
     def append_error(self, index: int):
         item = self.input_df.iloc[index]
@@ -128,9 +216,20 @@ class Experiment:
     def start(self):
         self.start_time = time.time()
 
+    # Order the items so prompts sharing the same static prefix are sent back to back, which lets the backend reuse the KV cache of that prefix
+    def item_order(self) -> list[int]:
+        prompts = self.input_df['prompt']
+
+        return sorted(range(self.process_amount), key=lambda i: prefix_key(prompts.iloc[i]))
+
+    # Drop the queued items and stop the generations in flight, they stop at their next token instead of running to the end
+    def cancel(self, executor: ThreadPoolExecutor):
+        self.token.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+
     def run_parallel(self):
         with ThreadPoolExecutor(max_workers=self.workers) as executor:
-            futures = {executor.submit(self.process_item, i, self.temperature): i for i in range(self.process_amount)}
+            futures = {executor.submit(with_token, self.token, self.process_item, i, self.temperature): i for i in self.item_order()}
             total = len(futures)
             completed = 0
 
@@ -146,30 +245,143 @@ class Experiment:
 
                         completed += 1
                         self.print_progress(completed, total)
+                    except Cancelled:
+                        continue
                     except Exception as e:
                         print(f"Error processing item {index}: {e}")
                         self.append_error(index)
+
+                    if self.should_abort():
+                        self.cancel(executor)
+                        break
             except KeyboardInterrupt:
                 print("Interrupted")
-                executor.shutdown(wait=False, cancel_futures=True)
+                self.cancel(executor)
                 raise KeyboardInterrupt()
 
+        self.finish_scoring()
+
     def run(self):
         self.start()
 
-        for i in range(self.process_amount):
+        for completed, i in enumerate(self.item_order()):
             try:
-                result = self.process_item(i, self.temperature)
+                result = with_token(self.token, self.process_item, i, self.temperature)
                 self.append_result(i, result)
-                self.print_progress(i+1, self.process_amount)
+                self.print_progress(completed+1, self.process_amount)
             except Exception as e:
                 print(f"Error processing item {i}: {e}")
                 self.append_error(i)
 
+            if self.should_abort():
+                break
+
+        self.finish_scoring()
+
+# Runs the experiment at several temperatures in one pass, every prompt is generated at all temperatures at once
+# so it is prefilled once, and every temperature gets the same output file as a separate run
+class MultiTemperatureExperiment(Experiment):
+    temperatures: list[float]
+    output_files: dict[float, str]
+    output_dfs: dict[float, DataFrame]
+    prefill_time: float = 0
+    prefill_saved: float = 0
+    # The live scorer of every temperature
+    scorers: dict[float, LiveScorer]
+
+    def __init__(self, model: Model, input_size: int, process_amount: int, prompt: str, input_folder: str, output_folder: str, workers: int, temperatures: list[float], quiet: bool = False, input_format: str = "csv", scorers: dict[float, LiveScorer]|None = None):
+        super().__init__(model, input_size, process_amount, prompt, input_folder, output_folder, workers, temperatures[0], quiet, input_format)
+        self.temperatures = temperatures
+        self.scorers = scorers if scorers is not None else {}
+        self.output_files = {temperature: f"{output_folder}/{model.name}_{process_amount}_{prompt}_{temperature}.csv" for temperature in temperatures}
+        self.output_dfs = {temperature: DataFrame(columns=["hash", "project", "true_message", "generated_message"]) for temperature in temperatures}
+
+        # The summary counts the items of the first temperature
+        self.output_df = self.output_dfs[temperatures[0]]
+
+    def save_output(self):
+        for temperature, output_file in self.output_files.items():
+            output_file = self.saved_file(output_file)
+
+            with span("main.save_output", output_file):
+                self.output_dfs[temperature].to_csv(output_file, index=False)
+
+        if self.should_abort():
+            print(f"Saved the {len(self.output_df)} messages per temperature generated before aborting with an .aborted suffix")
+
+    # All temperatures share every generation, so the run only stops once the scores of all of them are too low
+    def should_abort(self) -> bool:
+        return len(self.scorers) > 0 and all(scorer.aborted for scorer in self.scorers.values())
+
+    def finish_scoring(self):
+        for scorer in self.scorers.values():
+            scorer.close()
+
+    def process_item(self, index: int, temperature: float) -> dict:
+        item = self.input_df.iloc[index]
+
+        with span("main.generate", item['hash']):
+            generations = self.model.generate_temperatures(item['prompt'], self.temperatures, 1.5 if self.prompt == "cot" else 1.1)
+
+        if not self.quiet:
+            print(f"t: {item['true_message']}")
+
+            for temperature, generation in zip(self.temperatures, generations):
+                print(f"g ({temperature}): {generation.text}")
+
+        # Without the reuse, every temperature would have taken as long as the first one to prefill
+        prefill_time = sum(generation.prompt_duration for generation in generations)
+        prefill_without_reuse = generations[0].prompt_duration * len(generations)
+
+        return {
+            "hash": item['hash'],
+            "project": item['project'],
+            "true_message": item['true_message'],
+            "generated_messages": [generation.text for generation in generations],
+            "completion_tokens": sum(generation.completion_tokens for generation in generations),
+            "load_duration": generations[0].load_duration,
+            "prefill_time": prefill_time,
+            "prefill_saved": max(prefill_without_reuse - prefill_time, 0)
+        }
+
+    def append_result(self, index: int, result: dict):
+        for temperature, generated_message in zip(self.temperatures, result['generated_messages']):
+            self.output_dfs[temperature].loc[index] = [
+                result['hash'],
+                result['project'],
+                result['true_message'],
+                generated_message
+            ]
+
+            if temperature in self.scorers:
+                self.scorers[temperature].submit(result['true_message'], generated_message)
+        self.completion_tokens += result['completion_tokens']
+        self.load_time += result['load_duration']
+        self.prefill_time += result['prefill_time']
+        self.prefill_saved += result['prefill_saved']
+
+    def append_error(self, index: int):
+        item = self.input_df.iloc[index]
+
+        for output_df in self.output_dfs.values():
+            output_df.loc[index] = [
+                item['hash'],
+                item['project'],
+                item['true_message'],
+                ""
+            ]
+
+    def print_summary(self):
+        super().print_summary()
+
+        total = self.prefill_time + self.prefill_saved
+
+        print(f"Prefilled every prompt once for {len(self.temperatures)} temperatures: {self.prefill_time:.2f}s prefilling, {self.prefill_saved:.2f}s saved ({(self.prefill_saved/total if total > 0 else 0)*100:.2f}% of the prefill compute)")
+
 MODELS = {
-    "mistral": MistralModel(),
-    "codellama": CodellamaModel(),
-    "phi3.5": Phi35Model()
+    "mistral": MistralModel,
+    "codellama": CodellamaModel,
+    "phi3.5": Phi35Model
 }
 EXPERIMENTS = ["baseline", "fewshot", "cot"]
 
@@ -187,20 +399,70 @@ parser.add_argument("--workers", type=int, default=5, help="The number of worker
 parser.add_argument("--get_result_file",action="store_true",help="Get the scores for obtained results")
 parser.add_argument("--draw_graphs",action="store_true",help="Draw the graphs")
 parser.add_argument("--clean_output",action="store_true",help="Clean the output files")
+parser.add_argument("--sweep", type=str, default=None, help="Run a grid of experiments, given as a JSON file or as 'model=mistral,phi3.5;prompt=fewshot;temperature=0.0,0.7'. Missing axes use --model, --prompt and --temperature.")
+parser.add_argument("--sweep_report", type=str, default="./results/sweep_report.csv", help="The file to save the wall time and model load time of every sweep cell to, outside of the output folder so it is not cleaned or scored as an output.")
+parser.add_argument("--quiet", action="store_true", help="Do not print the true and generated message of every item.")
+parser.add_argument("--temperatures", type=float, nargs="+", default=None, help="Generate every prompt at all of these temperatures in one pass, with one output file per temperature.")
+parser.add_argument("--best_of", type=int, default=1, help="Sample this many messages per item and keep the one that agrees most with the others.")
+parser.add_argument("--input_format", type=str, default="csv", choices=["csv", "arrow"], help="Read the input files as CSV or as memory-mapped Arrow files.")
+add_backend_arguments(parser)
+add_metrics_arguments(parser)
+add_profile_arguments(parser)
+add_live_scoring_arguments(parser)
 
 if __name__ == "__main__":
     args = parser.parse_args()
+
+    # A multi-temperature run generates one sample per temperature, and a sweep takes its temperatures from the grid
+    if args.temperatures and args.best_of > 1:
+        parser.error("--temperatures cannot be combined with --best_of, run every temperature with --temperature instead")
+    if args.temperatures and args.sweep:
+        parser.error("--temperatures is not used by --sweep, give the temperatures in the grid instead, for example 'temperature=0.0,0.7'")
+
+    start_profiling(args)
+
+    # The cleaning, scoring and graph dependencies are only imported by their own commands, a generation run never loads them
     if args.clean_output:
-        clean_folder()
+        from clean import clean_folder
+
+        with span("clean"):
+            clean_folder()
     elif args.get_result_file or args.draw_graphs:
         if args.get_result_file:
-            read_and_evaluate_files()
+            from post_processing.post_processing_csv import read_and_evaluate_files
+
+            with span("evaluate"):
+                read_and_evaluate_files()
 
         if args.draw_graphs:
-            read_from_files_for_graphs()
+            from post_processing.graphs import read_from_files_for_graphs
+
+            with span("graphs"):
+                read_from_files_for_graphs()
+    elif args.sweep:
+        from sweep import Sweep, parse_grid
+
+        metrics = MetricsExport(create_backend(args), args)
+        backend = metrics.backend
+        grid = parse_grid(args.sweep, {"model": [args.model], "prompt": [args.prompt], "temperature": [args.temperature]})
+
+        os.makedirs(args.output_folder, exist_ok=True)
+
+        sweep = Sweep(grid, backend, lambda model, prompt, temperature: Experiment(MODELS[model](backend), args.input_size, args.process_amount, prompt, args.input_folder, args.output_folder, args.workers, temperature, args.quiet, args.input_format, args.best_of, create_live_scorer(args, prompt)), args.sequential)
+        with span("sweep"):
+            sweep.run()
+        os.makedirs(os.path.dirname(args.sweep_report) or ".", exist_ok=True)
+        sweep.save_report(args.sweep_report)
+
+        if backend.report():
+            print(backend.report())
+
+        metrics.stop()
+        backend.close()
     else:
         model_name = args.model
-        model = MODELS[model_name]
+        metrics = MetricsExport(create_backend(args), args)
+        model = MODELS[model_name](metrics.backend)
         prompt = args.prompt
         input_size = args.input_size
         process_amount = args.process_amount
@@ -212,13 +474,23 @@ if __name__ == "__main__":
 
         os.makedirs(output_folder, exist_ok=True)
 
-        experiment = Experiment(model, input_size, process_amount, prompt, input_folder, output_folder, workers, temperature)
+        if args.temperatures:
+            scorers = {temperature: create_live_scorer(args, prompt, f"Temperature {temperature}") for temperature in args.temperatures}
+            experiment = MultiTemperatureExperiment(model, input_size, process_amount, prompt, input_folder, output_folder, workers, args.temperatures, args.quiet, args.input_format, {temperature: scorer for temperature, scorer in scorers.items() if scorer is not None})
+        else:
+            experiment = Experiment(model, input_size, process_amount, prompt, input_folder, output_folder, workers, temperature, args.quiet, args.input_format, args.best_of, create_live_scorer(args, prompt))
         experiment.check_installed()
         experiment.read_input()
 
-        if sequential:
-            experiment.run()
-        else:
-            experiment.run_parallel()
+        with span("generate"):
+            if sequential:
+                experiment.run()
+            else:
+                experiment.run_parallel()
+
+        experiment.save_output()
+        experiment.print_summary()
+        metrics.stop()
+        model.backend.close()
 
-        experiment.save_output()
\ No newline at end of file
+    stop_profiling(args, "main")
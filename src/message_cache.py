@@ -0,0 +1,208 @@
+import hashlib
+import json
+import os
+import time
+
+from prompt_template import EXTENSION_TEMPLATE
+
+def sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+# Identifies the message of a staged file: the same file, staged content, model and prompt give the same message
+class MessageKey:
+    file: str
+    diff_hash: str
+    model: str
+    template: str
+
+    def __init__(self, file: str, diff: str, model: str, template: str = EXTENSION_TEMPLATE.fingerprint):
+        self.file = file
+        self.diff_hash = sha256(diff)
+        self.model = model
+        self.template = template
+
+    @property
+    def digest(self) -> str:
+        return sha256(f"{self.file}\0{self.diff_hash}\0{self.model}\0{self.template}")
+
+# Generated messages stored as one JSON file per key.
+# Files are replaced atomically, so the watcher and runExtension.py can share the cache between processes.
+# A process generating a message holds a claim file for its key, so the other processes wait for that message instead
+# of generating the same one at the same time.
+class MessageCache:
+    folder: str
+    hits: int = 0
+    misses: int = 0
+    waited: int = 0
+    # Claims older than this are left over from a process that was killed
+    claim_timeout: float = 600
+
+    def __init__(self, folder: str):
+        self.folder = folder
+
+        os.makedirs(folder, exist_ok=True)
+
+    def path(self, key: MessageKey) -> str:
+        return os.path.join(self.folder, f"{key.digest}.json")
+
+    def get(self, key: MessageKey) -> str|None:
+        message = self.load(key)
+        self.count(message)
+
+        return message
+
+    # The message of a key without counting the lookup as a hit or a miss
+    def load(self, key: MessageKey) -> str|None:
+        try:
+            with open(self.path(key), "r", encoding="utf-8") as f:
+                message = json.load(f)["message"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+        # Keep recently used messages when pruning
+        try:
+            os.utime(self.path(key))
+        except OSError:
+            pass
+
+        return message
+
+    # Count a lookup of a key as a hit or a miss
+    def count(self, message: str|None):
+        if message is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+
+        return self.hits / lookups if lookups > 0 else 0
+
+    def put(self, key: MessageKey, message: str):
+        path = self.path(key)
+        temporary_file = f"{path}.{os.getpid()}.tmp"
+
+        with open(temporary_file, "w", encoding="utf-8") as f:
+            json.dump({"file": key.file, "diff_hash": key.diff_hash, "model": key.model, "template": key.template, "message": message, "created": time.time()}, f)
+
+        os.replace(temporary_file, path)
+
+    def __contains__(self, key: MessageKey) -> bool:
+        return os.path.exists(self.path(key))
+
+    def claim_path(self, key: MessageKey) -> str:
+        return os.path.join(self.folder, f"{key.digest}.claim")
+
+    # Claim the generation of a key for this process, False when another process is generating it
+    def claim(self, key: MessageKey) -> bool:
+        path = self.claim_path(key)
+
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if not self.claim_stale(path):
+                return False
+
+            self.release_path(path)
+
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                return False
+
+        with os.fdopen(fd, "w") as f:
+            f.write(str(os.getpid()))
+
+        return True
+
+    def release(self, key: MessageKey):
+        self.release_path(self.claim_path(key))
+
+    def release_path(self, path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    # A claim of a process that no longer runs, or older than the claim timeout
+    def claim_stale(self, path: str) -> bool:
+        try:
+            if time.time() - os.path.getmtime(path) > self.claim_timeout:
+                return True
+
+            with open(path, "r") as f:
+                pid = int(f.read() or 0)
+        except FileNotFoundError:
+            return True
+        except ValueError:
+            # Claimed, but the process id is not written yet
+            return False
+
+        # Signal 0 only checks the process on POSIX, on Windows the timeout has to do
+        if os.name == "nt":
+            return False
+
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except (PermissionError, OSError):
+            return False
+
+        return False
+
+    # The message of a key, waiting while another process generates it, and whether this process holds the claim of the
+    # key. The message is None once this process claimed the key and has to generate the message itself, or when the
+    # other process did not finish within the timeout, in which case the claim stays with that process.
+    # Polling for the message of the other process counts as a single lookup of the key.
+    def get_or_claim(self, key: MessageKey, timeout: float = 300, poll_interval: float = 0.2) -> tuple[str|None, bool]:
+        message = self.load(key)
+        deadline = time.monotonic() + timeout
+        waiting = False
+
+        while message is None:
+            if self.claim(key):
+                # The other process may have stored the message right before it released its claim
+                if key not in self:
+                    self.count(None)
+                    return None, True
+
+                self.release(key)
+            elif time.monotonic() >= deadline:
+                self.count(None)
+                return None, False
+            elif not waiting:
+                waiting = True
+                self.waited += 1
+            else:
+                time.sleep(poll_interval)
+
+            if key in self:
+                message = self.load(key)
+
+        self.count(message)
+
+        return message, False
+
+    # Remove the least recently used messages beyond the given number of entries
+    def prune(self, max_entries: int):
+        entries = []
+
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith(".json"):
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except FileNotFoundError:
+                    pass
+
+        for _, path in sorted(entries, reverse=True)[max_entries:]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+# The folder of the cache inside the git directory of a repository, so it never shows up as a change
+def default_cache_folder(git_dir: str) -> str:
+    return os.path.join(git_dir, "commit_message_cache")
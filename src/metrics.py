@@ -0,0 +1,272 @@
+import argparse
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from backends import Backend, BackendWrapper, Generation
+from cancellation import Cancelled
+
+# Quantiles reported for the latency and time to first token
+QUANTILES = [0.5, 0.9, 0.99]
+
+# Nearest-rank quantile of a sorted list
+def quantile(values: list[float], q: float) -> float:
+    if len(values) == 0:
+        return 0
+
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+# Thread safe counters of the generations of a run
+class Metrics:
+    requests: int = 0
+    errors: int = 0
+    cancelled: int = 0
+    in_flight: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    prompt_duration: float = 0
+    completion_duration: float = 0
+    latencies: list[float]
+    ttfts: list[float]
+    start_time: float
+    lock: threading.Lock
+
+    def __init__(self):
+        self.latencies = []
+        self.ttfts = []
+        self.start_time = time.time()
+        self.lock = threading.Lock()
+
+    def started(self):
+        with self.lock:
+            self.in_flight += 1
+
+    # Record a finished generation, the time to first token and token rates come from the statistics of the backend
+    def record(self, generation: Generation, latency: float):
+        with self.lock:
+            self.in_flight -= 1
+            self.requests += 1
+            self.latencies.append(latency)
+            self.ttfts.append(generation.load_duration + generation.prompt_duration)
+            self.prompt_tokens += generation.prompt_tokens
+            self.completion_tokens += generation.completion_tokens
+            self.prompt_duration += generation.prompt_duration
+            self.completion_duration += generation.completion_duration
+
+    def record_error(self):
+        with self.lock:
+            self.in_flight -= 1
+            self.requests += 1
+            self.errors += 1
+
+    def record_cancelled(self):
+        with self.lock:
+            self.in_flight -= 1
+            self.cancelled += 1
+
+    # Current values of all metrics
+    def snapshot(self) -> dict:
+        with self.lock:
+            latencies = sorted(self.latencies)
+            ttfts = sorted(self.ttfts)
+
+            return {
+                "time": time.time(),
+                "elapsed": time.time() - self.start_time,
+                "requests": self.requests,
+                "errors": self.errors,
+                "cancelled": self.cancelled,
+                "in_flight": self.in_flight,
+                "latency": {str(q): quantile(latencies, q) for q in QUANTILES},
+                "latency_mean": sum(latencies) / len(latencies) if latencies else 0,
+                "ttft": {str(q): quantile(ttfts, q) for q in QUANTILES},
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "prompt_tokens_per_second": self.prompt_tokens / self.prompt_duration if self.prompt_duration > 0 else 0,
+                "completion_tokens_per_second": self.completion_tokens / self.completion_duration if self.completion_duration > 0 else 0
+            }
+
+    # All metrics in the Prometheus text exposition format
+    def render_prometheus(self) -> str:
+        snapshot = self.snapshot()
+        lines = []
+
+        def metric(name: str, kind: str, help: str, samples: list[tuple[str, float]]):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{labels} {value}")
+
+        metric("generation_requests_total", "counter", "Finished generation requests.", [("", snapshot["requests"])])
+        metric("generation_errors_total", "counter", "Failed generation requests.", [("", snapshot["errors"])])
+        metric("generation_cancelled_total", "counter", "Generation requests cancelled before they finished.", [("", snapshot["cancelled"])])
+        metric("generation_in_flight", "gauge", "Generation requests in progress.", [("", snapshot["in_flight"])])
+        metric("generation_latency_seconds", "summary", "Latency of the generation requests.", [(f'{{quantile="{q}"}}', value) for q, value in snapshot["latency"].items()])
+        metric("generation_ttft_seconds", "summary", "Time to first token reported by the backend.", [(f'{{quantile="{q}"}}', value) for q, value in snapshot["ttft"].items()])
+        metric("generation_prompt_tokens_total", "counter", "Prompt tokens evaluated.", [("", snapshot["prompt_tokens"])])
+        metric("generation_completion_tokens_total", "counter", "Completion tokens generated.", [("", snapshot["completion_tokens"])])
+        metric("generation_prompt_tokens_per_second", "gauge", "Prompt evaluation rate reported by the backend.", [("", snapshot["prompt_tokens_per_second"])])
+        metric("generation_completion_tokens_per_second", "gauge", "Generation rate reported by the backend.", [("", snapshot["completion_tokens_per_second"])])
+
+        return "\n".join(lines) + "\n"
+
+# Backend wrapper that records the metrics of every generation of the wrapped backend
+class InstrumentedBackend(BackendWrapper):
+    metrics: Metrics
+
+    def __init__(self, inner: Backend, metrics: Metrics):
+        super().__init__(inner)
+        self.metrics = metrics
+
+    def generate(self, model: str, prompt: str, options: dict) -> Generation:
+        self.metrics.started()
+        start = time.time()
+
+        try:
+            generation = self.inner.generate(model, prompt, options)
+        except Cancelled:
+            self.metrics.record_cancelled()
+            raise
+        except BaseException:
+            self.metrics.record_error()
+            raise
+
+        self.metrics.record(generation, time.time() - start)
+
+        return generation
+
+    def generate_n(self, model: str, prompt: str, options: dict, n: int) -> list[Generation]:
+        return self.record_batch(n, lambda: self.inner.generate_n(model, prompt, options, n))
+
+    def generate_temperatures(self, model: str, prompt: str, options: dict, temperatures: list[float]) -> list[Generation]:
+        return self.record_batch(len(temperatures), lambda: self.inner.generate_temperatures(model, prompt, options, temperatures))
+
+    # Every generation of a batch counts as a request, with the latency of the whole batch
+    def record_batch(self, n: int, function) -> list[Generation]:
+        for _ in range(n):
+            self.metrics.started()
+
+        start = time.time()
+
+        try:
+            generations = function()
+        except Cancelled:
+            for _ in range(n):
+                self.metrics.record_cancelled()
+            raise
+        except BaseException:
+            for _ in range(n):
+                self.metrics.record_error()
+            raise
+
+        latency = time.time() - start
+
+        for generation in generations:
+            self.metrics.record(generation, latency)
+
+        return generations
+
+# Serves the metrics over HTTP, /metrics in the Prometheus format and /metrics.json as a JSON snapshot
+class MetricsServer(ThreadingHTTPServer):
+    daemon_threads = True
+    metrics: Metrics
+
+    def __init__(self, metrics: Metrics, port: int, host: str = "127.0.0.1"):
+        super().__init__((host, port), MetricsRequestHandler)
+        self.metrics = metrics
+
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    server: MetricsServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            body = self.server.metrics.render_prometheus().encode("utf-8")
+            content_type = "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body = json.dumps(self.server.metrics.snapshot()).encode("utf-8")
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+# Periodically writes a JSON snapshot of the metrics to a file, replaced atomically so readers never see a partial file
+class SnapshotWriter:
+    metrics: Metrics
+    file: str
+    interval: float
+    stopped: threading.Event
+
+    def __init__(self, metrics: Metrics, file: str, interval: float = 5):
+        self.metrics = metrics
+        self.file = file
+        self.interval = interval
+        self.stopped = threading.Event()
+
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def write(self):
+        temporary_file = self.file + ".tmp"
+
+        with open(temporary_file, "w", encoding="utf-8") as f:
+            json.dump(self.metrics.snapshot(), f, indent=2)
+
+        os.replace(temporary_file, self.file)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    # Stop writing, after a final snapshot with the end state of the run
+    def stop(self):
+        self.stopped.set()
+        self.write()
+
+# Add the arguments used to expose the metrics of a run
+def add_metrics_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--metrics_port", type=int, default=None, help="Serve live metrics on this port (/metrics for Prometheus, /metrics.json).")
+    parser.add_argument("--metrics_file", type=str, default=None, help="Periodically write a JSON snapshot of the live metrics to this file.")
+    parser.add_argument("--metrics_interval", type=float, default=5, help="The seconds between two metrics snapshots.")
+
+# Exposes the metrics of a backend as selected on the command line
+class MetricsExport:
+    backend: Backend
+    metrics: Metrics|None = None
+    server: MetricsServer|None = None
+    writer: SnapshotWriter|None = None
+
+    def __init__(self, backend: Backend, args: argparse.Namespace):
+        self.backend = backend
+
+        if args.metrics_port is None and args.metrics_file is None:
+            return
+
+        self.metrics = Metrics()
+        self.backend = InstrumentedBackend(backend, self.metrics)
+
+        if args.metrics_port is not None:
+            self.server = MetricsServer(self.metrics, args.metrics_port)
+        if args.metrics_file is not None:
+            self.writer = SnapshotWriter(self.metrics, args.metrics_file, args.metrics_interval)
+
+    def stop(self):
+        if self.server is not None:
+            self.server.stop()
+        if self.writer is not None:
+            self.writer.stop()
@@ -3,19 +3,27 @@ import os
 from dotenv import load_dotenv
 from llama_cpp import Llama
 
+from prefix_cache import enable_prefix_cache
+
 # Load environment variables from a .env file
 load_dotenv()
 
 # Initializes the LlamaMistralWrapper class, loading the Llama model with the environment variables
 class LlamaMistralWrapper:
-    try:
+    def __init__(self, prefix_cache: bool = True, n_threads: int|None = None, n_batch: int = 512):
+        try:
             self.llm = Llama(
                 model_path=os.environ['MODEL_PATH_MISTRAL'],
                 chat_format="llama-2",
                 n_ctx=int(os.environ['CONTEXT_WINDOW_FOR_MISTRAL']),
                 n_gpu_layers=int(os.environ['GPU_LAYERS']),
+                n_threads=n_threads,
+                n_batch=n_batch,
                 verbose=True
             )
+            # Reuse the evaluated state of the static system message and prompt prefix across prompts
+            if prefix_cache:
+                enable_prefix_cache(self.llm)
             # Print confirmation of model loading
             print("Loaded Mistral")
         except KeyError as e:
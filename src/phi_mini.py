@@ -3,19 +3,26 @@ import os
 from dotenv import load_dotenv
 from llama_cpp import Llama
 
+from prefix_cache import enable_prefix_cache
+
 # Load environment variables from a .env file
 load_dotenv()
 
 # Initializes the PhiMiniWrapper class, loading the Llama model with settings from environment variables.
 class PhiMiniWrapper:
-    def __init__(self):
+    def __init__(self, prefix_cache: bool = True, n_threads: int|None = None, n_batch: int = 512):
         try:
             self.llm = Llama(
                 model_path=os.environ['MODEL_PATH_PHI'],
                 n_ctx=int(os.environ['CONTEXT_WINDOW_FOR_PHI']),
                 n_gpu_layers=int(os.environ['GPU_LAYERS']),
+                n_threads=n_threads,
+                n_batch=n_batch,
                 verbose=True
             )
+            # Reuse the evaluated state of the static system block and prompt prefix across prompts
+            if prefix_cache:
+                enable_prefix_cache(self.llm)
             # Print confirmation of model loading
             print("Loaded Phi_-3.5-mini-instruct-Q8_0")
         except KeyError as e:
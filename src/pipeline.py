@@ -0,0 +1,344 @@
+import argparse
+import hashlib
+import json
+import os
+import shlex
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+from prompt_template import BASELINE_TEMPLATE, COT_TEMPLATE, FEWSHOT_TEMPLATE
+
+# Root of the repository, every path of a stage is relative to it
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# A step of the pipeline: a command with the files it reads and writes.
+# The params are anything else the outputs depend on that is not in a file, like the text of a prompt template.
+class Stage:
+    name: str
+    command: list[str]
+    inputs: list[str]
+    outputs: list[str]
+    params: dict
+    pool: str
+    stdout: str|None
+
+    def __init__(self, name: str, command: list[str], inputs: list[str], outputs: list[str], params: dict|None = None, pool: str = "cpu", stdout: str|None = None):
+        self.name = name
+        self.command = command
+        self.inputs = inputs
+        self.outputs = outputs
+        self.params = params or {}
+        self.pool = pool
+        self.stdout = stdout
+
+# Content hashes of files, cached by modification time and size so unchanged files are not read again
+class FileHashes:
+    cache: dict[str, list]
+    lock: threading.Lock
+
+    def __init__(self, cache: dict[str, list]):
+        self.cache = cache
+        self.lock = threading.Lock()
+
+    def hash(self, path: str) -> str|None:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+
+        signature = [stat.st_mtime_ns, stat.st_size]
+
+        with self.lock:
+            cached = self.cache.get(path)
+
+            if cached is not None and cached[:2] == signature:
+                return cached[2]
+
+        digest = hashlib.sha256()
+
+        with open(path, "rb") as f:
+            while chunk := f.read(1 << 20):
+                digest.update(chunk)
+
+        with self.lock:
+            self.cache[path] = signature + [digest.hexdigest()]
+
+        return digest.hexdigest()
+
+# Runs the stages in dependency order, independent stages at the same time.
+# A stage is skipped when the hash of its command, params and input contents is the one of its last run and its
+# outputs are unchanged since, so a stage whose inputs were rebuilt with the same content does not run again either.
+class Pipeline:
+    stages: dict[str, Stage]
+    producers: dict[str, str]
+    state_file: str
+    state: dict
+    hashes: FileHashes
+    pools: dict[str, int]
+    force: bool
+    results: dict[str, str]
+
+    def __init__(self, stages: list[Stage], state_file: str, pools: dict[str, int], force: bool = False):
+        self.stages = {stage.name: stage for stage in stages}
+        self.producers = {output: stage.name for stage in stages for output in stage.outputs}
+        self.state_file = state_file
+        self.pools = pools
+        self.force = force
+        self.results = {}
+
+        try:
+            with open(state_file, "r", encoding="utf-8") as f:
+                self.state = json.load(f)
+        except (OSError, ValueError):
+            self.state = {}
+
+        self.state.setdefault("stages", {})
+        self.hashes = FileHashes(self.state.setdefault("files", {}))
+
+    def dependencies(self, stage: Stage) -> set[str]:
+        return {self.producers[path] for path in stage.inputs if path in self.producers}
+
+    def key(self, stage: Stage) -> str:
+        inputs = {path: self.hashes.hash(os.path.join(ROOT, path)) for path in stage.inputs}
+
+        return hashlib.sha256(json.dumps([stage.command, stage.params, inputs], sort_keys=True).encode("utf-8")).hexdigest()
+
+    def output_hashes(self, stage: Stage) -> dict[str, str|None]:
+        return {path: self.hashes.hash(os.path.join(ROOT, path)) for path in stage.outputs}
+
+    def is_fresh(self, stage: Stage, key: str) -> bool:
+        previous = self.state["stages"].get(stage.name)
+
+        if self.force or previous is None or previous["key"] != key:
+            return False
+
+        outputs = self.output_hashes(stage)
+
+        return None not in outputs.values() and outputs == previous["outputs"]
+
+    def run_stage(self, stage: Stage) -> str:
+        missing = [path for path in stage.inputs if not os.path.exists(os.path.join(ROOT, path))]
+
+        if len(missing) > 0:
+            raise Exception(f"Missing inputs: {', '.join(missing)}")
+
+        key = self.key(stage)
+
+        if self.is_fresh(stage, key):
+            return "cached"
+
+        for output in stage.outputs:
+            os.makedirs(os.path.dirname(os.path.join(ROOT, output)), exist_ok=True)
+
+        print(f"Running {stage.name}: {shlex.join(stage.command)}")
+        start = time.time()
+        environment = {**os.environ, "PYTHONPATH": os.pathsep.join([os.path.join(ROOT, "src"), os.environ.get("PYTHONPATH", "")])}
+
+        if stage.stdout is not None:
+            with open(os.path.join(ROOT, stage.stdout), "w", encoding="utf-8") as f:
+                result = subprocess.run(stage.command, cwd=ROOT, env=environment, stdout=f, stderr=subprocess.PIPE, text=True)
+        else:
+            result = subprocess.run(stage.command, cwd=ROOT, env=environment, capture_output=True, text=True)
+
+        if result.returncode != 0:
+            raise Exception(f"Exit code {result.returncode}: {result.stderr.strip()[-2000:]}")
+
+        missing = [path for path in stage.outputs if not os.path.exists(os.path.join(ROOT, path))]
+
+        if len(missing) > 0:
+            raise Exception(f"Missing outputs: {', '.join(missing)}")
+
+        outputs = self.output_hashes(stage)
+
+        with self.hashes.lock:
+            self.state["stages"][stage.name] = {"key": key, "outputs": outputs}
+
+        self.save_state()
+
+        return f"ran in {time.time() - start:.2f}s"
+
+    # Saved after every stage, so an interrupted run keeps the stages that finished
+    def save_state(self):
+        temporary_file = f"{self.state_file}.tmp"
+
+        # The hashes share their lock with the state, stages finish on several threads
+        with self.hashes.lock:
+            with open(temporary_file, "w", encoding="utf-8") as f:
+                json.dump(self.state, f, indent=1)
+
+            os.replace(temporary_file, self.state_file)
+
+    def run(self) -> bool:
+        remaining = dict(self.stages)
+        running: dict[Future, Stage] = {}
+        busy = {pool: 0 for pool in self.pools}
+
+        with ThreadPoolExecutor(max_workers=sum(self.pools.values())) as executor:
+            while len(remaining) > 0 or len(running) > 0:
+                for name, stage in list(remaining.items()):
+                    dependencies = self.dependencies(stage)
+
+                    # Stages after a failed stage cannot run
+                    if any(self.results.get(dependency, "").startswith(("failed", "skipped")) for dependency in dependencies):
+                        self.results[name] = "skipped"
+                        del remaining[name]
+                    elif all(dependency in self.results for dependency in dependencies) and busy[stage.pool] < self.pools[stage.pool]:
+                        busy[stage.pool] += 1
+                        running[executor.submit(self.run_stage, stage)] = stage
+                        del remaining[name]
+
+                if len(running) == 0:
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    stage = running.pop(future)
+                    busy[stage.pool] -= 1
+
+                    try:
+                        self.results[stage.name] = future.result()
+                    except Exception as e:
+                        self.results[stage.name] = f"failed: {e}"
+
+                    print(f"{stage.name}: {self.results[stage.name]}")
+
+        self.save_state()
+
+        return not any(result.startswith(("failed", "skipped")) for result in self.results.values())
+
+# The templates the prompts of an experiment are rendered with, the few-shot prompt falls back to the baseline
+PROMPT_TEMPLATES = {
+    "baseline": [BASELINE_TEMPLATE],
+    "fewshot": [FEWSHOT_TEMPLATE, BASELINE_TEMPLATE],
+    "cot": [COT_TEMPLATE]
+}
+
+# The dataset file each experiment reads its prompts from
+PROMPT_SOURCES = {
+    "baseline": "src/commitbench_subset.csv",
+    "fewshot": "src/commitbench_subset_similar.csv",
+    "cot": "src/commitbench_subset_similar.csv"
+}
+
+# The stages to reproduce the results: inputs per prompt, outputs per model, prompt and temperature, and per output
+# file the cleaning and scoring, which are combined into the evaluation results and the tables
+def experiment_stages(args: argparse.Namespace) -> list[Stage]:
+    python = sys.executable
+    stages = []
+    scored_files = []
+
+    if args.similar_search:
+        stages.append(Stage(
+            "similar_search",
+            [python, "src/few_shot/run_similar_search.py", "--input_file", "src/commitbench_subset.csv", "--output_file", "src/commitbench_subset_similar.csv"],
+            ["src/commitbench_subset.csv"],
+            ["src/commitbench_subset_similar.csv"]
+        ))
+
+    for prompt in args.prompts:
+        input_files = [f"{args.input_folder}/{model}_{args.size}_{prompt}.csv" for model in args.models]
+
+        stages.append(Stage(
+            f"prepare:{prompt}",
+            [python, "src/prepare_input.py", "--experiments", prompt, "--models", *args.models, "--size", str(args.size), "--output_folder", args.input_folder],
+            [PROMPT_SOURCES[prompt], "src/prepare_input.py"],
+            input_files,
+            {"templates": [template.fingerprint for template in PROMPT_TEMPLATES[prompt]]}
+        ))
+
+        for model, input_file in zip(args.models, input_files):
+            for temperature in args.temperatures:
+                name = f"{model}_{args.process_amount}_{prompt}_{temperature}.csv"
+                output_file = f"{args.output_folder}/{name}"
+                cleaned_file = f"{args.cleaned_folder}/{name}"
+                scored_file = f"{args.scores_folder}/{name}"
+
+                stages.append(Stage(
+                    f"generate:{model}:{prompt}:{temperature}",
+                    [python, "src/main.py", "--model", model, "--prompt", prompt, "--temperature", str(temperature), "--input_size", str(args.size), "--process_amount", str(args.process_amount), "--input_folder", args.input_folder, "--output_folder", args.output_folder, "--quiet", *shlex.split(args.generate_args)],
+                    [input_file],
+                    [output_file],
+                    pool="generate"
+                ))
+                stages.append(Stage(
+                    f"clean:{name}",
+                    [python, "src/clean.py", "--file", output_file, "--output", cleaned_file],
+                    [output_file, "src/clean.py"],
+                    [cleaned_file]
+                ))
+                stages.append(Stage(
+                    f"score:{name}",
+                    [python, "-m", "post_processing.post_processing_csv", "--file", cleaned_file, "--output", scored_file],
+                    [cleaned_file, "src/post_processing/evaluate.py", "src/post_processing/post_processing_csv.py"],
+                    [scored_file]
+                ))
+                scored_files.append(scored_file)
+
+    results_file = f"{args.results_folder}/evaluation_results.csv"
+    scores_file = f"{args.results_folder}/evaluation_results_all.csv"
+
+    stages.append(Stage(
+        "combine",
+        [python, "-m", "post_processing.post_processing_csv", "--combine", *scored_files, "--output_folder", args.results_folder],
+        [*scored_files, "src/post_processing/post_processing_csv.py"],
+        [results_file, scores_file]
+    ))
+    stages.append(Stage(
+        "significance",
+        [python, "-m", "post_processing.significance", "--file", scores_file, "--output_folder", args.results_folder],
+        [scores_file, "src/post_processing/significance.py"],
+        [f"{args.results_folder}/significance.csv", f"{args.results_folder}/significance_pairs.csv"]
+    ))
+
+    for table in args.tables:
+        stages.append(Stage(
+            f"table:{table}",
+            [python, "results/data_to_table.py", "--file", results_file, "--scores", scores_file, "--table", table],
+            [results_file, scores_file, "results/data_to_table.py", "src/post_processing/significance.py"],
+            [f"{args.results_folder}/tables/{table}.tex"],
+            stdout=f"{args.results_folder}/tables/{table}.tex"
+        ))
+
+    return stages
+
+parser = argparse.ArgumentParser(description="Reproduce the results from the dataset, only running the stages whose inputs changed since their last run.")
+
+parser.add_argument("--models", type=str, nargs="+", default=["mistral", "codellama", "phi3.5"], help="The models to run.")
+parser.add_argument("--prompts", type=str, nargs="+", default=["baseline", "fewshot", "cot"], choices=PROMPT_TEMPLATES.keys(), help="The prompts to run.")
+parser.add_argument("--temperatures", type=float, nargs="+", default=[0.7], help="The temperatures to run.")
+parser.add_argument("--size", type=int, default=1000, help="The number of items per input file.")
+parser.add_argument("--process_amount", type=int, default=1000, help="The number of items to generate per experiment.")
+parser.add_argument("--input_folder", type=str, default="input", help="The folder of the input files.")
+parser.add_argument("--output_folder", type=str, default="output", help="The folder of the output files.")
+parser.add_argument("--cleaned_folder", type=str, default="cleaned_output", help="The folder of the cleaned output files.")
+parser.add_argument("--scores_folder", type=str, default="scores", help="The folder of the scored items per output file.")
+parser.add_argument("--results_folder", type=str, default="results", help="The folder of the evaluation results and tables.")
+parser.add_argument("--tables", type=str, nargs="*", default=["full", "length", "temperature"], help="The LaTeX tables to generate.")
+parser.add_argument("--generate_args", type=str, default="", help="Extra arguments for main.py, for example the backend, part of the generation cache key.")
+parser.add_argument("--similar_search", action="store_true", help="Also rebuild the similar commits of the dataset, which clones every project.")
+parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="The number of cleaning and scoring stages run at the same time.")
+parser.add_argument("--generate_jobs", type=int, default=1, help="The number of experiments generated at the same time.")
+parser.add_argument("--state_file", type=str, default=os.path.join(ROOT, ".pipeline_state.json"), help="The file recording the last run of every stage.")
+parser.add_argument("--force", action="store_true", help="Run every stage, even when its inputs did not change.")
+parser.add_argument("--dry_run", action="store_true", help="Only show which stages would run.")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    args.temperatures = [float(temperature) for temperature in args.temperatures]
+
+    pipeline = Pipeline(experiment_stages(args), args.state_file, {"cpu": max(args.jobs, 1), "generate": max(args.generate_jobs, 1)}, args.force)
+
+    # Stages after a stage that would run are only known to run once their inputs are rebuilt
+    if args.dry_run:
+        for stage in pipeline.stages.values():
+            print(f"{stage.name}: {'cached' if pipeline.is_fresh(stage, pipeline.key(stage)) else 'would run'}")
+        sys.exit(0)
+
+    succeeded = pipeline.run()
+
+    print(f"{sum(1 for result in pipeline.results.values() if result == 'cached')} cached, {sum(1 for result in pipeline.results.values() if result.startswith('ran'))} ran, {sum(1 for result in pipeline.results.values() if not result.startswith(('cached', 'ran')))} failed or skipped")
+    sys.exit(0 if succeeded else 1)
@@ -1,27 +1,52 @@
 
+import functools
+
 from nltk.translate.bleu_score import sentence_bleu, SmoothingFunction
 from nltk.translate.meteor_score import meteor_score
 from pandas import DataFrame
 from rouge_score import rouge_scorer
-from bert_score import score as bert_score
 from nltk.tokenize import word_tokenize
 from tabulate import tabulate
 import nltk
 import ssl
-try:
-    _create_unverified_https_context = ssl._create_unverified_context
-except AttributeError:
-    pass
-else:
-    ssl._create_default_https_context = _create_unverified_https_context
-
-nltk.download('punkt_tab')
-nltk.download('wordnet')
 import warnings
 
+from profiling import span
+
 warnings.filterwarnings("ignore", category=UserWarning, module="transformers")
 
-# the first time running they need to be downloaded
+# The tokenizer and WordNet data METEOR needs, downloaded the first time a score is computed instead of on import
+NLTK_DATA = {
+    'punkt_tab': 'tokenizers/punkt_tab',
+    'wordnet': 'corpora/wordnet'
+}
+
+@functools.cache
+def ensure_nltk_data():
+    missing = []
+
+    for package, path in NLTK_DATA.items():
+        # Some corpora stay zipped after the download
+        try:
+            nltk.data.find(path)
+        except LookupError:
+            try:
+                nltk.data.find(f"{path}.zip")
+            except LookupError:
+                missing.append(package)
+
+    if len(missing) == 0:
+        return
+
+    try:
+        _create_unverified_https_context = ssl._create_unverified_context
+    except AttributeError:
+        pass
+    else:
+        ssl._create_default_https_context = _create_unverified_https_context
+
+    for package in missing:
+        nltk.download(package)
 
 
 # #File preprocessing
@@ -46,6 +71,7 @@ def compute_bleu(original, generated):
 # METEOR Score
 def compute_meteor(original, generated):
     """Compute METEOR score for a pair of texts."""
+    ensure_nltk_data()
     original_tokens = word_tokenize(original)  # Tokenize the original string
     generated_tokens = word_tokenize(generated)  # Tokenize the generated string
     return meteor_score([original_tokens], generated_tokens)
@@ -60,14 +86,20 @@ def compute_rouge_l(original, generated):
 # BERTScore
 def compute_bertscore(originals, generated):
     """Compute BERTScore for the dataset."""
+    # bert_score loads torch and transformers, which takes seconds, so it is only imported when it is used
+    from bert_score import score as bert_score
+
     P, R, F1 = bert_score(generated, originals, lang="en", rescale_with_baseline=False)
     return F1.mean().item()
 
 # Evaluate metrics
 def evaluate_metrics(orignal: str, generated: str):
-    blue = compute_bleu(orignal, generated)
-    meteor = compute_meteor(orignal, generated)
-    rouge = compute_rouge_l(orignal, generated)
+    with span("evaluate.bleu"):
+        blue = compute_bleu(orignal, generated)
+    with span("evaluate.meteor"):
+        meteor = compute_meteor(orignal, generated)
+    with span("evaluate.rouge_l"):
+        rouge = compute_rouge_l(orignal, generated)
 
     return blue, meteor, rouge
 
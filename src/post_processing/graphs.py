@@ -1,13 +1,17 @@
+import argparse
 import os
 
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
+from profiling import span
 
 
-def read_from_files_for_graphs(file_path='./results/evaluation_results.csv'):
-    data=pd.read_csv(file_path)
+
+def read_from_files_for_graphs(file_path='./results/evaluation_results.csv', output_folder='results/graphs'):
+    with span("graphs.read"):
+        data=pd.read_csv(file_path)
     avg_scores=data.groupby(['model','prompt'])[['bleu', 'meteor', 'rouge_l', 'bertscore']].mean().reset_index()
     models=avg_scores['model'].unique()
     prompts=avg_scores['prompt'].unique()
@@ -29,6 +33,18 @@ def read_from_files_for_graphs(file_path='./results/evaluation_results.csv'):
         ax.set_xticklabels(prompts)
         ax.legend(title="Models")
         plt.tight_layout()
-        save_path=os.path.join('results/graphs',f'{metric}_performance.png')
-        plt.savefig(save_path)
-        plt.close()
\ No newline at end of file
+        save_path=os.path.join(output_folder,f'{metric}_performance.png')
+        with span("graphs.save", metric):
+            plt.savefig(save_path)
+        plt.close()
+
+parser = argparse.ArgumentParser(description="Draw the graphs of the evaluation results.")
+
+parser.add_argument("--file", type=str, default="./results/evaluation_results.csv", help="The evaluation results file.")
+parser.add_argument("--output_folder", type=str, default="results/graphs", help="The folder to save the graphs to.")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    os.makedirs(args.output_folder, exist_ok=True)
+    read_from_files_for_graphs(args.file, args.output_folder)
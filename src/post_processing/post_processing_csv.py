@@ -1,13 +1,18 @@
+import argparse
 import os
 import pandas as pd
 
 from .evaluate import (evaluate_metrics)
+from profiling import span
+from dataset import read_table
 
-def read_and_evaluate_files(input_files: str='./cleaned_output', output_files: str='./results'):
-    average_results = {
+# The columns of the evaluation results, one row per model, prompt, temperature and number of samples
+def new_average_results() -> dict[str, list]:
+    return {
         'model':[],
         'prompt':[],
         'temperature':[],
+        'best_of':[],
         'true_mean_length': [],
         'mean_length': [],
         'cleaned_mean_length': [],
@@ -40,103 +45,173 @@ def read_and_evaluate_files(input_files: str='./cleaned_output', output_files: s
         'first_sentence_rouge_l_mean':[]
     }
 
-    all_data = pd.DataFrame()
+# The model, prompt, temperature and number of samples of an output file, from its name. Runs with --best_of end
+# with _best{N}, so they are kept apart from the single sample run of the same model, prompt and temperature.
+def file_cell(filename: str) -> tuple[str, str, str, int]:
+    parts=os.path.splitext(filename)[0].split('_')
+
+    if len(parts) == 4:
+        return parts[0], parts[2], parts[3], 1
+    if len(parts) == 5 and parts[4].startswith('best') and parts[4][4:].isdigit():
+        return parts[0], parts[2], parts[3], int(parts[4][4:])
+
+    raise ValueError(f"Cannot read the model, prompt and temperature of {filename}")
+
+# Score every item of a cleaned output file, the model, prompt, temperature and samples come from the file name
+def evaluate_file(input_files: str, filename: str) -> pd.DataFrame:
+    model, prompt_type, temperature, best_of = file_cell(filename)
+    with span("evaluate.read", filename):
+        df = read_table(os.path.join(input_files,filename),['hash','true_message','generated_message','cleaned_generated_message'])
+
+    for i in range(len(df)):
+        item = df.iloc[i]
+
+        if not isinstance(item['true_message'], str):
+            df.loc[i,'true_message'] = ""
+        if not isinstance(item['generated_message'], str):
+            df.loc[i,'generated_message'] = ""
+        if not isinstance(item['cleaned_generated_message'], str):
+            df.loc[i,'cleaned_generated_message'] = ""
+        
+        item = df.iloc[i]
+
+        df.loc[i, 'model'] = model
+        df.loc[i, 'prompt'] = prompt_type
+        df.loc[i, 'temperature'] = temperature
+        df.loc[i, 'best_of'] = best_of
+
+        df.loc[i, 'length'] = len(item['generated_message'])
+        df.loc[i, 'true_length'] = len(item['true_message'])
+        df.loc[i, 'cleaned_length'] = len(item['cleaned_generated_message'])
+    
+        bleu, meteor, rouge_l = evaluate_metrics(item['true_message'], item['generated_message'])
+        df.loc[i,'bleu'] = bleu
+        df.loc[i,'meteor'] = meteor
+        df.loc[i,'rouge_l'] = rouge_l
 
-    for filename in os.listdir(input_files):
-        if filename.endswith('.csv'):
-            parts=filename.replace('.csv','').split('_')
-            model=parts[0]
-            prompt_type=parts[2]
-            temperature=parts[3]
-            df = pd.read_csv(os.path.join(input_files,filename),usecols=['true_message','generated_message','cleaned_generated_message'])
-
-            for i in range(len(df)):
-                item = df.iloc[i]
-
-                if not isinstance(item['true_message'], str):
-                    df.loc[i,'true_message'] = ""
-                if not isinstance(item['generated_message'], str):
-                    df.loc[i,'generated_message'] = ""
-                if not isinstance(item['cleaned_generated_message'], str):
-                    df.loc[i,'cleaned_generated_message'] = ""
-                
-                item = df.iloc[i]
-
-                df.loc[i, 'model'] = model
-                df.loc[i, 'prompt'] = prompt_type
-                df.loc[i, 'temperature'] = temperature
-
-                df.loc[i, 'length'] = len(item['generated_message'])
-                df.loc[i, 'true_length'] = len(item['true_message'])
-                df.loc[i, 'cleaned_length'] = len(item['cleaned_generated_message'])
-            
-                bleu, meteor, rouge_l = evaluate_metrics(item['true_message'], item['generated_message'])
-                df.loc[i,'bleu'] = bleu
-                df.loc[i,'meteor'] = meteor
-                df.loc[i,'rouge_l'] = rouge_l
-
-                cleaned_bleu, cleaned_meteor, cleaned_rouge_l = evaluate_metrics(item['true_message'], item['cleaned_generated_message'])
-                df.loc[i,'cleaned_bleu'] = cleaned_bleu
-                df.loc[i,'cleaned_meteor'] = cleaned_meteor
-                df.loc[i,'cleaned_rouge_l'] = cleaned_rouge_l
-
-                first_sentence_bleu, first_sentence_meteor, first_sentence_rouge_l = evaluate_metrics(item['true_message'].split("\n")[0], item['cleaned_generated_message'])
-                df.loc[i,'first_sentence_bleu'] = first_sentence_bleu
-                df.loc[i,'first_sentence_meteor'] = first_sentence_meteor
-                df.loc[i,'first_sentence_rouge_l'] = first_sentence_rouge_l
-
-                if i % 100 == 0:
-                    print(f"{filename}: {i}/{len(df)}")
+        cleaned_bleu, cleaned_meteor, cleaned_rouge_l = evaluate_metrics(item['true_message'], item['cleaned_generated_message'])
+        df.loc[i,'cleaned_bleu'] = cleaned_bleu
+        df.loc[i,'cleaned_meteor'] = cleaned_meteor
+        df.loc[i,'cleaned_rouge_l'] = cleaned_rouge_l
 
-            all_data = pd.concat([all_data,df])
+        first_sentence_bleu, first_sentence_meteor, first_sentence_rouge_l = evaluate_metrics(item['true_message'].split("\n")[0], item['cleaned_generated_message'])
+        df.loc[i,'first_sentence_bleu'] = first_sentence_bleu
+        df.loc[i,'first_sentence_meteor'] = first_sentence_meteor
+        df.loc[i,'first_sentence_rouge_l'] = first_sentence_rouge_l
 
-            average_results['model'].append(model)
-            average_results['prompt'].append(prompt_type)
-            average_results['temperature'].append(temperature)
+        if i % 100 == 0:
+            print(f"{filename}: {i}/{len(df)}")
 
-            average_results['true_mean_length'].append(df['true_length'].mean())
-            average_results['mean_length'].append(df['length'].mean())
-            average_results['cleaned_mean_length'].append(df['cleaned_length'].mean())
+    return df
 
-            average_results['bleu_mean'].append(df['bleu'].mean())
-            average_results['meteor_mean'].append(df['meteor'].mean())
-            average_results['rouge_l_mean'].append(df['rouge_l'].mean())
+# Add the averages of the scored items of one output file to the evaluation results
+def add_averages(average_results: dict[str, list], df: pd.DataFrame, filename: str):
+    model, prompt_type, temperature, best_of = file_cell(filename)
 
-            average_results['cleaned_bleu_mean'].append(df['cleaned_bleu'].mean())
-            average_results['cleaned_meteor_mean'].append(df['cleaned_meteor'].mean())
-            average_results['cleaned_rouge_l_mean'].append(df['cleaned_rouge_l'].mean())
+    average_results['model'].append(model)
+    average_results['prompt'].append(prompt_type)
+    average_results['temperature'].append(temperature)
+    average_results['best_of'].append(best_of)
 
-            average_results['cleaned_blue_std'].append(df['cleaned_bleu'].std())
-            average_results['cleaned_meteor_std'].append(df['cleaned_meteor'].std())
-            average_results['cleaned_rouge_l_std'].append(df['cleaned_rouge_l'].std())
+    average_results['true_mean_length'].append(df['true_length'].mean())
+    average_results['mean_length'].append(df['length'].mean())
+    average_results['cleaned_mean_length'].append(df['cleaned_length'].mean())
 
-            average_results['cleaned_blue_p2'].append(df['cleaned_bleu'].quantile(0.02))
-            average_results['cleaned_meteor_p2'].append(df['cleaned_meteor'].quantile(0.02))
-            average_results['cleaned_rouge_l_p2'].append(df['cleaned_rouge_l'].quantile(0.02))
+    average_results['bleu_mean'].append(df['bleu'].mean())
+    average_results['meteor_mean'].append(df['meteor'].mean())
+    average_results['rouge_l_mean'].append(df['rouge_l'].mean())
 
-            average_results['cleaned_blue_p25'].append(df['cleaned_bleu'].quantile(0.25))
-            average_results['cleaned_meteor_p25'].append(df['cleaned_meteor'].quantile(0.25))
-            average_results['cleaned_rouge_l_p25'].append(df['cleaned_rouge_l'].quantile(0.25))
+    average_results['cleaned_bleu_mean'].append(df['cleaned_bleu'].mean())
+    average_results['cleaned_meteor_mean'].append(df['cleaned_meteor'].mean())
+    average_results['cleaned_rouge_l_mean'].append(df['cleaned_rouge_l'].mean())
 
-            average_results['cleaned_blue_p50'].append(df['cleaned_bleu'].quantile(0.50))
-            average_results['cleaned_meteor_p50'].append(df['cleaned_meteor'].quantile(0.50))
-            average_results['cleaned_rouge_l_p50'].append(df['cleaned_rouge_l'].quantile(0.50))
+    average_results['cleaned_blue_std'].append(df['cleaned_bleu'].std())
+    average_results['cleaned_meteor_std'].append(df['cleaned_meteor'].std())
+    average_results['cleaned_rouge_l_std'].append(df['cleaned_rouge_l'].std())
 
-            average_results['cleaned_blue_p75'].append(df['cleaned_bleu'].quantile(0.75))
-            average_results['cleaned_meteor_p75'].append(df['cleaned_meteor'].quantile(0.75))
-            average_results['cleaned_rouge_l_p75'].append(df['cleaned_rouge_l'].quantile(0.75))
+    average_results['cleaned_blue_p2'].append(df['cleaned_bleu'].quantile(0.02))
+    average_results['cleaned_meteor_p2'].append(df['cleaned_meteor'].quantile(0.02))
+    average_results['cleaned_rouge_l_p2'].append(df['cleaned_rouge_l'].quantile(0.02))
 
-            average_results['cleaned_blue_p98'].append(df['cleaned_bleu'].quantile(0.98))
-            average_results['cleaned_meteor_p98'].append(df['cleaned_meteor'].quantile(0.98))
-            average_results['cleaned_rouge_l_p98'].append(df['cleaned_rouge_l'].quantile(0.98))
+    average_results['cleaned_blue_p25'].append(df['cleaned_bleu'].quantile(0.25))
+    average_results['cleaned_meteor_p25'].append(df['cleaned_meteor'].quantile(0.25))
+    average_results['cleaned_rouge_l_p25'].append(df['cleaned_rouge_l'].quantile(0.25))
 
-            average_results['first_sentence_bleu_mean'].append(df['first_sentence_bleu'].mean())
-            average_results['first_sentence_meteor_mean'].append(df['first_sentence_meteor'].mean())
-            average_results['first_sentence_rouge_l_mean'].append(df['first_sentence_rouge_l'].mean())
-    
+    average_results['cleaned_blue_p50'].append(df['cleaned_bleu'].quantile(0.50))
+    average_results['cleaned_meteor_p50'].append(df['cleaned_meteor'].quantile(0.50))
+    average_results['cleaned_rouge_l_p50'].append(df['cleaned_rouge_l'].quantile(0.50))
+
+    average_results['cleaned_blue_p75'].append(df['cleaned_bleu'].quantile(0.75))
+    average_results['cleaned_meteor_p75'].append(df['cleaned_meteor'].quantile(0.75))
+    average_results['cleaned_rouge_l_p75'].append(df['cleaned_rouge_l'].quantile(0.75))
+
+    average_results['cleaned_blue_p98'].append(df['cleaned_bleu'].quantile(0.98))
+    average_results['cleaned_meteor_p98'].append(df['cleaned_meteor'].quantile(0.98))
+    average_results['cleaned_rouge_l_p98'].append(df['cleaned_rouge_l'].quantile(0.98))
+
+    average_results['first_sentence_bleu_mean'].append(df['first_sentence_bleu'].mean())
+    average_results['first_sentence_meteor_mean'].append(df['first_sentence_meteor'].mean())
+    average_results['first_sentence_rouge_l_mean'].append(df['first_sentence_rouge_l'].mean())
+
+# Write the evaluation results and all scored items
+def save_results(average_results: dict[str, list], all_data: pd.DataFrame, output_files: str):
     results = pd.DataFrame(average_results)
-    results.to_csv(f'{output_files}/evaluation_results.csv',index=False)
-    all_data.to_csv(f'{output_files}/evaluation_results_all.csv',index=False)
+
+    with span("evaluate.save"):
+        results.to_csv(f'{output_files}/evaluation_results.csv',index=False)
+        all_data.to_csv(f'{output_files}/evaluation_results_all.csv',index=False)
     print(results.to_string())
 
     
+
+def read_and_evaluate_files(input_files: str='./cleaned_output', output_files: str='./results'):
+    average_results = new_average_results()
+    all_data = pd.DataFrame()
+
+    for filename in os.listdir(input_files):
+        if filename.endswith('.csv') or filename.endswith('.arrow'):
+            df = evaluate_file(input_files, filename)
+            all_data = pd.concat([all_data,df])
+            add_averages(average_results, df, filename)
+
+    save_results(average_results, all_data, output_files)
+
+# Score a single cleaned output file into a file of scored items, so every file can be scored on its own
+def evaluate_to_file(input_file: str, output_file: str):
+    df = evaluate_file(os.path.dirname(input_file), os.path.basename(input_file))
+
+    with span("evaluate.save", output_file):
+        df.to_csv(output_file, index=False)
+
+# Combine files of scored items, named after their output files, into the evaluation results
+def combine_scored_files(files: list[str], output_files: str):
+    average_results = new_average_results()
+    all_data = pd.DataFrame()
+
+    for file in sorted(files):
+        with span("evaluate.read", file):
+            df = pd.read_csv(file, dtype={'temperature': str}, keep_default_na=False)
+
+        all_data = pd.concat([all_data,df])
+        add_averages(average_results, df, os.path.basename(file))
+
+    save_results(average_results, all_data, output_files)
+
+parser = argparse.ArgumentParser(description="Score cleaned output files, one at a time or all at once.")
+
+parser.add_argument("--file", type=str, default=None, help="Score a single cleaned output file.")
+parser.add_argument("--output", type=str, default=None, help="The file to save the scored items of --file to.")
+parser.add_argument("--combine", type=str, nargs="+", default=None, help="Combine files of scored items into the evaluation results.")
+parser.add_argument("--input_folder", type=str, default="./cleaned_output", help="The folder of cleaned output files to score when no file is given.")
+parser.add_argument("--output_folder", type=str, default="./results", help="The folder to save the evaluation results to.")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    if args.file:
+        evaluate_to_file(args.file, args.output or os.path.join(args.output_folder, os.path.basename(args.file)))
+    elif args.combine:
+        os.makedirs(args.output_folder, exist_ok=True)
+        combine_scored_files(args.combine, args.output_folder)
+    else:
+        read_and_evaluate_files(args.input_folder, args.output_folder)
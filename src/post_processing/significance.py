@@ -0,0 +1,164 @@
+import argparse
+import itertools
+import os
+
+import numpy as np
+import pandas as pd
+
+# The columns identifying a configuration, the items of all configurations are paired by their hash
+CONFIG = ['model', 'prompt', 'temperature', 'best_of']
+
+# The per item metrics of evaluation_results_all.csv
+METRICS = ['bleu', 'meteor', 'rouge_l', 'cleaned_bleu', 'cleaned_meteor', 'cleaned_rouge_l']
+
+# Read the scored items of all configurations. Results scored before --best_of have no best_of column, they were all single samples.
+def read_scores(file: str, metrics: list[str] = METRICS) -> pd.DataFrame:
+    df = pd.read_csv(file, usecols=lambda column: column in ['hash', *CONFIG, *metrics])
+
+    if 'best_of' not in df.columns:
+        df = df.assign(best_of=1)
+
+    return df
+
+# The scores of one metric as a configurations × items matrix, only the items scored in every configuration are kept
+def metric_matrix(df: pd.DataFrame, metric: str) -> tuple[list[tuple], np.ndarray]:
+    table = df.pivot_table(index=CONFIG, columns='hash', values=metric, aggfunc='mean').dropna(axis=1)
+
+    return list(table.index), table.to_numpy(dtype=np.float64)
+
+# The means of every configuration for every bootstrap resample, as a configurations × resamples matrix.
+# A resample is a vector of how often every item is drawn, so all configurations are resampled with the same items in one product.
+def bootstrap_means(matrix: np.ndarray, resamples: int, rng: np.random.Generator) -> np.ndarray:
+    items = matrix.shape[1]
+    draws = rng.integers(0, items, size=(resamples, items)) + np.arange(resamples)[:, None] * items
+    counts = np.bincount(draws.ravel(), minlength=resamples * items).reshape(resamples, items).astype(np.float32)
+
+    return (matrix.astype(np.float32) @ counts.T) / items
+
+# Percentile bootstrap confidence intervals of the mean of every configuration
+def confidence_intervals(matrix: np.ndarray, resamples: int = 10000, confidence: float = 0.95, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    means = bootstrap_means(matrix, resamples, np.random.default_rng(seed))
+    alpha = (1 - confidence) / 2
+
+    return np.quantile(means, alpha, axis=1), np.quantile(means, 1 - alpha, axis=1)
+
+# Two-sided p-values of paired permutation tests between pairs of configurations.
+# Under the null hypothesis the two scores of an item are exchangeable, so every resample flips the sign of the
+# paired differences at random, with the same flips for all pairs.
+def permutation_p_values(matrix: np.ndarray, pairs: list[tuple[int, int]], resamples: int = 10000, seed: int = 0) -> np.ndarray:
+    if len(pairs) == 0:
+        return np.zeros(0)
+
+    rng = np.random.default_rng(seed)
+    items = matrix.shape[1]
+    differences = np.stack([matrix[a] - matrix[b] for a, b in pairs]).astype(np.float32)
+    signs = rng.choice(np.array([-1, 1], dtype=np.float32), size=(resamples, items))
+
+    observed = np.abs(differences.mean(axis=1))
+    permuted = np.abs(differences @ signs.T) / items
+
+    # Small tolerance so ties with the observed difference count as at least as extreme
+    extreme = (permuted >= observed[:, None] - 1e-9).sum(axis=1)
+
+    return (extreme + 1) / (resamples + 1)
+
+# Confidence intervals and pairwise significance of every metric over all configurations of an evaluation
+class Significance:
+    configs: dict[str, list[tuple]]
+    matrices: dict[str, np.ndarray]
+    intervals: dict[str, tuple[np.ndarray, np.ndarray]]
+    p_values: dict[str, dict[tuple[int, int], float]]
+
+    def __init__(self, df: pd.DataFrame, metrics: list[str] = METRICS, resamples: int = 10000, confidence: float = 0.95, seed: int = 0):
+        df = df.assign(temperature=df['temperature'].astype(float), best_of=df['best_of'].astype(int))
+
+        self.configs = {}
+        self.matrices = {}
+        self.intervals = {}
+        self.p_values = {}
+
+        for metric in metrics:
+            configs, matrix = metric_matrix(df, metric)
+            pairs = list(itertools.combinations(range(len(configs)), 2))
+
+            self.configs[metric] = configs
+            self.matrices[metric] = matrix
+            self.intervals[metric] = confidence_intervals(matrix, resamples, confidence, seed)
+            self.p_values[metric] = dict(zip(pairs, permutation_p_values(matrix, pairs, resamples, seed)))
+
+    def index(self, metric: str, config: tuple) -> int|None:
+        config = (config[0], config[1], float(config[2]), int(config[3]))
+
+        return self.configs[metric].index(config) if config in self.configs[metric] else None
+
+    # The confidence interval of the mean of a configuration, None when it has no scored items
+    def interval(self, metric: str, config: tuple) -> tuple[float, float]|None:
+        i = self.index(metric, config)
+
+        if i is None:
+            return None
+
+        return float(self.intervals[metric][0][i]), float(self.intervals[metric][1][i])
+
+    # The p-value of the difference between two configurations
+    def p_value(self, metric: str, a: tuple, b: tuple) -> float|None:
+        i = self.index(metric, a)
+        j = self.index(metric, b)
+
+        if i is None or j is None:
+            return None
+        if i == j:
+            return 1.0
+
+        return float(self.p_values[metric][(min(i, j), max(i, j))])
+
+    def interval_frame(self) -> pd.DataFrame:
+        rows = []
+
+        for metric, configs in self.configs.items():
+            for i, config in enumerate(configs):
+                rows.append({
+                    **dict(zip(CONFIG, config)),
+                    'metric': metric,
+                    'items': self.matrices[metric].shape[1],
+                    'mean': self.matrices[metric][i].mean(),
+                    'ci_low': self.intervals[metric][0][i],
+                    'ci_high': self.intervals[metric][1][i]
+                })
+
+        return pd.DataFrame(rows)
+
+    def pair_frame(self) -> pd.DataFrame:
+        rows = []
+
+        for metric, configs in self.configs.items():
+            for (i, j), p_value in self.p_values[metric].items():
+                rows.append({
+                    'metric': metric,
+                    **{f"a_{column}": value for column, value in zip(CONFIG, configs[i])},
+                    **{f"b_{column}": value for column, value in zip(CONFIG, configs[j])},
+                    'mean_difference': self.matrices[metric][i].mean() - self.matrices[metric][j].mean(),
+                    'p_value': p_value
+                })
+
+        return pd.DataFrame(rows)
+
+parser = argparse.ArgumentParser(description="Compute bootstrap confidence intervals and paired permutation tests of the evaluation results.")
+
+parser.add_argument("--file", type=str, default="./results/evaluation_results_all.csv", help="The scored items of all configurations.")
+parser.add_argument("--output_folder", type=str, default="./results", help="The folder to save significance.csv and significance_pairs.csv to.")
+parser.add_argument("--metrics", type=str, nargs="+", default=METRICS, help="The metrics to test.")
+parser.add_argument("--resamples", type=int, default=10000, help="The number of bootstrap resamples and permutations.")
+parser.add_argument("--confidence", type=float, default=0.95, help="The confidence level of the intervals.")
+parser.add_argument("--seed", type=int, default=0, help="The seed of the resampling.")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    significance = Significance(read_scores(args.file, args.metrics), args.metrics, args.resamples, args.confidence, args.seed)
+
+    os.makedirs(args.output_folder, exist_ok=True)
+    significance.interval_frame().to_csv(os.path.join(args.output_folder, 'significance.csv'), index=False)
+    significance.pair_frame().to_csv(os.path.join(args.output_folder, 'significance_pairs.csv'), index=False)
+
+    print(significance.interval_frame().to_string())
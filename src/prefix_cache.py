@@ -0,0 +1,20 @@
+import os
+
+from llama_cpp import Llama, LlamaRAMCache
+
+# Default amount of RAM used to keep evaluated prompt states, can be overridden with PREFIX_CACHE_BYTES
+DEFAULT_CAPACITY_BYTES = 2 << 30
+
+# Enable llama.cpp prefix caching on a loaded model.
+# After every completion the evaluated state is kept in RAM, and the next prompt restores the state with the
+# longest matching token prefix, so a byte-stable prompt prefix is only prefilled once.
+def enable_prefix_cache(llm: Llama, capacity_bytes: int|None = None):
+    if capacity_bytes is None:
+        capacity_bytes = int(os.environ.get('PREFIX_CACHE_BYTES', DEFAULT_CAPACITY_BYTES))
+
+    llm.set_cache(LlamaRAMCache(capacity_bytes=capacity_bytes))
+
+# Disable prefix caching and forget the evaluated context, so the next prompt is prefilled from scratch
+def disable_prefix_cache(llm: Llama):
+    llm.set_cache(None)
+    llm.reset()
@@ -1,157 +1,144 @@
+import argparse
 import os
-from pandas import read_csv, DataFrame
+import shutil
+from pandas import DataFrame, Series
+
+from prompt_template import BASELINE_TEMPLATE, FEWSHOT_TEMPLATE, COT_TEMPLATE
+from profiling import add_profile_arguments, span, start_profiling, stop_profiling
+from dataset import ArrowWriter, arrow_path, read_chunks, string_schema
 
 # Directory of the current file
 __FOLDER = os.path.dirname(os.path.abspath(__file__))
 
-# Class representing a single input item for an experiment
-class InputItem:
-	hash: str
-	project: str
-	true_message: str
-	prompt: str
-
-	def __init__(self, hash: str, project: str, true_message: str, prompt: str):
-		self.hash = hash
-		self.project = project
-		self.true_message = true_message
-		self.prompt = prompt
-
-	# Convert the input item to a list format for DataFrame compatibility
-	def value(self):
-		return [self.hash, self.project, self.true_message, self.prompt]
+# Columns of the generated input files
+COLUMNS = ["hash", "project", "true_message", "prompt"]
 
 # Base class for all experiments
 class Experiment:
 	size: int
 	folder: str
-
-	def __init__(self, size: int, folder: str):
+	# Format of the dataset and input files, csv or arrow
+	format: str
+	# Dataset file the prompts are built from, relative to the folder
+	source: str = 'commitbench_subset.csv'
+	# Columns read from the dataset file
+	columns: list[str] = ['hash', 'project', 'message', 'diff']
+
+	def __init__(self, size: int, folder: str, format: str = "csv"):
 		self.size = size
 		self.folder = folder
+		self.format = format
+
+	# Method to generate the prompts for a chunk of the dataset (to be implemented by subclasses)
+	def prompts(self, df: DataFrame) -> Series:
+		return Series("", index=df.index)
 
-	# Method to generate input items for the experiment (to be implemented by subclasses)
-	def inputs(self) -> list[InputItem]:
-		return []
-	
 	# Method to return the name of the experiment (to be implemented by subclasses)
 	def name(self) -> str:
 		return ""
 
+	# Read the dataset in chunks, only loading the columns the experiment needs
+	def read(self, chunksize: int):
+		source = self.source if self.format == "csv" else arrow_path(self.source)
+
+		return read_chunks(os.path.join(self.folder, source), self.columns, self.size, chunksize)
+
+	# Generate the input items for a chunk of the dataset, column by column
+	def inputs(self, df: DataFrame) -> DataFrame:
+		return DataFrame({
+			"hash": df['hash'],
+			"project": df['project'],
+			"true_message": df['message'],
+			"prompt": self.prompts(df)
+		}, columns=COLUMNS)
+
+	# Stream the input items to a CSV file, one chunk at a time
+	def write(self, output_file: str, chunksize: int = 250):
+		# Never write through a link shared with the input files of other models
+		if os.path.lexists(output_file):
+			os.remove(output_file)
+
+		if self.format == "arrow":
+			with ArrowWriter(output_file, string_schema(COLUMNS)) as writer:
+				for i, chunk in enumerate(self.read(chunksize)):
+					with span("prepare_input.chunk", f"{self.name()}:{i}"):
+						writer.write(self.inputs(chunk))
+			return
+
+		with open(output_file, 'w', encoding='utf-8', newline='') as f:
+			for i, chunk in enumerate(self.read(chunksize)):
+				with span("prepare_input.chunk", f"{self.name()}:{i}"):
+					self.inputs(chunk).to_csv(f, header=i == 0, index=False)
+
 # Generate a baseline prompt based on the given diff
 def baseline_prompt(diff: str) -> str:
-	return f"""You are a programmer to produce concise, descriptive commit messages for Git changes. 
-Do not include references to issue numbers or pull requests.
-
-Now here is the new Git diff for which you must generate a commit message:
-{diff}
-
-Format:
-A short commit message (in one sentence) describing what changed and why.
-
-Output:
-"""
+	return BASELINE_TEMPLATE.render(diff=diff)
 
 # Generate a few-shot prompt based on the given diff and example messages
 def fewshot_prompt(diff: str, messages: list[str]) -> str:
-	numbered_messages = '\n'.join([f"{i+1}. {message}" for i, message in enumerate(messages)])
-	return f"""You are a programmer to produce concise, descriptive commit messages for Git changes. 
-Below are up to three examples of commit messages that previously touched upon the same code or files. 
-Please note that the first example is more important and should influence your message the most. 
-Use the style and context of these examples, prioritizing the first examples, to inspire a new commit message for the provided Git diff. 
-Do not include references to issue numbers or pull requests.
-
-Examples of relevant commit messages:
-{numbered_messages}
-
-Now here is the new Git diff for which you must generate a commit message:
-{diff}
-
-Format:
-A short commit message (in one sentence) describing what changed and why, consistent with the style 
-and context demonstrated by the above examples.
-
-Output:
-"""
+	return FEWSHOT_TEMPLATE.render(examples=numbered_messages(messages), diff=diff)
 
 # Generate a chain-of-thought (CoT) prompt based on the given diff
 def cot_prompt(diff: str) -> str:
-	return f"""You are a programmer to produce concise, descriptive commit messages for Git changes.
-Do not include references to issue numbers or pull requests.
-
-Now here is the new Git diff for which you must generate a commit message:
-{diff}
-
-Let's think step by step. Number every step before giving the final answer as [[ANSWER]] or ANSWER: ANSWER.
+	return COT_TEMPLATE.render(diff=diff)
 
-Steps:
-"""
+# Number the example messages of a few-shot prompt
+def numbered_messages(messages: list[str]) -> str:
+	return '\n'.join([f"{i+1}. {message}" for i, message in enumerate(messages)])
 
 # Baseline experiment that uses the baseline prompt
 class BaselineExperiment(Experiment):
-	def inputs(self):
-		df = read_csv(self.folder + '/commitbench_subset.csv')
+	def prompts(self, df: DataFrame) -> Series:
+		return BASELINE_TEMPLATE.render_columns(diff=df['diff'] + "\n")
 
-		items = []
-
-		for i in range(self.size):
-			item = df.iloc[i]
-
-			diff = item['diff'] + "\n"
-			prompt = baseline_prompt(diff)
-
-			items.append(InputItem(item['hash'], item['project'], item['message'], prompt))
-		
-		return items
-	
 	def name(self):
 		return "baseline"
 
 # Few-shot experiment that uses the few-shot prompt
 class FewShotExperiment(Experiment):
-	def inputs(self):
-		df = read_csv(self.folder + '/commitbench_subset_similar.csv')
-
-		items = []
+	source = 'commitbench_subset_similar.csv'
+	columns = ['hash', 'project', 'message', 'diff', 'nr_similar_commits_no_initial', 'most_similar_commits_messages']
 
-		for i in range(self.size):
-			item = df.iloc[i]
+	def prompts(self, df: DataFrame) -> Series:
+		# Items without similar commits fall back to the baseline prompt
+		has_examples = df['nr_similar_commits_no_initial'] != 0
+		examples = df['most_similar_commits_messages'].fillna('').str.split('||-||', regex=False).map(numbered_messages)
 
-			diff = item['diff']
+		fewshot = FEWSHOT_TEMPLATE.render_columns(examples=examples, diff=df['diff'])
+		baseline = BASELINE_TEMPLATE.render_columns(diff=df['diff'])
 
-			if item['nr_similar_commits_no_initial'] == 0:
-				prompt = baseline_prompt(diff)
-			else:
-				messages = item['most_similar_commits_messages'].split('||-||')
-				prompt = fewshot_prompt(diff, messages)
+		return fewshot.where(has_examples, baseline)
 
-			items.append(InputItem(item['hash'], item['project'], item['message'], prompt))
-		
-		return items
-	
 	def name(self):
 		return "fewshot"
 
 # Chain-of-Thought (CoT) experiment that uses the CoT prompt
 class CoTExperiment(Experiment):
-	def inputs(self):
-		df = read_csv(self.folder + '/commitbench_subset_similar.csv')
+	source = 'commitbench_subset_similar.csv'
 
-		items = []
+	def prompts(self, df: DataFrame) -> Series:
+		return COT_TEMPLATE.render_columns(diff=df['diff'] + "\n")
 
-		for i in range(self.size):
-			item = df.iloc[i]
-
-			diff = item['diff'] + "\n"
-			prompt = cot_prompt(diff)
-
-			items.append(InputItem(item['hash'], item['project'], item['message'], prompt))
-		
-		return items
-	
 	def name(self):
 		return "cot"
 
+# Place an identical input file for another model, without writing the content again
+def link_file(source: str, target: str, mode: str):
+	if os.path.lexists(target):
+		os.remove(target)
+
+	try:
+		if mode == "symlink":
+			os.symlink(os.path.relpath(source, os.path.dirname(target)), target)
+			return
+		if mode == "hardlink":
+			os.link(source, target)
+			return
+	except OSError as e:
+		print(f"Could not {mode} {target} ({e}), copying instead")
+
+	shutil.copyfile(source, target)
+
 # List of supported models
 MODELS = ["mistral", "codellama", "phi3.5"]
 
@@ -159,24 +146,47 @@ MODELS = ["mistral", "codellama", "phi3.5"]
 SIZE = 1000
 
 # List of experiments to run
-EXPERIMENTS = [BaselineExperiment(SIZE, __FOLDER), FewShotExperiment(SIZE, __FOLDER), CoTExperiment(SIZE, __FOLDER)]
+EXPERIMENTS = {
+	"baseline": BaselineExperiment,
+	"fewshot": FewShotExperiment,
+	"cot": CoTExperiment
+}
 
 # Folder for input data
 FOLDER = __FOLDER + '/../input'
 
-# Ensure the input folder exists
-os.makedirs(FOLDER, exist_ok=True)
+parser = argparse.ArgumentParser(description="Generate the input files with the prompts for every model and experiment.")
+
+parser.add_argument("--models", type=str, nargs="+", default=MODELS, help="The models to generate input files for.")
+parser.add_argument("--experiments", type=str, nargs="+", default=list(EXPERIMENTS.keys()), choices=EXPERIMENTS.keys(), help="The experiments to generate input files for.")
+parser.add_argument("--size", type=int, default=SIZE, help="The number of items per input file.")
+parser.add_argument("--dataset_folder", type=str, default=__FOLDER, help="The folder containing the dataset files.")
+parser.add_argument("--output_folder", type=str, default=FOLDER, help="The folder to save the input files.")
+parser.add_argument("--link", type=str, default="hardlink", choices=["hardlink", "symlink", "copy"], help="How to place the identical input files of the other models.")
+parser.add_argument("--chunksize", type=int, default=250, help="The number of items read and written at a time.")
+parser.add_argument("--format", type=str, default="csv", choices=["csv", "arrow"], help="Read the dataset and write the input files as CSV or as memory-mapped Arrow files (convert the dataset first with dataset.py).")
+add_profile_arguments(parser)
+
+if __name__ == "__main__":
+	args = parser.parse_args()
+	start_profiling(args)
+
+	# Ensure the input folder exists
+	os.makedirs(args.output_folder, exist_ok=True)
+
+	# Prompts do not depend on the model, so every experiment is generated once and shared by all models
+	for name in args.experiments:
+		experiment = EXPERIMENTS[name](args.size, args.dataset_folder, args.format)
+
+		files = [f"{args.output_folder}/{model}_{args.size}_{experiment.name()}.{args.format}" for model in args.models]
 
-# Generate input CSV files for each model and experiment
-for model in MODELS:
-	for experiment in EXPERIMENTS:
-		items = experiment.inputs()
+		with span("prepare_input.write", experiment.name()):
+			experiment.write(files[0], args.chunksize)
 
-		# Create a DataFrame to store the experiment inputs
-		df = DataFrame(columns=["hash", "project", "true_message", "prompt"])
+		with span("prepare_input.link", experiment.name()):
+			for file in files[1:]:
+				link_file(files[0], file, args.link)
 
-		for item in items:
-			df.loc[len(df)] = item.value()
+		print(f"Generated {', '.join(os.path.basename(file) for file in files)}")
 
-		# Save the DataFrame as a CSV file
-		df.to_csv(f"{FOLDER}/{model}_{SIZE}_{experiment.name()}.csv", index=False)
\ No newline at end of file
+	stop_profiling(args, "prepare_input")
@@ -0,0 +1,123 @@
+import argparse
+import cProfile
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from pandas import DataFrame
+
+# A single timed section of a stage, optionally for one item of the stage
+class Span:
+    name: str
+    item: str|None
+    start: float
+    duration: float
+
+    def __init__(self, name: str, item: str|None, start: float, duration: float):
+        self.name = name
+        self.item = item
+        self.start = start
+        self.duration = duration
+
+# Collects the spans of a run. Disabled by default, so the spans cost nothing unless --profile is given.
+class Profiler:
+    enabled: bool = False
+    spans: list[Span]
+    lock: threading.Lock
+    start_time: float
+    cprofile: cProfile.Profile|None = None
+
+    def __init__(self):
+        self.spans = []
+        self.lock = threading.Lock()
+        self.start_time = time.perf_counter()
+
+    def enable(self, cprofile: bool = False):
+        self.enabled = True
+        self.start_time = time.perf_counter()
+
+        if cprofile:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    # Time the body of a with statement as a span of the given stage
+    @contextmanager
+    def timed(self, name: str, item: str|None = None):
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            span = Span(name, item, start - self.start_time, time.perf_counter() - start)
+
+            with self.lock:
+                self.spans.append(span)
+
+    def span(self, name: str, item=None):
+        if not self.enabled:
+            return nullcontext()
+
+        return self.timed(name, None if item is None else str(item))
+
+    # Total, mean and maximum time of every stage, in the order the stages first started
+    def stage_report(self) -> DataFrame:
+        elapsed = time.perf_counter() - self.start_time
+        stages = {}
+
+        with self.lock:
+            for span in self.spans:
+                stage = stages.setdefault(span.name, {"stage": span.name, "first_start": span.start, "count": 0, "total": 0.0, "max": 0.0})
+                stage["count"] += 1
+                stage["total"] += span.duration
+                stage["max"] = max(stage["max"], span.duration)
+
+        report = DataFrame(list(stages.values()), columns=["stage", "first_start", "count", "total", "max"])
+        report["mean"] = report["total"] / report["count"]
+        # Nested and parallel spans overlap, so the shares do not add up to 100%
+        report["share"] = report["total"] / elapsed if elapsed > 0 else 0
+
+        return report.sort_values("first_start").drop(columns="first_start").reset_index(drop=True)
+
+    # Every span that belongs to an item, to find the slowest items of a stage
+    def item_report(self) -> DataFrame:
+        with self.lock:
+            rows = [{"stage": span.name, "item": span.item, "start": span.start, "duration": span.duration} for span in self.spans if span.item is not None]
+
+        return DataFrame(rows, columns=["stage", "item", "start", "duration"])
+
+    # Write the reports, and the cProfile statistics if enabled, to the given folder
+    def save(self, folder: str, name: str):
+        os.makedirs(folder, exist_ok=True)
+
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            # Readable by pstats, snakeviz and flameprof
+            self.cprofile.dump_stats(os.path.join(folder, f"{name}.prof"))
+
+        stages = self.stage_report()
+        stages.to_csv(os.path.join(folder, f"{name}_stages.csv"), index=False)
+        self.item_report().to_csv(os.path.join(folder, f"{name}_items.csv"), index=False)
+
+        print(stages.to_string(index=False, float_format=lambda value: f"{value:.4f}"))
+
+# The profiler shared by all modules of a run
+profiler = Profiler()
+
+# Time a stage, or a single item of a stage, of the pipeline
+def span(name: str, item=None):
+    return profiler.span(name, item)
+
+def add_profile_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--profile", action="store_true", help="Time every stage and item and write a timing report.")
+    parser.add_argument("--profile_folder", type=str, default="./profile", help="The folder to write the timing report to.")
+    parser.add_argument("--cprofile", action="store_true", help="With --profile, also write a cProfile dump of the main thread.")
+
+def start_profiling(args: argparse.Namespace):
+    if args.profile:
+        profiler.enable(args.cprofile)
+
+# Write the report of the run, named after the script that ran
+def stop_profiling(args: argparse.Namespace, name: str):
+    if args.profile:
+        profiler.save(args.profile_folder, name)
@@ -0,0 +1,134 @@
+import hashlib
+from string import Formatter
+
+# A prompt split into a static prefix, identical for every item, and a variable suffix.
+# The prefix must stay byte-stable: Ollama and llama.cpp only reuse the KV cache of a prompt prefix
+# when the tokens match exactly, so anything item-specific belongs in the suffix.
+class PromptTemplate:
+    name: str
+    prefix: str
+    suffix: str
+
+    def __init__(self, name: str, prefix: str, suffix: str):
+        self.name = name
+        self.prefix = prefix
+        self.suffix = suffix
+
+    # Render the full prompt, only the suffix is filled with the given values
+    def render(self, **values: str) -> str:
+        return self.prefix + self.suffix.format(**values)
+
+    # Render the prompts of a whole column at once, the values can be anything concatenable with a string such as a pandas Series
+    def render_columns(self, **columns):
+        result = self.prefix
+
+        for literal, field, _, _ in Formatter().parse(self.suffix):
+            result = result + literal
+
+            if field is not None:
+                result = result + columns[field]
+
+        return result
+
+    # Check if a rendered prompt was produced by this template
+    def matches(self, prompt: str) -> bool:
+        return prompt.startswith(self.prefix)
+
+    # Short hash of the template text, changes whenever the prefix or suffix is edited
+    @property
+    def fingerprint(self) -> str:
+        return hashlib.sha256((self.prefix + self.suffix).encode("utf-8")).hexdigest()[:12]
+
+BASELINE_TEMPLATE = PromptTemplate(
+    "baseline",
+    """You are a programmer to produce concise, descriptive commit messages for Git changes. 
+Do not include references to issue numbers or pull requests.
+
+Now here is the new Git diff for which you must generate a commit message:
+""",
+    """{diff}
+
+Format:
+A short commit message (in one sentence) describing what changed and why.
+
+Output:
+""")
+
+FEWSHOT_TEMPLATE = PromptTemplate(
+    "fewshot",
+    """You are a programmer to produce concise, descriptive commit messages for Git changes. 
+Below are up to three examples of commit messages that previously touched upon the same code or files. 
+Please note that the first example is more important and should influence your message the most. 
+Use the style and context of these examples, prioritizing the first examples, to inspire a new commit message for the provided Git diff. 
+Do not include references to issue numbers or pull requests.
+
+Examples of relevant commit messages:
+""",
+    """{examples}
+
+Now here is the new Git diff for which you must generate a commit message:
+{diff}
+
+Format:
+A short commit message (in one sentence) describing what changed and why, consistent with the style 
+and context demonstrated by the above examples.
+
+Output:
+""")
+
+COT_TEMPLATE = PromptTemplate(
+    "cot",
+    """You are a programmer to produce concise, descriptive commit messages for Git changes.
+Do not include references to issue numbers or pull requests.
+
+Now here is the new Git diff for which you must generate a commit message:
+""",
+    """{diff}
+
+Let's think step by step. Number every step before giving the final answer as [[ANSWER]] or ANSWER: ANSWER.
+
+Steps:
+""")
+
+# The per-file prompt of the VS Code extension, the prefix is the same for all files so the server reuses its KV cache.
+# It must stay identical to the prompt in extension/commit-generation/src/extension.ts.
+EXTENSION_TEMPLATE = PromptTemplate(
+    "extension",
+    """
+            You are an AI assistant designed to produce concise, descriptive commit messages for Git changes. 
+            Below are up to three examples of commit messages that previously touched upon the same code or files. 
+            Please note that the first example is more important and should influence your message the most. 
+            Use the style and context of these examples, prioritizing the first examples, to inspire a new commit message for the provided Git diff.  Do not include references to issue numbers or pull requests.  Do not surround with quotes.
+            Generate a concise one-sentence Git commit message for changes in a single file.
+            Examples of relevant commit messages:
+            Fix null pointer exception in authentication
+Refactor logging setup for better traceability
+Improve API request handling to avoid timeouts
+            File: """,
+    """{file}
+            Diff:
+            {diff}
+            Output:
+           - A short commit message (in one sentence) describing what changed and why, consistent with the style 
+            and context demonstrated by the above examples.""")
+
+# All templates, longest prefix first so the most specific template wins when matching a prompt
+TEMPLATES = sorted([BASELINE_TEMPLATE, FEWSHOT_TEMPLATE, COT_TEMPLATE, EXTENSION_TEMPLATE], key=lambda template: len(template.prefix), reverse=True)
+
+# Find the template a rendered prompt was produced with, None if the prompt does not share a known prefix
+def match_template(prompt: str) -> PromptTemplate|None:
+    for template in TEMPLATES:
+        if template.matches(prompt):
+            return template
+
+    return None
+
+# Key used to schedule prompts sharing the same static prefix back to back
+def prefix_key(prompt: str) -> str:
+    template = match_template(prompt)
+
+    return template.name if template is not None else ""
+
+# Build the prompt of the extension for the staged diff of a single file
+def extension_prompt(file: str, diff: str) -> str:
+    return EXTENSION_TEMPLATE.render(file=file, diff=diff)
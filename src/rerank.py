@@ -0,0 +1,78 @@
+import math
+import re
+
+# Picks the best of several sampled messages without a model: every sample is scored by its ROUGE-L agreement with
+# the other samples, so the message closest to what the model generates most of the time wins, plus a prior on the length.
+
+TOKEN = re.compile(r"\w+|[^\w\s]")
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN.findall(text.lower())
+
+# Length of the longest common subsequence of two token lists
+def lcs_length(a: list[str], b: list[str]) -> int:
+    if len(a) < len(b):
+        a, b = b, a
+
+    previous = [0] * (len(b) + 1)
+
+    for token in a:
+        current = [0]
+
+        for j, other in enumerate(b):
+            current.append(previous[j] + 1 if token == other else max(previous[j + 1], current[j]))
+
+        previous = current
+
+    return previous[-1]
+
+# ROUGE-L F-measure of two token lists, without the stemming of rouge_score, which is enough to compare samples
+def rouge_l(a: list[str], b: list[str]) -> float:
+    if len(a) == 0 or len(b) == 0:
+        return 0
+
+    lcs = lcs_length(a, b)
+
+    if lcs == 0:
+        return 0
+
+    precision = lcs / len(b)
+    recall = lcs / len(a)
+
+    return 2 * precision * recall / (precision + recall)
+
+class Reranker:
+    length_weight: float
+    target_length: int
+    length_spread: float
+
+    # The length prior is a log-normal around the target number of tokens, commit messages are short
+    def __init__(self, length_weight: float = 0.1, target_length: int = 12, length_spread: float = 1):
+        self.length_weight = length_weight
+        self.target_length = target_length
+        self.length_spread = length_spread
+
+    def length_prior(self, length: int) -> float:
+        if length == 0:
+            return -math.inf
+
+        return -0.5 * (math.log(length / self.target_length) / self.length_spread) ** 2
+
+    # Score every sample, empty samples always lose
+    def scores(self, samples: list[str]) -> list[float]:
+        tokens = [tokenize(sample) for sample in samples]
+        scores = []
+
+        for i, sample in enumerate(tokens):
+            others = [rouge_l(other, sample) for j, other in enumerate(tokens) if j != i]
+            agreement = sum(others) / len(others) if len(others) > 0 else 0
+
+            scores.append(agreement + self.length_weight * self.length_prior(len(sample)))
+
+        return scores
+
+    # The index of the best sample, the first one on ties
+    def best(self, samples: list[str]) -> int:
+        scores = self.scores(samples)
+
+        return max(range(len(samples)), key=lambda i: (scores[i], -i))
@@ -2,13 +2,20 @@
 
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
-import ollama
 from pandas import DataFrame
 import argparse
 import time
+import signal
 import sys
 from threading import Lock
 
+from backends import Backend, OllamaBackend, add_backend_arguments, create_backend
+from cancellation import CancellationToken, Cancelled, with_token
+from metrics import MetricsExport, add_metrics_arguments
+from message_cache import MessageCache, MessageKey, default_cache_folder
+from prompt_template import extension_prompt
+from watcher import git_dir
+
 
 #from post_processing.post_processing_csv import convert_to_result_file
 #from post_processing.graphs import read_from_files_for_graphs
@@ -19,17 +26,16 @@ from threading import Lock
 # --------------------------------------------------------------------
 class Model:
     name: str = ""
+    backend: Backend
+
+    def __init__(self, backend: Backend | None = None):
+        self.backend = backend if backend is not None else OllamaBackend()
 
     def run(self, prompt: str, temperature: float) -> str:
-        response = ollama.generate(model=self.name, prompt=prompt, options={"temperature": temperature})
-        return response.response
+        return self.backend.generate(self.name, prompt, {"temperature": temperature}).text
 
     def check_installed(self) -> bool:
-        try:
-            ollama.show(self.name)
-            return True
-        except:
-            return False
+        return self.backend.check_installed(self.name)
 
 class MistralModel(Model):
     name: str = "mistral"
@@ -49,7 +55,14 @@ class TxtExperiment:
     start_time: float = 0
     workers: int
     temperature: float
+    # The staged file the diff on stdin belongs to, the prompt is then built here instead of by the extension
+    file: str | None = None
+    diff: str = ""
+    cache: MessageCache | None = None
+    cache_size: int = 1000
     file_lock = Lock()
+    # Cancels the generations in flight when the extension stops the run
+    token: CancellationToken
 
     def __init__(
         self,
@@ -58,9 +71,17 @@ class TxtExperiment:
         output_txt: str,
         process_amount: int,
         workers: int,
-        temperature: float
+        temperature: float,
+        backend: Backend | None = None,
+        file: str | None = None,
+        cache: MessageCache | None = None,
+        cache_size: int = 1000
     ):
-        self.model = MistralModel()
+        self.model = MistralModel(backend)
+        self.token = CancellationToken()
+        self.file = file
+        self.cache = cache
+        self.cache_size = cache_size
         self.prompt = "fewshot"
         
         # self.txt_file = txt_file
@@ -99,6 +120,10 @@ class TxtExperiment:
 
         # Possibly split into lines or treat as one prompt
         lines = [diff_content]
+
+        if self.file is not None:
+            self.diff = diff_content
+            lines = [extension_prompt(self.file, diff_content)]
         self.input_df = DataFrame({"prompt": lines})
         self.process_amount = len(lines)
 
@@ -125,8 +150,40 @@ class TxtExperiment:
     def process_item(self, index: int, temperature: float) -> dict:
         item = self.input_df.iloc[index]
         prompt_line = item["prompt"]
+
+        # Reuse the message of the same staged content, generated by an earlier run or in the background by the watcher.
+        # When another process is generating it right now, wait for its message instead of generating it again.
+        if self.cache is not None and self.file is not None:
+            key = MessageKey(self.file, self.diff, self.model.name)
+            message, claimed = self.cache.get_or_claim(key)
+
+            if message is not None:
+                print(f"Using the cached message of {self.file}", file=sys.stderr)
+                return {
+                    "prompt": prompt_line,
+                    "generated_message": message
+                }
+
+            try:
+                generated_message = self.model.run(prompt_line, temperature)
+
+                # An empty message would be returned from the cache forever instead of generating it again
+                if generated_message.strip():
+                    self.cache.put(key, generated_message)
+                    self.cache.prune(self.cache_size)
+            finally:
+                # Only release a claim of this process, not the one of a process that is still generating the message
+                if claimed:
+                    self.cache.release(key)
+
+            return {
+                "prompt": prompt_line,
+                "generated_message": generated_message
+            }
+
         # Generate the commit message using the few-shot prompt
         generated_message = self.model.run(prompt_line, temperature)
+
         return {
             "prompt": prompt_line,
             "generated_message": generated_message
@@ -141,7 +198,8 @@ class TxtExperiment:
         print(
             f"Progress: {completed}/{total} "
             f"({(completed/total)*100:.2f}%) done. "
-            f"Elapsed {time_elapsed:.2f}s, remaining: {time_remaining:.2f}s",file=sys.stderr
+            f"Elapsed {time_elapsed:.2f}s, remaining: {time_remaining:.2f}s"
+            + (f", cache hits: {self.cache.hits}/{self.cache.hits + self.cache.misses} ({self.cache.hit_ratio*100:.2f}%), waited for {self.cache.waited}" if self.cache is not None else ""),file=sys.stderr
         )
     
     def append_result(self, index: int, result: dict):
@@ -167,7 +225,7 @@ class TxtExperiment:
     def run_parallel(self):
         with ThreadPoolExecutor(max_workers=self.workers) as executor:
             futures = {
-                executor.submit(self.process_item, i, self.temperature): i
+                executor.submit(with_token, self.token, self.process_item, i, self.temperature): i
                 for i in range(self.process_amount)
             }
             total = len(futures)
@@ -183,11 +241,14 @@ class TxtExperiment:
                         self.append_result(index, result)
                         completed += 1
                         self.print_progress(completed, total)
+                    except Cancelled:
+                        continue
                     except Exception as e:
                         print(f"Error processing item {index}: {e}")
                         self.append_error(index)
             except KeyboardInterrupt:
-                print("Interrupted")
+                print("Interrupted", file=sys.stderr)
+                self.token.cancel()
                 executor.shutdown(wait=False, cancel_futures=True)
                 raise KeyboardInterrupt()
 
@@ -196,7 +257,7 @@ class TxtExperiment:
         self.start()
         for i in range(self.process_amount):
             try:
-                result = self.process_item(i, self.temperature)
+                result = with_token(self.token, self.process_item, i, self.temperature)
                 self.append_result(i, result)
                 self.print_progress(i+1, self.process_amount)
             except Exception as e:
@@ -212,9 +273,21 @@ parser.add_argument("--process_amount", type=int, default=1, help="Number of lin
 parser.add_argument("--workers", type=int, default=5, help="Number of parallel workers.")
 parser.add_argument("--sequential", action="store_true", help="Run sequentially instead of parallel.")
 parser.add_argument("--temperature", type=float, default=0.7, help="Model generation temperature.")
+parser.add_argument("--file", type=str, default=None, help="The staged file of the diff on stdin, builds the per-file prompt and uses the messages pre-generated by watcher.py.")
+parser.add_argument("--cache_folder", type=str, default=None, help="The message cache shared with watcher.py (defaults to .git/commit_message_cache).")
+parser.add_argument("--cache_size", type=int, default=1000, help="The number of messages kept in the cache.")
+parser.add_argument("--no_cache", action="store_true", help="Always generate, without using or filling the message cache.")
+add_backend_arguments(parser)
+add_metrics_arguments(parser)
+# A developer is waiting for the extension, so its requests go before batch experiments on a shared server
+parser.set_defaults(priority="interactive")
 
 if __name__ == "__main__":
     args = parser.parse_args()
+    # The extension stops the run with SIGTERM when the staged changes changed, handle it like Ctrl+C so the
+    # generations in flight are cancelled instead of running to the end
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    metrics = MetricsExport(create_backend(args), args)
     # open(args.output_csv, "w").close()  
     # open(args.output_txt, "w").close()  
     experiment = TxtExperiment(
@@ -223,21 +296,36 @@ if __name__ == "__main__":
         output_txt=args.output_txt,
         process_amount=args.process_amount,
         workers=args.workers,
-        temperature=args.temperature
+        temperature=args.temperature,
+        backend=metrics.backend,
+        file=args.file,
+        cache=MessageCache(args.cache_folder or default_cache_folder(git_dir("."))) if args.file is not None and not args.no_cache else None,
+        cache_size=args.cache_size
     )
 
-    experiment.check_installed()
-    experiment.read_input()
+    try:
+        experiment.check_installed()
+        experiment.read_input()
 
-    if args.sequential:
-        experiment.run()
-    else:
-        experiment.run_parallel()
+        if args.sequential:
+            experiment.run()
+        else:
+            experiment.run_parallel()
+    except KeyboardInterrupt:
+        metrics.stop()
+        print("Cancelled the generation", file=sys.stderr)
+        sys.exit(130)
 
     # Write full table to CSV
     experiment.save_output_csv()
     # Write only generated messages to .txt
     experiment.save_output_txt()
+    metrics.stop()
+
+    report = metrics.backend.report()
+
+    if report:
+        print(report, file=sys.stderr)
     for msg in experiment.output_df["generated_message"]:
         if isinstance(msg, str) and msg.strip():
             print(msg)
@@ -0,0 +1,294 @@
+import argparse
+import contextlib
+import heapq
+import http.client
+import itertools
+import json
+import select
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+from urllib.parse import urlsplit
+
+from metrics import QUANTILES, quantile
+
+# Priority classes, requests name their class in the X-Priority header and requests without one are batch work
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+PRIORITIES = {
+    INTERACTIVE: 0,
+    BATCH: 1
+}
+
+# Raised for a queued request whose client disconnected before it got a slot
+class Abandoned(Exception):
+    pass
+
+# Admits the requests to the model server in priority order.
+# Queued interactive requests go before all queued batch requests, and while there is interactive traffic, and for a
+# cooldown after it, fewer batch requests run at once so the next interactive request finds a free slot.
+class PriorityScheduler:
+    concurrency: int
+    interactive_batch_concurrency: int
+    cooldown: float
+    condition: threading.Condition
+    queue: list[tuple[int, int, str]]
+    sequence: itertools.count
+    running: dict[str, int]
+    waits: dict[str, list[float]]
+    abandoned: dict[str, int]
+    last_interactive: float
+
+    def __init__(self, concurrency: int = 4, interactive_batch_concurrency: int = 1, cooldown: float = 5):
+        self.concurrency = concurrency
+        self.interactive_batch_concurrency = interactive_batch_concurrency
+        self.cooldown = cooldown
+        self.condition = threading.Condition()
+        self.queue = []
+        self.sequence = itertools.count()
+        self.running = {priority_class: 0 for priority_class in PRIORITIES}
+        self.waits = {priority_class: [] for priority_class in PRIORITIES}
+        self.abandoned = {priority_class: 0 for priority_class in PRIORITIES}
+        self.last_interactive = -cooldown
+
+    def interactive_present(self) -> bool:
+        queued = any(entry[2] == INTERACTIVE for entry in self.queue)
+
+        return queued or self.running[INTERACTIVE] > 0 or time.time() - self.last_interactive < self.cooldown
+
+    # The seconds until the batch limit goes up again after the last interactive request, None when it will not
+    # change by itself and only a request starting or finishing can let a queued request start
+    def cooldown_left(self) -> float|None:
+        left = self.last_interactive + self.cooldown - time.time()
+
+        return max(left, 0.01) if left > 0 else None
+
+    # The number of batch requests allowed to run at the same time
+    def batch_limit(self) -> int:
+        return self.interactive_batch_concurrency if self.interactive_present() else self.concurrency
+
+    # Only the first request in the queue can start, so a batch request never overtakes an interactive one
+    def can_start(self, entry: tuple[int, int, str]) -> bool:
+        if self.queue[0] != entry or sum(self.running.values()) >= self.concurrency:
+            return False
+
+        return entry[2] == INTERACTIVE or self.running[BATCH] < self.batch_limit()
+
+    # Wait for a slot of the priority class and hold it while the request runs. A request whose client is gone by the
+    # time it could start, as told by client_gone, raises Abandoned and leaves the slot to the next request.
+    @contextlib.contextmanager
+    def slot(self, priority_class: str, client_gone: Callable[[], bool]|None = None):
+        start = time.time()
+        entry = (PRIORITIES[priority_class], next(self.sequence), priority_class)
+
+        with self.condition:
+            heapq.heappush(self.queue, entry)
+
+            if priority_class == INTERACTIVE:
+                self.last_interactive = start
+
+            # Wake up when the cooldown ends, the batch limit goes up again then
+            while not self.can_start(entry):
+                self.condition.wait(self.cooldown_left())
+
+            heapq.heappop(self.queue)
+
+            if client_gone is not None and client_gone():
+                self.abandoned[priority_class] += 1
+                self.condition.notify_all()
+                raise Abandoned()
+
+            self.running[priority_class] += 1
+            self.waits[priority_class].append(time.time() - start)
+            self.condition.notify_all()
+
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.running[priority_class] -= 1
+
+                if priority_class == INTERACTIVE:
+                    self.last_interactive = time.time()
+
+                self.condition.notify_all()
+
+    # Queue wait times per priority class
+    def snapshot(self) -> dict:
+        with self.condition:
+            classes = {}
+
+            for priority_class, waits in self.waits.items():
+                waits = sorted(waits)
+
+                classes[priority_class] = {
+                    "requests": len(waits),
+                    "running": self.running[priority_class],
+                    "queued": sum(1 for entry in self.queue if entry[2] == priority_class),
+                    "abandoned": self.abandoned[priority_class],
+                    "wait_mean": sum(waits) / len(waits) if len(waits) > 0 else 0,
+                    "wait": {str(q): quantile(waits, q) for q in QUANTILES}
+                }
+
+            return {"batch_limit": self.batch_limit(), "classes": classes}
+
+    def report(self) -> str:
+        snapshot = self.snapshot()
+        lines = []
+
+        for priority_class, stats in snapshot["classes"].items():
+            waits = ", ".join(f"p{int(float(q) * 100)} {wait:.3f}s" for q, wait in stats["wait"].items())
+            lines.append(f"{priority_class}: {stats['requests']} requests, {stats['running']} running, {stats['queued']} queued, {stats['abandoned']} abandoned, queue wait mean {stats['wait_mean']:.3f}s, {waits}")
+
+        lines.append(f"Batch concurrency: {snapshot['batch_limit']}")
+
+        return "\n".join(lines)
+
+# An Ollama compatible server that forwards every request to the real server, the generation requests through the scheduler
+class SchedulerProxy(ThreadingHTTPServer):
+    daemon_threads = True
+    scheduler: PriorityScheduler
+    upstream_host: str
+    upstream_port: int
+
+    def __init__(self, scheduler: PriorityScheduler, upstream: str, port: int, host: str = "127.0.0.1"):
+        super().__init__((host, port), ProxyRequestHandler)
+        self.scheduler = scheduler
+
+        url = urlsplit(upstream if "://" in upstream else f"http://{upstream}")
+        self.upstream_host = url.hostname or "localhost"
+        self.upstream_port = url.port or 11434
+
+class ProxyRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: SchedulerProxy
+
+    # The requests that occupy the model, everything else is forwarded right away
+    SCHEDULED_PATHS = {"/api/generate", "/api/chat", "/api/embed", "/api/embeddings"}
+
+    # Headers that only apply to a single connection
+    HOP_HEADERS = {"connection", "keep-alive", "transfer-encoding", "content-length", "host"}
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == "/scheduler/stats":
+            body = json.dumps(self.server.scheduler.snapshot()).encode("utf-8")
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.forward()
+
+    def do_POST(self):
+        self.forward()
+
+    def do_DELETE(self):
+        self.forward()
+
+    def forward(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        if self.path.split("?")[0] not in self.SCHEDULED_PATHS:
+            self.relay(body)
+            return
+
+        priority_class = self.headers.get("X-Priority", BATCH).lower()
+
+        try:
+            with self.server.scheduler.slot(priority_class if priority_class in PRIORITIES else BATCH, self.client_gone):
+                self.relay(body)
+        except Abandoned:
+            self.close_connection = True
+
+    # Whether the client closed the connection, a cancelled generation stops reading and closes it while still queued
+    def client_gone(self) -> bool:
+        try:
+            readable, _, _ = select.select([self.connection], [], [], 0)
+
+            return len(readable) > 0 and self.connection.recv(1, socket.MSG_PEEK) == b""
+        except OSError:
+            return True
+
+    # Send the request to the model server and stream its response back as it arrives
+    def relay(self, body: bytes):
+        connection = http.client.HTTPConnection(self.server.upstream_host, self.server.upstream_port)
+        headers = {key: value for key, value in self.headers.items() if key.lower() not in self.HOP_HEADERS}
+
+        try:
+            connection.request(self.command, self.path, body, headers)
+            response = connection.getresponse()
+        except OSError as e:
+            connection.close()
+            self.send_error(502, f"Model server unreachable: {e}")
+            return
+
+        try:
+            length = response.getheader("Content-Length")
+
+            self.send_response(response.status)
+            for key, value in response.getheaders():
+                if key.lower() not in self.HOP_HEADERS:
+                    self.send_header(key, value)
+
+            if length is not None:
+                self.send_header("Content-Length", length)
+            else:
+                self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            while chunk := response.read1(65536):
+                if length is None:
+                    self.wfile.write(f"{len(chunk):x}\r\n".encode("ascii") + chunk + b"\r\n")
+                else:
+                    self.wfile.write(chunk)
+                self.wfile.flush()
+
+            if length is None:
+                self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading, closing the upstream connection stops the generation and frees the slot
+            self.close_connection = True
+        finally:
+            connection.close()
+
+parser = argparse.ArgumentParser(description="Run a local proxy in front of Ollama that serves interactive requests before batch experiments.")
+
+parser.add_argument("--upstream", type=str, default="http://localhost:11434", help="The Ollama server to forward the requests to.")
+parser.add_argument("--port", type=int, default=11435, help="The port the proxy listens on, point --host of the clients to it.")
+parser.add_argument("--concurrency", type=int, default=4, help="The number of requests sent to the server at once, set it to OLLAMA_NUM_PARALLEL.")
+parser.add_argument("--interactive_batch_concurrency", type=int, default=1, help="The number of batch requests running at once while there are interactive requests.")
+parser.add_argument("--cooldown", type=float, default=5, help="The seconds after the last interactive request before the batch concurrency goes back up.")
+parser.add_argument("--report_interval", type=float, default=0, help="Print the queue wait times every this many seconds.")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    scheduler = PriorityScheduler(args.concurrency, args.interactive_batch_concurrency, args.cooldown)
+    proxy = SchedulerProxy(scheduler, args.upstream, args.port)
+
+    if args.report_interval > 0:
+        def print_reports():
+            while True:
+                time.sleep(args.report_interval)
+                print(scheduler.report(), file=sys.stderr)
+
+        threading.Thread(target=print_reports, daemon=True).start()
+
+    print(f"Scheduling requests to {args.upstream} on port {args.port}", file=sys.stderr)
+
+    try:
+        proxy.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        proxy.server_close()
+        print(scheduler.report(), file=sys.stderr)
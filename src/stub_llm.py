@@ -0,0 +1,365 @@
+import argparse
+import contextlib
+import datetime
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Deterministic stand-in for an LLM, served over an Ollama compatible HTTP API or used in-process by the stub backend.
+# Latency is simulated from a time to first token, a token rate and a relative jitter, so benchmarks can tell the
+# orchestration overhead apart from the (simulated) model time.
+
+WORDS = ["Fix", "Add", "Update", "Refactor", "Remove", "handling", "of", "the", "parser", "tests", "config", "docs", "for", "edge", "cases"]
+
+# Generate a deterministic message, the same model and prompt always give the same message
+def stub_message(model: str, prompt: str, length: int = 8) -> str:
+    digest = hashlib.sha256(f"{model}\0{prompt}".encode("utf-8")).digest()
+
+    return " ".join(WORDS[digest[i % len(digest)] % len(WORDS)] for i in range(length))
+
+# Raised when a request is selected for error injection
+class InjectedError(Exception):
+    pass
+
+# Timing and failure behaviour of the stand-in model
+class StubProfile:
+    ttft: float
+    token_rate: float
+    jitter: float
+    error_rate: float
+    length: int
+    seed: int
+    load_time: float
+    parallel: int
+
+    def __init__(self, ttft: float = 0, token_rate: float = 0, jitter: float = 0, error_rate: float = 0, length: int = 8, seed: int = 0, load_time: float = 0, parallel: int = 0):
+        self.ttft = ttft
+        self.token_rate = token_rate
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.length = length
+        self.seed = seed
+        self.load_time = load_time
+        self.parallel = parallel
+
+    # Limit on the generations running at the same time, like the parallel slots of an Ollama server
+    def slots(self):
+        return threading.BoundedSemaphore(self.parallel) if self.parallel > 0 else contextlib.nullcontext()
+
+    # Random source for a single request, seeded by the prompt so repeated runs behave the same
+    def request_random(self, model: str, prompt: str) -> random.Random:
+        return random.Random(f"{self.seed}\0{model}\0{prompt}")
+
+    # Apply the relative jitter to a duration
+    def jittered(self, rng: random.Random, duration: float) -> float:
+        return max(duration * (1 + rng.uniform(-self.jitter, self.jitter)), 0)
+
+    # Check if a request should fail
+    def should_fail(self, rng: random.Random) -> bool:
+        return rng.random() < self.error_rate
+
+    # Time until the first token is produced
+    def first_token_delay(self, rng: random.Random) -> float:
+        return self.jittered(rng, self.ttft)
+
+    # Time between two produced tokens
+    def token_delay(self, rng: random.Random) -> float:
+        return self.jittered(rng, 1 / self.token_rate) if self.token_rate > 0 else 0
+
+    # Generate the tokens of a message, sleeping as the simulated model would, yields (token, elapsed seconds)
+    def stream(self, model: str, prompt: str):
+        rng = self.request_random(model, prompt)
+
+        if self.should_fail(rng):
+            raise InjectedError("injected error")
+
+        start = time.perf_counter()
+        time.sleep(self.first_token_delay(rng))
+
+        for i, word in enumerate(stub_message(model, prompt, self.length).split(" ")):
+            if i > 0:
+                time.sleep(self.token_delay(rng))
+
+            yield (word if i == 0 else " " + word), time.perf_counter() - start
+
+    # Add the arguments used to configure the stand-in model
+    @staticmethod
+    def add_arguments(parser: argparse.ArgumentParser, prefix: str = ""):
+        parser.add_argument(f"--{prefix}ttft", type=float, default=0, help="The simulated time to first token in seconds.")
+        parser.add_argument(f"--{prefix}token_rate", type=float, default=0, help="The simulated tokens per second (0 for instant).")
+        parser.add_argument(f"--{prefix}jitter", type=float, default=0, help="The relative jitter applied to every simulated delay.")
+        parser.add_argument(f"--{prefix}error_rate", type=float, default=0, help="The fraction of requests that fail.")
+        parser.add_argument(f"--{prefix}load_time", type=float, default=0, help="The simulated time to load a model that is not resident.")
+        parser.add_argument(f"--{prefix}parallel", type=int, default=0, help="The number of requests generated at the same time (0 for unlimited).")
+
+    # Create the profile from the parsed command line arguments
+    @classmethod
+    def from_args(cls, args: argparse.Namespace, prefix: str = "") -> "StubProfile":
+        return cls(getattr(args, f"{prefix}ttft"), getattr(args, f"{prefix}token_rate"), getattr(args, f"{prefix}jitter"), getattr(args, f"{prefix}error_rate"), load_time=getattr(args, f"{prefix}load_time"), parallel=getattr(args, f"{prefix}parallel"))
+
+# Keeps track of the single model resident in memory, switching to another model costs the simulated load time
+class StubResidency:
+    load_time: float
+    resident: str|None = None
+    lock: threading.Lock
+
+    def __init__(self, load_time: float):
+        self.load_time = load_time
+        self.lock = threading.Lock()
+
+    # Load the model if it is not resident yet and return the time it took
+    def ensure_loaded(self, model: str) -> float:
+        with self.lock:
+            if self.resident == model:
+                return 0
+
+            time.sleep(self.load_time)
+            self.resident = model
+
+            return self.load_time
+
+    def unload(self, model: str):
+        with self.lock:
+            if self.resident == model:
+                self.resident = None
+
+# Counters of the requests served by a stand-in server
+class StubStats:
+    requests: int = 0
+    errors: int = 0
+    busy_time: float = 0
+    lock: threading.Lock
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    def record(self, duration: float, error: bool = False):
+        with self.lock:
+            self.requests += 1
+            self.busy_time += duration
+            if error:
+                self.errors += 1
+
+# Handles the subset of the Ollama API used by the project: generate, show, tags and version
+class StubRequestHandler(BaseHTTPRequestHandler):
+    server: "StubServer"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    # A stopped server drops every request, also on connections kept alive from before it was stopped
+    def parse_request(self) -> bool:
+        if self.server.stopped:
+            self.close_connection = True
+            return False
+
+        return super().parse_request()
+
+    def send_json(self, status: int, body: dict):
+        data = json.dumps(body).encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length", 0))
+
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        if self.path == "/api/version":
+            self.send_json(200, {"version": "0.0.0-stub"})
+        elif self.path == "/api/tags":
+            self.send_json(200, {"models": [{"name": name, "model": name} for name in self.server.models]})
+        elif self.path == "/":
+            self.send_json(200, {"status": "Ollama is running"})
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        body = self.read_json()
+
+        if self.path == "/api/show":
+            if self.server.serves(body.get("model", "")):
+                self.send_json(200, {"modelfile": "", "parameters": "", "template": "{{ .Prompt }}", "details": {"family": "stub"}, "model_info": {}, "capabilities": ["completion"]})
+            else:
+                self.send_json(404, {"error": f"model '{body.get('model')}' not found"})
+        elif self.path == "/api/generate":
+            self.generate(body)
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    # Final message of a generation, with the statistics Ollama reports (durations in nanoseconds)
+    def done_message(self, model: str, prompt: str, text: str, tokens: int, first_token: float, total: float, load: float) -> dict:
+        return {
+            "model": model,
+            "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "response": text,
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": int(total * 1e9),
+            "load_duration": int(load * 1e9),
+            "prompt_eval_count": len(prompt.split()),
+            "prompt_eval_duration": int(first_token * 1e9),
+            "eval_count": tokens,
+            "eval_duration": int(max(total - load - first_token, 0) * 1e9)
+        }
+
+    def generate(self, body: dict):
+        model = body.get("model", "")
+        prompt = body.get("prompt") or ""
+        # Ollama streams by default
+        stream = body.get("stream", True)
+
+        if not self.server.serves(model):
+            self.send_json(404, {"error": f"model '{model}' not found"})
+            return
+
+        # A keep alive of zero unloads the model, as Ollama does
+        if body.get("keep_alive") == 0:
+            self.server.residency.unload(model)
+            self.send_json(200, {"model": model, "response": "", "done": True, "done_reason": "unload"})
+            return
+
+        # Wait for a free slot, like requests queue on a busy Ollama server
+        with self.server.slots:
+            start = time.perf_counter()
+
+            try:
+                load = self.server.residency.ensure_loaded(model)
+                tokens = self.server.profile.stream(model, prompt)
+
+                if stream:
+                    self.stream_tokens(model, prompt, tokens, start, load)
+                else:
+                    text = ""
+                    first_token = None
+                    count = 0
+
+                    for token, elapsed in tokens:
+                        first_token = elapsed if first_token is None else first_token
+                        text += token
+                        count += 1
+
+                    total = time.perf_counter() - start
+                    self.send_json(200, self.done_message(model, prompt, text, count, first_token or 0, total, load))
+
+                self.server.stats.record(time.perf_counter() - start)
+            except InjectedError as e:
+                self.server.stats.record(time.perf_counter() - start, error=True)
+                self.send_json(500, {"error": str(e)})
+            except (BrokenPipeError, ConnectionResetError):
+                # The client closed the connection of a cancelled generation, Ollama stops generating then as well
+                self.server.stats.record(time.perf_counter() - start)
+                self.close_connection = True
+
+    # Send every token as its own newline delimited JSON message, like Ollama does when streaming
+    def stream_tokens(self, model: str, prompt: str, tokens, start: float, load: float):
+        started = False
+        first_token = None
+        count = 0
+
+        for token, elapsed in tokens:
+            if not started:
+                self.start_stream()
+                started = True
+                first_token = elapsed
+
+            count += 1
+            self.write_chunk({"model": model, "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(), "response": token, "done": False})
+
+        if not started:
+            self.start_stream()
+
+        total = time.perf_counter() - start
+        self.write_chunk(self.done_message(model, prompt, "", count, first_token or 0, total, load))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def start_stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def write_chunk(self, message: dict):
+        data = json.dumps(message).encode("utf-8") + b"\n"
+
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+# Ollama compatible HTTP server backed by the stand-in model, runs in a background thread
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    profile: StubProfile
+    models: list[str]
+    stats: StubStats
+    residency: StubResidency
+    slots: contextlib.AbstractContextManager
+    stopped: bool = False
+    thread: threading.Thread|None = None
+
+    def __init__(self, profile: StubProfile, models: list[str], host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), StubRequestHandler)
+        self.profile = profile
+        self.models = models
+        self.stats = StubStats()
+        self.residency = StubResidency(profile.load_time)
+        self.slots = profile.slots()
+
+    # Check if the server answers for a model, with or without a tag
+    def serves(self, model: str) -> bool:
+        return model in self.models or model.split(":")[0] in self.models
+
+    # Address to use as Ollama host
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubServer":
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+        return self
+
+    def stop(self):
+        self.stopped = True
+        self.shutdown()
+        self.server_close()
+
+parser = argparse.ArgumentParser(description="Run a deterministic Ollama compatible stand-in server.")
+
+parser.add_argument("--host", type=str, default="127.0.0.1", help="The address to listen on.")
+parser.add_argument("--port", type=int, default=11435, help="The port to listen on.")
+parser.add_argument("--models", type=str, nargs="+", default=["mistral", "codellama", "phi3.5"], help="The model names the server answers for.")
+parser.add_argument("--length", type=int, default=8, help="The number of tokens in every generated message.")
+parser.add_argument("--seed", type=int, default=0, help="The seed of the simulated jitter and errors.")
+StubProfile.add_arguments(parser)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    profile = StubProfile.from_args(args)
+    profile.length = args.length
+    profile.seed = args.seed
+
+    server = StubServer(profile, args.models, args.host, args.port)
+    print(f"Stand-in Ollama server listening on {server.url}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
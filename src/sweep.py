@@ -0,0 +1,165 @@
+import json
+import os
+import time
+from itertools import groupby
+from typing import Callable
+
+from pandas import DataFrame
+
+from backends import Backend
+from dataset import read_table
+
+# Axes of the results grid, named after the matching main.py arguments
+AXES = ["model", "prompt", "temperature"]
+
+# A single cell of the results grid, with the time it took to generate
+class SweepCell:
+    model: str
+    prompt: str
+    temperature: float
+    items: int = 0
+    wall_time: float = 0
+    load_time: float = 0
+
+    def __init__(self, model: str, prompt: str, temperature: float):
+        self.model = model
+        self.prompt = prompt
+        self.temperature = temperature
+
+    def __str__(self):
+        return f"{self.model} {self.prompt} {self.temperature}"
+
+# Parse a grid spec, either a JSON file with a list per axis or inline as "model=mistral,phi3.5;prompt=fewshot;temperature=0.0,0.7".
+# Axes missing from the spec use the given defaults.
+def parse_grid(spec: str, defaults: dict[str, list]) -> dict[str, list]:
+    grid = dict(defaults)
+
+    if os.path.isfile(spec):
+        with open(spec, "r", encoding="utf-8") as f:
+            values = json.load(f)
+    else:
+        values = {}
+
+        for part in spec.split(";"):
+            if not part.strip():
+                continue
+
+            key, _, value = part.partition("=")
+            values[key.strip()] = [item.strip() for item in value.split(",") if item.strip()]
+
+    for key, value in values.items():
+        if key not in AXES:
+            raise ValueError(f"Unknown sweep axis '{key}', expected one of {', '.join(AXES)}")
+
+        grid[key] = value if isinstance(value, list) else [value]
+
+    grid["temperature"] = [float(temperature) for temperature in grid["temperature"]]
+
+    return grid
+
+# Runs every cell of a models × prompts × temperatures grid in one process.
+# Cells are ordered by model, so every model is loaded once and stays resident while all its prompts and temperatures run,
+# and every input file is read once for all its temperatures.
+class Sweep:
+    cells: list[SweepCell]
+    backend: Backend
+    create_experiment: Callable
+    sequential: bool
+    inputs: dict[str, DataFrame]
+    model_load_times: dict[str, float]
+
+    def __init__(self, grid: dict[str, list], backend: Backend, create_experiment: Callable, sequential: bool = False):
+        self.backend = backend
+        self.create_experiment = create_experiment
+        self.sequential = sequential
+        self.inputs = {}
+        self.model_load_times = {}
+        self.cells = [
+            SweepCell(model, prompt, temperature)
+            for model in grid["model"]
+            for prompt in grid["prompt"]
+            for temperature in grid["temperature"]
+        ]
+
+    # Read an input file once and share it between all cells using it
+    def read_input(self, input_file: str) -> DataFrame:
+        if input_file not in self.inputs:
+            self.inputs[input_file] = read_table(input_file)
+
+        return self.inputs[input_file]
+
+    # Load a model ahead of its cells, so the load is not counted in the first cell
+    def load_model(self, experiment, model: str):
+        experiment.check_installed()
+
+        start = time.time()
+        reported = self.backend.load(model)
+
+        self.model_load_times[model] = max(reported, time.time() - start)
+        print(f"Loaded {model} in {self.model_load_times[model]:.2f}s")
+
+    def run_cell(self, cell: SweepCell):
+        experiment = self.create_experiment(cell.model, cell.prompt, cell.temperature)
+        experiment.input_df = self.read_input(experiment.input_file)
+
+        print(f"Running {cell}")
+
+        start = time.time()
+
+        if self.sequential:
+            experiment.run()
+        else:
+            experiment.run_parallel()
+
+        cell.wall_time = time.time() - start
+        cell.load_time = experiment.load_time
+        cell.items = len(experiment.output_df)
+
+        experiment.save_output()
+
+    def run(self):
+        previous_model = None
+
+        for model, cells in groupby(self.cells, key=lambda cell: cell.model):
+            cells = list(cells)
+
+            # Free the memory of the previous model before loading the next one
+            if previous_model is not None:
+                self.backend.unload(previous_model)
+
+            self.load_model(self.create_experiment(model, cells[0].prompt, cells[0].temperature), model)
+
+            for cell in cells:
+                self.run_cell(cell)
+
+            previous_model = model
+
+    # Per cell wall time and model load overhead, the initial load of every model is reported on its first cell
+    def report(self) -> DataFrame:
+        rows = []
+        reported_models = set()
+
+        for cell in self.cells:
+            initial_load = 0 if cell.model in reported_models else self.model_load_times.get(cell.model, 0)
+            reported_models.add(cell.model)
+
+            rows.append({
+                "model": cell.model,
+                "prompt": cell.prompt,
+                "temperature": cell.temperature,
+                "items": cell.items,
+                "wall_time": cell.wall_time,
+                "model_load_time": initial_load + cell.load_time,
+                "items_per_second": cell.items / cell.wall_time if cell.wall_time > 0 else 0
+            })
+
+        return DataFrame(rows)
+
+    def save_report(self, output_file: str):
+        report = self.report()
+        report.to_csv(output_file, index=False)
+
+        print(report.to_string(index=False))
+        # Initial loads happen outside of the cells, loads during a cell are part of its wall time
+        total = report['wall_time'].sum() + sum(self.model_load_times.values())
+        print(f"Total {total:.2f}s of which {report['model_load_time'].sum():.2f}s loading models")
@@ -0,0 +1,224 @@
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from backends import Backend, add_backend_arguments, create_backend
+from cancellation import CancellationToken, Cancelled, use_token
+from message_cache import MessageCache, MessageKey, default_cache_folder
+from prompt_template import extension_prompt
+
+# Run a git command in the repository and return its output
+def git(repo: str, *args: str) -> str:
+    return subprocess.run(["git", *args], cwd=repo, capture_output=True, check=True).stdout.decode("utf-8", errors="replace")
+
+def git_dir(repo: str) -> str:
+    return os.path.join(repo, git(repo, "rev-parse", "--git-dir").strip())
+
+def staged_files(repo: str) -> list[str]:
+    return [file for file in git(repo, "diff", "--name-only", "--cached").split("\n") if file.strip()]
+
+# The staged diff of a single file, exactly as the extension reads it
+def staged_diff(repo: str, file: str) -> str:
+    return git(repo, "diff", "--cached", "--", file)
+
+# Polls the git index and reports a change once the index stopped changing for the debounce time,
+# so staging many files at once results in a single change
+class IndexWatcher:
+    index_file: str
+    poll_interval: float
+    debounce: float
+    current: tuple|None
+
+    def __init__(self, index_file: str, poll_interval: float = 0.5, debounce: float = 1):
+        self.index_file = index_file
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.current = self.signature()
+
+    def signature(self) -> tuple|None:
+        try:
+            stat = os.stat(self.index_file)
+        except FileNotFoundError:
+            return None
+
+        return (stat.st_mtime_ns, stat.st_size)
+
+    # Wait for the next debounced change, returns False when stopped
+    def wait_for_change(self, stopped: threading.Event) -> bool:
+        last = self.current
+        changed_at = None
+
+        while not stopped.wait(self.poll_interval):
+            signature = self.signature()
+
+            if signature != last:
+                last = signature
+                changed_at = time.time()
+            elif changed_at is not None and time.time() - changed_at >= self.debounce:
+                self.current = signature
+                return True
+
+        return False
+
+# Generates the messages of the staged files in the background and stores them in the message cache.
+# Work for content that is no longer staged is cancelled, also while it is generating, and results that went stale
+# while generating are thrown away.
+class PreGenerator:
+    repo: str
+    backend: Backend
+    cache: MessageCache
+    model: str
+    temperature: float
+    cache_size: int
+    executor: ThreadPoolExecutor
+    staged: dict[str, str]
+    pending: dict[str, tuple[str, Future, CancellationToken]]
+    lock: threading.Lock
+    generated: int = 0
+    discarded: int = 0
+    cancelled: int = 0
+    skipped: int = 0
+
+    def __init__(self, repo: str, backend: Backend, cache: MessageCache, model: str, temperature: float, workers: int = 1, cache_size: int = 1000):
+        self.repo = repo
+        self.backend = backend
+        self.cache = cache
+        self.model = model
+        self.temperature = temperature
+        self.cache_size = cache_size
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.staged = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def is_current(self, key: MessageKey) -> bool:
+        return self.staged.get(key.file) == key.diff_hash
+
+    # Read the staged files and queue the ones without a message
+    def refresh(self):
+        keys = {}
+
+        for file in staged_files(self.repo):
+            diff = staged_diff(self.repo, file)
+
+            if diff.strip():
+                keys[file] = (MessageKey(file, diff, self.model), diff)
+
+        with self.lock:
+            self.staged = {file: key.diff_hash for file, (key, _) in keys.items()}
+
+            for file, (diff_hash, future, token) in list(self.pending.items()):
+                if self.staged.get(file) != diff_hash:
+                    future.cancel()
+                    token.cancel()
+                    del self.pending[file]
+
+            for file, (key, diff) in keys.items():
+                if file in self.pending or key in self.cache:
+                    continue
+
+                token = CancellationToken()
+                self.pending[file] = (key.diff_hash, self.executor.submit(self.generate, key, diff, token), token)
+
+        print(f"{len(keys)} staged files, {len(self.pending)} queued", file=sys.stderr)
+
+    def generate(self, key: MessageKey, diff: str, token: CancellationToken):
+        claimed = False
+
+        try:
+            if not self.is_current(key):
+                return
+
+            # runExtension.py is generating the same message, it stores it in the cache itself
+            claimed = self.cache.claim(key)
+            if not claimed:
+                with self.lock:
+                    self.skipped += 1
+
+                print(f"Skipped the message of {key.file}, another process is generating it", file=sys.stderr)
+                return
+
+            if key in self.cache:
+                return
+
+            with use_token(token):
+                generation = self.backend.generate(self.model, extension_prompt(key.file, diff), {"temperature": self.temperature})
+
+            with self.lock:
+                if not self.is_current(key):
+                    self.discarded += 1
+                    print(f"Discarded the message of {key.file}, it changed while generating", file=sys.stderr)
+                    return
+
+                # An empty message would be returned from the cache forever instead of generating it again
+                if not generation.text.strip():
+                    print(f"Did not cache the empty message of {key.file}", file=sys.stderr)
+                    return
+
+                self.cache.put(key, generation.text)
+                self.cache.prune(self.cache_size)
+                self.generated += 1
+
+            print(f"Generated the message of {key.file}", file=sys.stderr)
+        except Cancelled:
+            with self.lock:
+                self.cancelled += 1
+
+            print(f"Cancelled the message of {key.file}, it changed while generating", file=sys.stderr)
+        except Exception as e:
+            print(f"Error generating the message of {key.file}: {e}", file=sys.stderr)
+        finally:
+            if claimed:
+                self.cache.release(key)
+
+            with self.lock:
+                if self.pending.get(key.file, ("", None, None))[0] == key.diff_hash:
+                    del self.pending[key.file]
+
+    def close(self):
+        with self.lock:
+            for _, _, token in self.pending.values():
+                token.cancel()
+
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+parser = argparse.ArgumentParser(description="Pre-generate the commit messages of staged files in the background whenever the git index changes.")
+
+parser.add_argument("--repo", type=str, default=".", help="The repository to watch.")
+parser.add_argument("--model", type=str, default="mistral", help="The model to generate with, the same as runExtension.py.")
+parser.add_argument("--temperature", type=float, default=0.7, help="Model generation temperature.")
+parser.add_argument("--cache_folder", type=str, default=None, help="The message cache shared with runExtension.py (defaults to .git/commit_message_cache).")
+parser.add_argument("--cache_size", type=int, default=1000, help="The number of messages kept in the cache.")
+parser.add_argument("--poll_interval", type=float, default=0.5, help="The seconds between two checks of the git index.")
+parser.add_argument("--debounce", type=float, default=1, help="The seconds the index has to stay unchanged before generating.")
+parser.add_argument("--workers", type=int, default=1, help="The number of messages generated at the same time.")
+parser.add_argument("--nice", type=int, default=10, help="Lower the CPU priority of the watcher by this amount, so interactive work goes first.")
+add_backend_arguments(parser)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    if hasattr(os, "nice") and args.nice > 0:
+        os.nice(args.nice)
+
+    backend = create_backend(args)
+    cache = MessageCache(args.cache_folder or default_cache_folder(git_dir(args.repo)))
+    generator = PreGenerator(args.repo, backend, cache, args.model, args.temperature, args.workers, args.cache_size)
+    watcher = IndexWatcher(os.path.join(git_dir(args.repo), "index"), args.poll_interval, args.debounce)
+    stopped = threading.Event()
+
+    try:
+        generator.refresh()
+
+        while watcher.wait_for_change(stopped):
+            generator.refresh()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        generator.close()
+        backend.close()
+        print(f"Generated {generator.generated} messages, discarded {generator.discarded} stale messages, cancelled {generator.cancelled} while generating, skipped {generator.skipped} generated by another process", file=sys.stderr)